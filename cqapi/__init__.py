@@ -1 +1,2 @@
 from cqapi.api import ConqueryConnection
+from cqapi.async_api import AsyncConqueryConnection
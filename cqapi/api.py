@@ -1,20 +1,38 @@
 import csv
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from datetime import timedelta
 from io import StringIO
-from time import sleep
-from typing import Union, List, Dict, NoReturn
+from tempfile import NamedTemporaryFile
+from time import sleep, monotonic
+from types import MappingProxyType
+from typing import Union, List, Dict, NoReturn, Iterator, Tuple, BinaryIO, Optional
+from weakref import WeakSet
 
+import attr
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
+from urllib3.util.retry import Retry
+import numpy as np
 import pandas as pd
 import pyarrow as pa
 
 import cqapi.datasets
+from cqapi.cache import ResultCache, ConceptsCache, StoredQueriesCache, QueryRegistry
 from cqapi.conquery.api import ConqueryApiUrls
 from cqapi.conquery_ids import get_dataset_from_id_string, ConqueryId
-from cqapi.exceptions import QueryNotFoundError
+from cqapi.exceptions import QueryNotFoundError, QueryTimeoutError
 from cqapi.queries.utils import get_dataset_from_query
 from cqapi.queries.base_elements import QueryObject
+from cqapi.queries.serialization import canonical_json, dumps
+from cqapi.temporary import TemporaryQueries
+from cqapi.waiter import QueryWaiter, query_is_running
 
 
 def raise_for_status(response: Response) -> Union[None, NoReturn]:
@@ -32,21 +50,235 @@ def raise_for_status(response: Response) -> Union[None, NoReturn]:
     raise HTTPError(http_error_msg, response=response)
 
 
+def query_to_dict(query: Union[dict, QueryObject]) -> dict:
+    try:
+        return query.to_dict()  # type:ignore
+    except AttributeError:
+        if not isinstance(query, dict):
+            raise TypeError(f"{query=} must be of type dict or QueryObject with method write_query")
+        return query
+
+
+def query_to_json(query: Union[dict, QueryObject], query_dict: dict = None) -> bytes:
+    """Body to post for query: query objects as canonical json of a fresh to_dict, dicts as they are.
+    query_dict is query_to_dict(query) if it was already computed."""
+    if query_dict is None:
+        query_dict = query_to_dict(query)
+    return canonical_json(query_dict) if isinstance(query, QueryObject) else dumps(query_dict)
+
+
+def get_executed_query_id(result: dict) -> str:
+    try:
+        return result['id']
+    except KeyError:
+        raise ValueError("Error encountered when executing query", result.get('message'), result.get('details'))
+
+
+def remove_structure_elements_from_concepts(concepts: dict) -> dict:
+    return {concept_id: concept for (concept_id, concept) in concepts.items() if concept.get('active')}
+
+
+def check_result_status(query_id: str, query_info: dict) -> None:
+    """Raises if the query with query_info is not DONE after waiting for it"""
+    response_status = query_info["status"]
+
+    if response_status == "FAILED":
+        raise Exception(f"Query with {query_id=} failed.")
+    elif response_status == "NEW":
+        raise Exception(f"Query {query_id} still in state NEW after reexecuting..")
+    elif response_status != "DONE":
+        raise ValueError(f"Unknown response status {response_status}")
+
+
+result_return_types = ["pandas", "arrow", "numpy"]
+
+
+def get_result_return_type(return_type: Optional[str], return_pandas: bool, file_format: str) -> str:
+    """Maps the legacy return_pandas flag to a return type. Arrow results were always returned as pandas."""
+    if return_type is None:
+        return "pandas" if return_pandas or file_format == "arrow" else "list"
+
+    if return_type not in result_return_types:
+        raise ValueError(f"Unknown {return_type=}. Must be in {result_return_types}")
+    return return_type
+
+
+def convert_arrow_table(table: pa.Table, return_type: str = "pandas") \
+        -> Union[pd.DataFrame, pa.Table, Dict[str, np.ndarray]]:
+    """Converts table to the return type. numpy returns a dict from column name to numpy array."""
+    if return_type == "pandas":
+        return table.to_pandas(date_as_object=False)
+    if return_type == "arrow":
+        return table
+    if return_type == "numpy":
+        return {column_name: table.column(column_name).to_numpy() for column_name in table.column_names}
+    raise ValueError(f"Unknown {return_type=}. Must be in {result_return_types}")
+
+
+@attr.s(auto_attribs=True)
+class DeletionReport:
+    """Result of ConqueryConnection.delete_stored_queries"""
+    deleted: List[str] = attr.ib(factory=list)
+    # query id -> error message
+    failed: Dict[str, str] = attr.ib(factory=dict)
+    elapsed: float = 0.0
+    # nothing was deleted, deleted lists the queries that would have been deleted
+    dry_run: bool = False
+
+    @property
+    def throughput(self) -> float:
+        """Deletion requests per second"""
+        n_requests = len(self.deleted) + len(self.failed)
+        return n_requests / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def filter_query_infos(query_infos: List[dict], label_pattern: str = None, older_than: timedelta = None) -> List[dict]:
+    """Query infos (as returned by get_stored_queries) whose label matches label_pattern (re.search) and that were
+    created more than older_than ago"""
+    if label_pattern is not None:
+        pattern = re.compile(label_pattern)
+        query_infos = [query_info for query_info in query_infos
+                       if query_info.get("label") is not None and pattern.search(query_info["label"])]
+
+    if older_than is not None:
+        def created_before_limit(query_info: dict) -> bool:
+            if query_info.get("createdAt") is None:
+                return False
+            created_at = pd.Timestamp(query_info["createdAt"])
+            return pd.Timestamp.now(tz=created_at.tz) - created_at > older_than
+
+        query_infos = [query_info for query_info in query_infos if created_before_limit(query_info)]
+
+    return query_infos
+
+
+def get_saved_query_ids(query: dict) -> List[str]:
+    """Ids of the queries referenced by SAVED_QUERY nodes of query, each id once in order of appearance"""
+    query_ids = dict()
+    stack = [query]
+    while stack:
+        node = stack.pop()
+        if "root" in node:
+            stack.append(node["root"])
+        elif "child" in node:
+            stack.append(node["child"])
+        elif "children" in node:
+            stack.extend(reversed(node["children"]))
+        elif node["type"] == "SAVED_QUERY":
+            query_ids[node["query"]] = None
+    return list(query_ids)
+
+
+def replace_saved_queries(query: dict, roots: Dict[str, dict], _path: Tuple[str, ...] = ()) -> dict:
+    """Copy of query with SAVED_QUERY nodes replaced by the (exploded) root of the referenced query in roots"""
+    if "root" in query:
+        return {**query, "root": replace_saved_queries(query["root"], roots, _path)}
+    if "child" in query:
+        return {**query, "child": replace_saved_queries(query["child"], roots, _path)}
+    if "children" in query:
+        return {**query, "children": [replace_saved_queries(child, roots, _path) for child in query["children"]]}
+    if query["type"] == "SAVED_QUERY":
+        query_id = query["query"]
+        if query_id in _path:
+            raise ValueError(f"Saved queries reference each other in a cycle: {' -> '.join([*_path, query_id])}")
+        return replace_saved_queries(roots[query_id], roots, (*_path, query_id))
+    return deepcopy(query)
+
+
+def read_arrow_result(content: Union[bytes, pa.NativeFile], return_type: str = "pandas"):
+    return convert_arrow_table(pa.ipc.open_file(content).read_all(), return_type=return_type)
+
+
+def split_record_batch(batch: pa.RecordBatch, max_rows: int = None) -> Iterator[pa.RecordBatch]:
+    """Zero-copy slices of batch with at most max_rows rows"""
+    if max_rows is None or batch.num_rows <= max_rows:
+        yield batch
+        return
+
+    for offset in range(0, batch.num_rows, max_rows):
+        yield batch.slice(offset, max_rows)
+
+
+def read_csv_result(result_string: str, return_type: str = "pandas"):
+    """Reads a conquery csv result with all columns as strings. "list" returns a list of rows"""
+    if return_type == "list":
+        return list(csv.reader(result_string.splitlines(), delimiter=';'))
+
+    data = pd.read_csv(StringIO(result_string), sep=";", dtype=str, keep_default_na=False)
+    if return_type == "pandas":
+        return data
+    return convert_arrow_table(pa.Table.from_pandas(data, preserve_index=False), return_type=return_type)
+
+
 class ConqueryConnectionSession:
     """Session object to communicate with conquery.
-    This could be a bundle of static methods if it wasn't for the token update in the header"""
+    This could be a bundle of static methods if it wasn't for the token update in the header
+
+    The session can be used from several threads at the same time: each thread gets its own requests.Session,
+    all of them share one pool of keep-alive connections per host. Idempotent requests (GET, DELETE, ...) are
+    retried with exponential backoff on connection errors and on 502, 503 and 504 responses.
+
+    :param timeout: seconds to wait for a connection and seconds to wait for data from the server,
+                    as (connect, read) tuple or one number for both. None waits forever.
+    :param pool_maxsize: connections kept alive per host, should be at least the number of threads using the session
+    :param retries: maximal number of retries of a request
+    :param backoff_factor: retries wait backoff_factor * 2 ** (retry - 1) seconds
+    """
+    retry_status_codes = (502, 503, 504)
+    retry_methods = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+    def __init__(self, token: str, timeout: Union[float, Tuple[float, float], None] = (5, 60),
+                 pool_maxsize: int = 10, retries: int = 3, backoff_factor: float = 0.5):
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # sessions of threads that ended are dropped together with their thread local data
+        self._sessions: WeakSet = WeakSet()
+        self._adapter = self._new_adapter()
+        self._set_token(token)
+
+    def _new_adapter(self) -> HTTPAdapter:
+        retry = Retry(total=self.retries, connect=self.retries, read=self.retries, status=self.retries,
+                      status_forcelist=self.retry_status_codes, allowed_methods=self.retry_methods,
+                      backoff_factor=self.backoff_factor, raise_on_status=False)
+        return HTTPAdapter(pool_connections=self.pool_maxsize, pool_maxsize=self.pool_maxsize, max_retries=retry)
 
-    def __init__(self, token: str):
-        self.token: str = token
-        self._session = requests.session()
-        self._session.headers.update(self.header)
+    @property
+    def _session(self) -> requests.Session:
+        """requests.Session of the current thread with the current headers"""
+        session: Optional[requests.Session] = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            with self._lock:
+                self._sessions.add(session)
+
+        headers = self._headers
+        if getattr(self._local, "headers", None) is not headers:
+            session.headers.update(headers)
+            self._local.headers = headers
+        return session
 
     def open(self):
         self.close()
-        self._session = requests.session()
+        self._adapter = self._new_adapter()
 
     def close(self):
-        self._session.close()
+        with self._lock:
+            sessions, self._sessions = list(self._sessions), WeakSet()
+            # sessions of other threads are dropped on their next request
+            self._local = threading.local()
+        for session in sessions:
+            session.close()
+        self._adapter.close()
+
+    @property
+    def token(self) -> str:
+        return self._token
 
     @property
     def header(self):
@@ -54,28 +286,48 @@ class ConqueryConnectionSession:
                 'Accept-Language': 'de-DE,de;q=0.9',
                 'pretty': 'false'}
 
+    def _set_token(self, token: str):
+        # token and headers are replaced together, every thread picks up the new headers with its next request
+        with self._lock:
+            self._token = token
+            self._headers = MappingProxyType(self.header)
+
     def update_token(self, new_token: str):
-        self.token = new_token
-        self._session.headers.update(self.header)
+        self._set_token(new_token)
 
     # Basic Request-Methods
-    def get(self, url, params: dict = None):
-        with self._session.get(url, params=params) as response:
+    def get(self, url, params: dict = None, headers: dict = None):
+        with self._session.get(url, params=params, headers=headers, timeout=self.timeout) as response:
             raise_for_status(response)
             return response
 
     def post(self, url, data):
-        with self._session.post(url=url, json=data) as response:
+        """Posts data as json, bytes are sent as they are as json body"""
+        if isinstance(data, bytes):
+            request = self._session.post(url=url, data=data, headers={"Content-Type": "application/json"},
+                                         timeout=self.timeout)
+        else:
+            request = self._session.post(url=url, json=data, timeout=self.timeout)
+        with request as response:
             raise_for_status(response)
             return response.json()
 
     def patch(self, url, data):
-        with self._session.patch(url, json=data) as response:
+        with self._session.patch(url, json=data, timeout=self.timeout) as response:
             raise_for_status(response)
             return response.json()
 
+    def download(self, url, file: BinaryIO, chunk_size: int = 1024 * 1024) -> int:
+        """Streams the response body into file chunk by chunk and returns the number of bytes written"""
+        n_bytes = 0
+        with self._session.get(url, stream=True, timeout=self.timeout) as response:
+            raise_for_status(response)
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                n_bytes += file.write(chunk)
+        return n_bytes
+
     def delete(self, url):
-        with self._session.delete(url) as response:
+        with self._session.delete(url, timeout=self.timeout) as response:
             raise_for_status(response)
             return response.text
 
@@ -88,28 +340,74 @@ class ConqueryConnectionSession:
 
 
 class ConqueryConnection(object):
+    """Connection to conquery for one user.
+
+    A connection can be shared by the threads of a pool: requests run on per-thread sessions with a common
+    connection pool (see pool_maxsize), update_token replaces the token atomically for all threads and the
+    datasets with permission are kept per connection. Use change_dataset only while no other thread relies on the
+    default dataset, or pass the dataset explicitly.
+    """
     _dataset = None
 
     def __init__(self, url: str, token: str = "",
-                 requests_timout: int = 5, dataset: str = None):
+                 requests_timout: int = 5, dataset: str = None, waiter: QueryWaiter = None,
+                 result_cache: ResultCache = None, concepts_ttl: Optional[float] = 600,
+                 stored_queries_ttl: Optional[float] = 60, read_timeout: Optional[float] = 60,
+                 pool_maxsize: int = 10, retries: int = 3, temporary_query_max_age: Optional[float] = None,
+                 query_registry: QueryRegistry = None):
+        """
+        :param requests_timout: seconds to wait for a connection to conquery
+        :param read_timeout: seconds to wait for data from conquery before a request fails. None waits forever.
+        :param pool_maxsize: connections to conquery kept alive, should be at least the number of threads that
+                             use the connection
+        :param retries: idempotent requests are retried with backoff on connection errors and 502, 503, 504
+        :param waiter: polling strategy used by all methods that block until a query is finished.
+                       Defaults to exponential backoff from 0.1s up to 5s between polls without deadline.
+        :param result_cache: optional on-disk cache for downloaded query results
+        :param concepts_ttl: seconds the responses of get_concepts and get_concept are reused before they are
+                             revalidated with the server. None disables caching of concepts.
+        :param stored_queries_ttl: seconds the index of stored queries used by get_query_id and
+                                   get_stored_query_info is reused before it is downloaded again.
+                                   None disables the index.
+        :param temporary_query_max_age: if set, every query executed through this connection is deleted from the
+                                        server by a background thread once it is older than this many seconds,
+                                        see temporary_queries and query_tracker
+        :param query_registry: optional registry of executed queries, execute_query returns the id of an
+                               identical query that is DONE instead of executing it again
+        """
 
         self.conquery_api_urls = ConqueryApiUrls(conquery_url=url.strip("/"))
         self._token = token
-        self._session: ConqueryConnectionSession = ConqueryConnectionSession(token=token)
-
         self._timeout: int = requests_timout
+        self._session: ConqueryConnectionSession = ConqueryConnectionSession(token=token,
+                                                                             timeout=(requests_timout, read_timeout),
+                                                                             pool_maxsize=pool_maxsize,
+                                                                             retries=retries)
+
+        self.waiter: QueryWaiter = waiter if waiter is not None else QueryWaiter()
+        self.result_cache: Optional[ResultCache] = result_cache
+        self.query_registry: Optional[QueryRegistry] = query_registry
+        self.concepts_cache: Optional[ConceptsCache] = ConceptsCache(ttl=concepts_ttl) \
+            if concepts_ttl is not None else None
+        self.stored_queries_cache: Optional[StoredQueriesCache] = StoredQueriesCache(ttl=stored_queries_ttl) \
+            if stored_queries_ttl is not None else None
         self._datasets_with_permission: List[str] = []
+        self._datasets_lock = threading.RLock()
+        self._trackers: List[TemporaryQueries] = []
+        self._trackers_lock = threading.Lock()
+        self.query_tracker: Optional[TemporaryQueries] = self.temporary_queries(max_age=temporary_query_max_age) \
+            if temporary_query_max_age is not None else None
 
         if token:
             self._set_up_datasets(dataset=dataset)
 
     def _set_up_datasets(self, dataset: str = None):
-        """Create new session and set datasets with permission globally"""
+        """Set datasets with permission of this connection and add them to the known datasets"""
+        with self._datasets_lock:
+            self._datasets_with_permission = self.get_datasets()
+            self.store_dataset_list_globally()
 
-        self._datasets_with_permission = self.get_datasets()
-        self.store_dataset_list_globally()
-
-        self._dataset = self._get_dataset(dataset)
+            self._dataset = self._get_dataset(dataset)
 
     def update_token(self, new_token: str):
         """Updates session token and own token (in case we make a new session)"""
@@ -117,14 +415,29 @@ class ConqueryConnection(object):
         self._session.update_token(new_token=new_token)
 
         # with user login this is the first time we have a token, so we set up the datasets
-        if not self._datasets_with_permission:
-            self._set_up_datasets()
+        with self._datasets_lock:
+            if not self._datasets_with_permission:
+                self._set_up_datasets()
 
     def change_dataset(self, dataset: str):
         self._dataset = self._get_dataset(dataset)
 
+    def temporary_queries(self, max_age: float = None, sweep_interval: float = 60) -> TemporaryQueries:
+        """Tracks all queries executed through this connection from now on, so they can be deleted later.
+        Used as context manager, the queries are deleted at the end of the with block. See TemporaryQueries."""
+        tracker = TemporaryQueries(self, max_age=max_age, sweep_interval=sweep_interval)
+        with self._trackers_lock:
+            self._trackers = [*self._trackers, tracker]
+        return tracker
+
+    def untrack_queries(self, tracker: TemporaryQueries) -> None:
+        with self._trackers_lock:
+            self._trackers = [other for other in self._trackers if other is not tracker]
+
     def store_dataset_list_globally(self):
-        cqapi.datasets.set_dataset_list(self._datasets_with_permission)
+        """Adds the datasets of this connection to the datasets known to the conquery ids (cqapi.datasets),
+        datasets of other connections are kept"""
+        cqapi.datasets.extend_dataset_list(self._datasets_with_permission)
 
     def _get_dataset(self, dataset: str = None) -> str:
 
@@ -143,8 +456,9 @@ class ConqueryConnection(object):
         return dataset
 
     def get_dataset(self) -> str:
-        if not self._dataset:
-            self._set_up_datasets()
+        with self._datasets_lock:
+            if not self._dataset:
+                self._set_up_datasets()
 
         if self._dataset is None:
             raise ValueError(f"No permission on any dataset")
@@ -177,19 +491,31 @@ class ConqueryConnection(object):
 
         return group_id in group_ids
 
+    def _get_concepts_json(self, url: str, dataset: str):
+        if self.concepts_cache is None:
+            return self._session.get_json(url)
+
+        return self.concepts_cache.get(url=url, dataset=dataset,
+                                       fetch=lambda headers: self._session.get(url, headers=headers))
+
+    def invalidate_concepts(self, dataset: str = None) -> None:
+        """Drops cached concepts of dataset (or all datasets), so they are downloaded again on next access"""
+        if self.concepts_cache is not None:
+            self.concepts_cache.invalidate(dataset=dataset)
+
     def get_concepts(self, dataset: str = None, remove_structure_elements: bool = True) -> dict:
+        """Returns the concepts of dataset. The result is cached, see concepts_ttl, and must not be modified."""
         dataset = self._get_dataset(dataset)
-        response = self._session.get_json(self.conquery_api_urls.concepts(dataset=dataset).parse())
+        response = self._get_concepts_json(self.conquery_api_urls.concepts(dataset=dataset).parse(), dataset)
 
         if remove_structure_elements:
-            return {concept_id: concept for (
-                concept_id, concept) in response['concepts'].items() if concept.get('active')}
+            return remove_structure_elements_from_concepts(response['concepts'])
 
         return response['concepts']
 
     def get_secondary_ids(self, dataset: str = None) -> list:
         dataset = self._get_dataset(dataset)
-        response = self._session.get_json(self.conquery_api_urls.concepts(dataset=dataset))
+        response = self._get_concepts_json(self.conquery_api_urls.concepts(dataset=dataset).parse(), dataset)
         return response['secondaryIds']
 
     def secondary_id_exists(self, secondary_id: str) -> bool:
@@ -199,21 +525,30 @@ class ConqueryConnection(object):
 
     def get_concept(self, concept_id: Union[str, ConqueryId],
                     return_raw_format: bool = False) -> dict:
+        """Returns the tree of a root concept. The result is cached, see concepts_ttl, and must not be modified."""
         if isinstance(concept_id, ConqueryId):
             concept_id = concept_id.id
 
-        response_dict = self._session.get_json(self.conquery_api_urls.concept_id(concept_id=concept_id).parse())
+        response_dict = self._get_concepts_json(self.conquery_api_urls.concept_id(concept_id=concept_id).parse(),
+                                                get_dataset_from_id_string(concept_id))
 
         return response_dict
 
     def get_stored_queries(self, dataset: str = None) -> list:
         dataset = self._get_dataset(dataset)
         response_list = self._session.get_json(self.conquery_api_urls.queries(dataset=dataset).parse())
+        if self.stored_queries_cache is not None:
+            self.stored_queries_cache.put(dataset, response_list)
         return response_list
 
     def get_query_id(self, label: str, dataset: str = None) -> str:
-        queries = self.get_stored_queries(dataset=dataset)
-        queries_with_label = [query["id"] for query in queries if query["label"] == label]
+        dataset = self._get_dataset(dataset)
+        if self.stored_queries_cache is not None:
+            queries_with_label = self.stored_queries_cache.get_ids(
+                dataset, label, fetch=lambda: self._session.get_json(self.conquery_api_urls.queries(dataset).parse()))
+        else:
+            queries_with_label = [query["id"] for query in self.get_stored_queries(dataset=dataset)
+                                  if query["label"] == label]
         if not queries_with_label:
             raise QueryNotFoundError
 
@@ -239,48 +574,112 @@ class ConqueryConnection(object):
         result = self._session.get_json(self.conquery_api_urls.query_id(query_id=query_id).parse())
         return result.get('query')
 
-    def explode_query(self, query: dict) -> dict:
-        if "root" in query:
-            query["root"] = self.explode_query(query=query["root"])
-        elif "child" in query:
-            query["child"] = self.explode_query(query=query["child"])
-        elif "children" in query:
-            for i, child_query in enumerate(query["children"]):
-                query["children"][i] = self.explode_query(query=child_query)
-        elif query["type"] == "SAVED_QUERY":
-            return self.get_query(query_id=query["query"])["root"]
-        return query
+    def explode_query(self, query: dict, max_workers: int = 8) -> dict:
+        """Returns a copy of query in which every SAVED_QUERY node is replaced by the root of the referenced query.
+
+        All referenced queries, also the ones referenced by referenced queries, are requested once and concurrently
+        with up to max_workers requests. query is not modified.
+        Raises ValueError if queries reference each other in a cycle.
+        """
+        roots: Dict[str, dict] = dict()
+        query_ids = get_saved_query_ids(query)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while query_ids:
+                new_roots = dict(zip(query_ids, executor.map(lambda query_id: self.get_query(query_id)["root"],
+                                                             query_ids)))
+                roots.update(new_roots)
+                query_ids = sorted({query_id for root in new_roots.values() for query_id in get_saved_query_ids(root)}
+                                   - roots.keys())
+
+        return replace_saved_queries(query, roots)
 
     def get_stored_query_info(self, query_id: str, label: str = None) -> dict:
-        dataset = get_dataset_from_id_string(query_id)
-        stored_queries = self.get_stored_queries(dataset)
-        if query_id is not None:
-            query_info = [query_info for query_info in stored_queries if query_info["id"] == query_id]
-            if not query_info:
-                raise ValueError(f"Could not find query with id {query_id}")
-        elif label is not None:
-            query_info = [query_info for query_info in stored_queries if query_info["label"] == label]
-            if not query_info:
+        if query_id is None and label is None:
+            raise ValueError(f"Neither query_id nor label is specified.")
+
+        if query_id is None:
+            try:
+                query_id = self.get_query_id(label=label)
+            except QueryNotFoundError:
                 raise ValueError(f"Could not find query with label {label}")
+
+        dataset = get_dataset_from_id_string(query_id)
+        if self.stored_queries_cache is not None:
+            query_info = self.stored_queries_cache.get_info(
+                dataset, query_id,
+                fetch=lambda: self._session.get_json(self.conquery_api_urls.queries(dataset).parse()))
         else:
-            raise ValueError(f"Neither query_id nor label is specified.")
+            query_info = next((query_info for query_info in self.get_stored_queries(dataset)
+                               if query_info["id"] == query_id), None)
+        if query_info is None:
+            raise ValueError(f"Could not find query with id {query_id}")
 
-        return query_info[0]
+        return query_info
 
     def delete_stored_query(self, query_id: str) -> None:
         self._session.delete(self.conquery_api_urls.query_id(query_id=query_id).parse())
+        for tracker in self._trackers:
+            tracker.keep(query_id)
+        if self.query_registry is not None:
+            self.query_registry.remove_query_id(query_id)
+        if self.stored_queries_cache is not None:
+            self.stored_queries_cache.remove(get_dataset_from_id_string(query_id), query_id)
+        if self.result_cache is not None:
+            self.result_cache.invalidate(query_id)
+
+    def delete_stored_queries(self, query_ids: List[str] = None, label_pattern: str = None,
+                              older_than: timedelta = None, dataset: str = None,
+                              max_workers: int = 8, dry_run: bool = False,
+                              all_queries: bool = False) -> DeletionReport:
+        """Deletes stored queries concurrently with up to max_workers requests and reports which were deleted.
+        Failed deletions do not stop the others, they are collected in the report.
+
+        :param query_ids: queries to delete. If not given, the stored queries of dataset that match the filters.
+        :param label_pattern: only delete queries whose label matches this regular expression (re.search)
+        :param older_than: only delete queries created more than older_than ago
+        :param dry_run: delete nothing, the report lists the queries that would be deleted
+        :param all_queries: has to be set to delete all stored queries of dataset without query_ids and filters
+        """
+        if max_workers < 1:
+            raise ValueError(f"{max_workers=} must be positive")
+        if query_ids is None and label_pattern is None and older_than is None and not all_queries:
+            raise ValueError("Give query_ids, label_pattern or older_than, or set all_queries=True to delete all "
+                             "stored queries of the dataset")
+
+        if label_pattern is not None or older_than is not None or query_ids is None:
+            query_infos = self.get_stored_queries(dataset=dataset)
+            if query_ids is not None:
+                query_id_set = set(query_ids)
+                query_infos = [query_info for query_info in query_infos if query_info["id"] in query_id_set]
+            query_ids = [query_info["id"] for query_info in filter_query_infos(query_infos,
+                                                                                label_pattern=label_pattern,
+                                                                                older_than=older_than)]
+
+        if dry_run:
+            return DeletionReport(deleted=list(query_ids), dry_run=True)
+
+        report = DeletionReport()
+        start = monotonic()
+
+        def delete(query_id: str):
+            try:
+                self.delete_stored_query(query_id=query_id)
+            except Exception as error:
+                report.failed[query_id] = str(error)
+            else:
+                report.deleted.append(query_id)
 
-    def delete_stored_queries(self, query_ids: List[str]):
-        for query_id in query_ids:
-            self.delete_stored_query(query_id=query_id)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(delete, query_ids))
+
+        report.elapsed = monotonic() - start
+        return report
 
     def get_number_of_results(self, query_id: str) -> int:
 
         self.reexecute_when_status_new(query_id=query_id)
 
-        self.wait_for_query_to_finish(query_id=query_id)
-
-        response = self.get_query_info(query_id)
+        response = self.wait_for_query_to_finish(query_id=query_id)
 
         n_results = response.get('numberOfResults')
         if n_results is None:
@@ -296,30 +695,30 @@ class ConqueryConnection(object):
             self.reexecute_query(query_id)
             sleep(0.5)
 
-    def wait_for_query_to_finish(self, query_id: str, requests_per_sec: int = None):
-        """Waits until query i finished and checks for NEW/FAILED"""
-        query_info = self.get_query_info(query_id)
+    def wait_for_query_to_finish(self, query_id: str, requests_per_sec: int = None,
+                                 waiter: QueryWaiter = None) -> dict:
+        """Waits until query is finished and checks for NEW/FAILED. Returns the last query info.
 
-        while query_info['status'] == 'RUNNING':
-            query_info = self.get_query_info(query_id)
-            if requests_per_sec is None:
-                continue
-            sleep(1 / requests_per_sec)
+        :param requests_per_sec: poll with a constant rate instead of the backoff of the connection waiter
+        :param waiter: overrides the waiter of the connection for this call
+        """
+        if waiter is None:
+            waiter = self.waiter if requests_per_sec is None else QueryWaiter.with_rate(requests_per_sec)
+
+        query_info = waiter.wait(lambda: self.get_query_info(query_id))
 
         if query_info['status'] in ["NEW", "FAILED"]:
             raise Exception(f"Query Status: {query_info['status']} for query {query_info['id']}")
 
+        return query_info
+
     def get_query_info(self, query_id: str):
         result = self._session.get_json(self.conquery_api_urls.query_id(query_id=query_id).parse())
         return result
 
     def query_succeeded(self, query_id: str) -> bool:
-        while True:
-            response = self.get_query_info(query_id)
-            if response["status"] == "DONE":
-                return True
-            if response["status"] in ["FAILED", "NEW"]:
-                return False
+        response = self.waiter.wait(lambda: self.get_query_info(query_id))
+        return response["status"] == "DONE"
 
     def get_query_label(self, query_id: str) -> str:
         query_info = self.get_query_info(query_id)
@@ -343,72 +742,235 @@ class ConqueryConnection(object):
 
     def execute_query(self, query: Union[dict, QueryObject], dataset: str = None,
                       label: str = None) -> str:
-        try:
-            query = query.to_dict()  # type:ignore
-        except AttributeError:
-            if not isinstance(query, dict):
-                raise TypeError(f"{query=} must be of type dict or QueryObject with method write_query")
+        """Executes query and returns its id.
+        With a query_registry, the id of an identical query that is already DONE is returned instead, unless label
+        differs from the label of that query. Registered queries are never relabeled."""
+        # body and registry key are built from the current state of query, lists and dicts of query objects can be
+        # modified in place
+        query_dict = query_to_dict(query)
+        body = query_to_json(query, query_dict)
 
         if dataset is None:
-            dataset = self._dataset if self._dataset is not None else get_dataset_from_query(query)
+            dataset = self._dataset if self._dataset is not None else get_dataset_from_query(query_dict)
 
-        result = self._session.post(self.conquery_api_urls.queries(dataset=dataset), query)
+        registry_key = self.query_registry.key(query_dict, dataset) if self.query_registry is not None else None
+        query_id = self._get_registered_query_id(registry_key, label) if registry_key is not None else None
 
-        try:
+        if query_id is None:
+            result = self._session.post(self.conquery_api_urls.queries(dataset=dataset), body)
+            query_id = get_executed_query_id(result)
+            if registry_key is not None:
+                self.query_registry.put(registry_key, query_id)
+
+            if self.stored_queries_cache is not None:
+                self.stored_queries_cache.add(dataset, query_id)
             if label is not None:
-                self._session.patch(self.conquery_api_urls.query_id(query_id=result['id']).parse(), {"label": label})
-            return result['id']
+                self._session.patch(self.conquery_api_urls.query_id(query_id=query_id).parse(), {"label": label})
+                if self.stored_queries_cache is not None:
+                    self.stored_queries_cache.set_label(dataset, query_id, label)
+        for tracker in self._trackers:
+            tracker.track(query_id)
+        return query_id
+
+    def _get_registered_query_id(self, registry_key: str, label: str = None) -> Optional[str]:
+        """Registered query id for registry_key if the query still exists, is DONE and has label (if given)"""
+        query_id = self.query_registry.get(registry_key)
+        if query_id is None:
+            return None
 
-        except KeyError:
-            raise ValueError("Error encountered when executing query", result.get('message'), result.get('details'))
+        try:
+            query_info = self.get_query_info(query_id)
+        except HTTPError:
+            query_info = dict()
+        if query_info.get("status") != "DONE":
+            self.query_registry.remove_query_id(query_id)
+            return None
+        if label is not None and query_info.get("label") != label:
+            return None
+        return query_id
 
     def reexecute_query(self, query_id: str) -> None:
         self._session.post(self.conquery_api_urls.query_reexecute(query_id=query_id), data="")
+        if self.result_cache is not None:
+            self.result_cache.invalidate(query_id)
 
     def get_query_result(self, query_id: str, return_pandas: bool = True, file_format: str = "arrow",
-                         delete_query: bool = False):
+                         delete_query: bool = False, return_type: str = None):
         """ Returns results for given query.
         Blocks until the query is DONE.
 
         :param file_format: Options are arrow, csv
         :param query_id:
-        :param return_pandas: when true, returns data as pandas.DataFrame
+        :param return_pandas: when true, returns csv data as pandas.DataFrame, else as list of rows.
+                              Ignored when return_type is set
         :param delete_query: deletes query after getting result
-        :return: str containing the returned csv's
+        :param return_type: "pandas" (pandas.DataFrame), "arrow" (pyarrow.Table, no conversion of arrow results)
+                            or "numpy" (dict of column name to numpy.ndarray)
+        :return: result in the format given by return_type
         """
+        return_type = get_result_return_type(return_type=return_type, return_pandas=return_pandas,
+                                             file_format=file_format)
 
         self.reexecute_when_status_new(query_id=query_id)
 
-        self.wait_for_query_to_finish(query_id=query_id)
+        response = self.wait_for_query_to_finish(query_id=query_id)
+        check_result_status(query_id=query_id, query_info=response)
 
-        response = self.get_query_info(query_id)
+        data = self._download_query_result(query_id=query_id, return_type=return_type, file_format=file_format,
+                                           query_info=response)
 
-        response_status = response["status"]
+        if delete_query:
+            self.delete_stored_query(query_id=query_id)
 
-        if response_status == "FAILED":
-            raise Exception(f"Query with {query_id=} failed.")
-        elif response_status == "NEW":
-            raise Exception(f"Query {query_id} still in state NEW after reexecuting..")
-        elif response_status == "DONE":
-            result_url = self.conquery_api_urls.query_result(query_id=query_id, file_format=file_format).parse()
+        return data
 
-            if file_format == "arrow":
-                data = pa.ipc.open_file(self._session.get(result_url).content).read_pandas(date_as_object=False)
+    def iter_query_result_batches(self, query_id: str, as_pandas: bool = False, max_rows: int = None,
+                                  delete_query: bool = False, chunk_size: int = 1024 * 1024) \
+            -> Iterator[Union[pa.RecordBatch, pd.DataFrame]]:
+        """Returns the arrow result of a query as iterator of record batches with bounded memory.
+        Blocks until the query is DONE.
 
-            else:
-                result_string = self._download_query_results(result_url)
-                if return_pandas:
-                    data = pd.read_csv(StringIO(result_string), sep=";", dtype=str, keep_default_na=False)
+        The result file is streamed to a temporary file (or the result cache of the connection) in chunks of
+        chunk_size bytes and memory mapped, so only the batches that are currently processed have to fit into memory.
+
+        :param as_pandas: yield each batch as pandas.DataFrame instead of pyarrow.RecordBatch
+        :param max_rows: split batches from the server into batches of at most max_rows rows
+        :param delete_query: deletes query after the batches were consumed
+        """
+        if max_rows is not None and max_rows < 1:
+            raise ValueError(f"{max_rows=} must be positive")
+
+        self.reexecute_when_status_new(query_id=query_id)
+
+        response = self.wait_for_query_to_finish(query_id=query_id)
+        check_result_status(query_id=query_id, query_info=response)
+
+        result_path = self._download_query_result_file(query_id=query_id, file_format="arrow",
+                                                       query_info=response, chunk_size=chunk_size)
+        try:
+            with pa.memory_map(result_path) as source:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    for batch in split_record_batch(reader.get_batch(i), max_rows=max_rows):
+                        yield batch.to_pandas(date_as_object=False) if as_pandas else batch
+        finally:
+            # deleting the query also removes the result file from the result cache, so not before it is read
+            if delete_query:
+                self.delete_stored_query(query_id=query_id)
+            if self.result_cache is None:
+                os.remove(result_path)
+
+    def execute_many(self, queries: List[Union[dict, QueryObject]], labels: List[str] = None,
+                     max_in_flight: int = 8, dataset: str = None, file_format: str = "arrow",
+                     delete_queries: bool = False, return_type: str = "pandas",
+                     timeout: float = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """Executes all queries and yields (query_id, result) in the order the queries finish.
+
+        At most max_in_flight queries are running at the same time, the statuses of all running queries are
+        polled in one loop that backs off according to the waiter of the connection. The timeout of the waiter
+        applies to each query from its submission on.
+
+        :param labels: optional labels, one for each query
+        :param max_in_flight: maximum number of queries submitted but not yet downloaded
+        :param delete_queries: deletes each query after getting its result
+        :param return_type: see get_query_result
+        :param timeout: seconds after which waiting for the whole batch stops with QueryTimeoutError, None waits
+                        until every query finished or hit the timeout of the waiter
+        """
+        return_type = get_result_return_type(return_type=return_type, return_pandas=True, file_format=file_format)
+        if labels is None:
+            labels = [None] * len(queries)
+        if len(labels) != len(queries):
+            raise ValueError(f"Got {len(labels)} labels for {len(queries)} queries")
+        if max_in_flight < 1:
+            raise ValueError(f"{max_in_flight=} must be positive")
+
+        to_submit = deque(zip(queries, labels))
+        # query id -> deadline of the query
+        in_flight: Dict[str, Optional[float]] = dict()
+        batch_deadline = None if timeout is None else monotonic() + timeout
+        intervals = self.waiter.intervals()
+        polls = 0
+
+        while to_submit or in_flight:
+            while to_submit and len(in_flight) < max_in_flight:
+                query, label = to_submit.popleft()
+                in_flight[self.execute_query(query=query, dataset=dataset, label=label)] = self.waiter.deadline()
+
+            finished = []
+            running = dict()
+            for query_id in in_flight:
+                query_info = self.get_query_info(query_id)
+                polls += 1
+                if not self.waiter.pending(polls, query_info, query_is_running):
+                    check_result_status(query_id=query_id, query_info=query_info)
+                    finished.append((query_id, query_info))
                 else:
-                    data = list(csv.reader(result_string.splitlines(), delimiter=';'))
+                    running[query_id] = query_info
+
+            if not finished:
+                # the query closest to its deadline determines how long to sleep
+                query_id = min(running, key=lambda running_id: in_flight[running_id] or float("inf"))
+                interval = self.waiter.next_interval(intervals, in_flight[query_id], polls, running[query_id])
+                if batch_deadline is not None:
+                    remaining = batch_deadline - monotonic()
+                    if remaining <= 0:
+                        raise QueryTimeoutError(f"{len(in_flight)} queries still running and {len(to_submit)} not "
+                                                f"submitted after {timeout}s")
+                    interval = min(interval, remaining)
+                sleep(interval)
+                continue
 
-        else:
-            raise ValueError(f"Unknown response status {response_status}")
+            # start backing off from scratch for the next round of queries
+            intervals = self.waiter.intervals()
+            for query_id, query_info in finished:
+                del in_flight[query_id]
+                data = self._download_query_result(query_id=query_id, return_type=return_type,
+                                                   file_format=file_format, query_info=query_info)
+                if delete_queries:
+                    self.delete_stored_query(query_id=query_id)
+                yield query_id, data
+
+    def _download_query_result(self, query_id: str, return_type: str = "pandas", file_format: str = "arrow",
+                               query_info: dict = None):
+        if self.result_cache is not None and query_info is not None:
+            # results from the cache are memory mapped instead of read into memory
+            result_path = self._download_query_result_file(query_id=query_id, file_format=file_format,
+                                                           query_info=query_info)
+            if file_format == "arrow":
+                return read_arrow_result(pa.memory_map(result_path), return_type=return_type)
 
-        if delete_query:
-            self.delete_stored_query(query_id=query_id)
+            with open(result_path, encoding="utf-8") as result_file:
+                return read_csv_result(result_file.read(), return_type=return_type)
 
-        return data
+        result_url = self.conquery_api_urls.query_result(query_id=query_id, file_format=file_format).parse()
+
+        if file_format == "arrow":
+            return read_arrow_result(self._session.get(result_url).content, return_type=return_type)
+
+        return read_csv_result(self._download_query_results(result_url), return_type=return_type)
+
+    def _download_query_result_file(self, query_id: str, file_format: str, query_info: dict,
+                                    chunk_size: int = 1024 * 1024) -> str:
+        """Downloads the result into the result cache or, without cache, into a temporary file the caller
+        has to remove. Returns the path of the file."""
+        result_url = self.conquery_api_urls.query_result(query_id=query_id, file_format=file_format).parse()
+
+        def download(file: BinaryIO):
+            self._session.download(result_url, file, chunk_size=chunk_size)
+
+        if self.result_cache is not None:
+            return self.result_cache.get_or_put(query_id=query_id, file_format=file_format, query_info=query_info,
+                                                download=download)
+
+        with NamedTemporaryFile(prefix="cqapi-", suffix=f".{file_format}", delete=False) as result_file:
+            try:
+                download(result_file)
+            except BaseException:
+                result_file.close()
+                os.remove(result_file.name)
+                raise
+        return result_file.name
 
     def _download_query_results(self, url):
         return self._session.get_text(url, params={"pretty": "false"})
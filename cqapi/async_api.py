@@ -0,0 +1,185 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Union, Optional, Callable, TypeVar, Dict, List
+from weakref import WeakKeyDictionary
+
+from cqapi.api import ConqueryConnectionSession, query_to_dict, query_to_json, get_executed_query_id, \
+    check_result_status, read_arrow_result, read_csv_result, remove_structure_elements_from_concepts, \
+    get_result_return_type
+from cqapi.conquery.api import ConqueryApiUrls
+from cqapi.conquery_ids import ConqueryId
+from cqapi.queries.base_elements import QueryObject
+from cqapi.queries.utils import get_dataset_from_query
+from cqapi.waiter import QueryWaiter
+
+T = TypeVar("T")
+
+
+class AsyncConqueryConnection:
+    """asyncio counterpart of ConqueryConnection.
+
+    Requests are executed by a pool of worker threads, each holding its own ConqueryConnectionSession, so that
+    up to max_concurrency requests are in flight at the same time while waiting queries only cost a coroutine.
+
+    Usage:
+        async with AsyncConqueryConnection(url, token, dataset="dataset1") as cq:
+            query_ids = await asyncio.gather(*[cq.execute_query(query) for query in queries])
+            results = await asyncio.gather(*[cq.get_query_result(query_id) for query_id in query_ids])
+    """
+
+    def __init__(self, url: str, token: str = "", dataset: str = None, max_concurrency: int = 16,
+                 waiter: QueryWaiter = None):
+        if max_concurrency < 1:
+            raise ValueError(f"{max_concurrency=} must be positive")
+
+        self.conquery_api_urls = ConqueryApiUrls(conquery_url=url.strip("/"))
+        self._token = token
+        self._dataset: Optional[str] = dataset
+        self.max_concurrency = max_concurrency
+        self.waiter: QueryWaiter = waiter if waiter is not None else QueryWaiter()
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="cqapi")
+        self._sessions = threading.local()
+        self._open_sessions: List[ConqueryConnectionSession] = []
+        self._semaphores: Dict[asyncio.AbstractEventLoop, asyncio.Semaphore] = WeakKeyDictionary()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """close without blocking the event loop while pending requests finish"""
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self):
+        """Waits for pending requests and closes the sessions, blocks the calling thread"""
+        self._executor.shutdown(wait=True)
+        for session in self._open_sessions:
+            session.close()
+
+    def update_token(self, new_token: str):
+        """Sessions of the worker threads pick up the new token with their next request"""
+        self._token = new_token
+
+    def change_dataset(self, dataset: str):
+        self._dataset = dataset
+
+    def _get_dataset(self, dataset: str = None) -> str:
+        if dataset is not None:
+            return dataset
+        if self._dataset is None:
+            raise ValueError("No dataset given and no default dataset set for this connection")
+        return self._dataset
+
+    def _get_session(self) -> ConqueryConnectionSession:
+        """Returns the session of the current worker thread"""
+        session: Optional[ConqueryConnectionSession] = getattr(self._sessions, "session", None)
+        if session is None:
+            session = ConqueryConnectionSession(token=self._token)
+            self._sessions.session = session
+            self._open_sessions.append(session)
+        elif session.token != self._token:
+            session.update_token(self._token)
+        return session
+
+    async def _run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        """Runs func(session, *args, **kwargs) in a worker thread, at most max_concurrency at a time"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+
+        async with semaphore:
+            return await loop.run_in_executor(self._executor,
+                                              lambda: func(self._get_session(), *args, **kwargs))
+
+    async def get_concepts(self, dataset: str = None, remove_structure_elements: bool = True) -> dict:
+        dataset = self._get_dataset(dataset)
+        response = await self._run(ConqueryConnectionSession.get_json,
+                                   self.conquery_api_urls.concepts(dataset=dataset).parse())
+
+        if remove_structure_elements:
+            return remove_structure_elements_from_concepts(response['concepts'])
+
+        return response['concepts']
+
+    async def get_concept(self, concept_id: Union[str, ConqueryId]) -> dict:
+        if isinstance(concept_id, ConqueryId):
+            concept_id = concept_id.id
+
+        return await self._run(ConqueryConnectionSession.get_json,
+                               self.conquery_api_urls.concept_id(concept_id=concept_id).parse())
+
+    async def get_query_info(self, query_id: str) -> dict:
+        return await self._run(ConqueryConnectionSession.get_json,
+                               self.conquery_api_urls.query_id(query_id=query_id).parse())
+
+    async def execute_query(self, query: Union[dict, QueryObject], dataset: str = None,
+                            label: str = None) -> str:
+        query_dict = query_to_dict(query)
+
+        if dataset is None:
+            dataset = self._dataset if self._dataset is not None else get_dataset_from_query(query_dict)
+
+        result = await self._run(ConqueryConnectionSession.post,
+                                 self.conquery_api_urls.queries(dataset=dataset).parse(),
+                                 query_to_json(query, query_dict))
+        query_id = get_executed_query_id(result)
+
+        if label is not None:
+            await self._run(ConqueryConnectionSession.patch,
+                            self.conquery_api_urls.query_id(query_id=query_id).parse(), {"label": label})
+        return query_id
+
+    async def reexecute_query(self, query_id: str) -> None:
+        await self._run(ConqueryConnectionSession.post,
+                        self.conquery_api_urls.query_reexecute(query_id=query_id).parse(), "")
+
+    async def reexecute_when_status_new(self, query_id: str):
+        """On restart of java backend, query_ids have status "NEW" and need to be rexecuted to retrieve data"""
+        query_info = await self.get_query_info(query_id)
+
+        if query_info["status"] == "NEW":
+            await self.reexecute_query(query_id)
+            await asyncio.sleep(0.5)
+
+    async def wait_for_query_to_finish(self, query_id: str, waiter: QueryWaiter = None) -> dict:
+        """Waits until query is finished and checks for NEW/FAILED. Returns the last query info."""
+        waiter = waiter if waiter is not None else self.waiter
+        query_info = await waiter.wait_async(partial(self.get_query_info, query_id))
+
+        if query_info['status'] in ["NEW", "FAILED"]:
+            raise Exception(f"Query Status: {query_info['status']} for query {query_info['id']}")
+
+        return query_info
+
+    async def get_query_result(self, query_id: str, return_pandas: bool = True, file_format: str = "arrow",
+                               delete_query: bool = False, return_type: str = None):
+        """Returns results for given query, see ConqueryConnection.get_query_result"""
+        return_type = get_result_return_type(return_type=return_type, return_pandas=return_pandas,
+                                             file_format=file_format)
+        await self.reexecute_when_status_new(query_id=query_id)
+
+        query_info = await self.wait_for_query_to_finish(query_id=query_id)
+        check_result_status(query_id=query_id, query_info=query_info)
+
+        result_url = self.conquery_api_urls.query_result(query_id=query_id, file_format=file_format).parse()
+
+        if file_format == "arrow":
+            data = await self._run(lambda session: read_arrow_result(session.get(result_url).content,
+                                                                     return_type=return_type))
+        else:
+            data = await self._run(lambda session: read_csv_result(
+                session.get_text(result_url, params={"pretty": "false"}), return_type=return_type))
+
+        if delete_query:
+            await self.delete_stored_query(query_id=query_id)
+
+        return data
+
+    async def delete_stored_query(self, query_id: str) -> None:
+        await self._run(ConqueryConnectionSession.delete, self.conquery_api_urls.query_id(query_id=query_id).parse())
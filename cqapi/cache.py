@@ -0,0 +1,377 @@
+import hashlib
+import json
+import os
+import threading
+from tempfile import NamedTemporaryFile
+from time import monotonic, time
+from typing import Callable, BinaryIO, Optional, List, Any, Dict
+from urllib.parse import quote
+
+import attr
+import requests
+
+from cqapi.queries.serialization import canonical_json
+
+
+class ResultCache:
+    """On-disk cache of downloaded query results with a least recently used size budget.
+
+    Results are keyed by query id, file format and a fingerprint of the query info, so a result is downloaded
+    again when the query was executed again in the meantime. Hits only touch the file, the caller can memory map it.
+
+    :param directory: directory for the cached files, created if it does not exist
+    :param max_bytes: total size of all cached files, least recently used files are removed beyond that
+    """
+    fingerprint_keys = ["numberOfResults", "createdAt", "finishTime", "requiredTime"]
+    _separator = "@"
+
+    def __init__(self, directory: str, max_bytes: int = 10 * 1024 ** 3):
+        if max_bytes < 0:
+            raise ValueError(f"{max_bytes=} must not be negative")
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def fingerprint(cls, query_info: dict) -> str:
+        state = [query_info.get(key) for key in cls.fingerprint_keys]
+        return hashlib.sha1(json.dumps(state).encode()).hexdigest()[:16]
+
+    def _prefix(self, query_id: str, file_format: str = None) -> str:
+        components = [quote(query_id, safe="")] + ([file_format] if file_format is not None else [])
+        return self._separator.join(components) + self._separator
+
+    def _path(self, query_id: str, file_format: str, query_info: dict) -> str:
+        return os.path.join(self.directory, self._prefix(query_id, file_format) + self.fingerprint(query_info))
+
+    def _files(self, prefix: str = "") -> List[str]:
+        return [os.path.join(self.directory, file_name) for file_name in os.listdir(self.directory)
+                if file_name.startswith(prefix) and not file_name.startswith(".")]
+
+    def get(self, query_id: str, file_format: str, query_info: dict) -> Optional[str]:
+        """Returns the path of the cached result or None"""
+        path = self._path(query_id, file_format, query_info)
+        with self._lock:
+            try:
+                # mark as recently used
+                os.utime(path)
+            except FileNotFoundError:
+                return None
+        return path
+
+    def put(self, query_id: str, file_format: str, query_info: dict, download: Callable[[BinaryIO], object]) -> str:
+        """Writes the result with download(file) into the cache and returns its path.
+        Older results of the same query and file format are removed."""
+        path = self._path(query_id, file_format, query_info)
+
+        with NamedTemporaryFile(dir=self.directory, prefix=".download-", delete=False) as file:
+            try:
+                download(file)
+            except BaseException:
+                file.close()
+                os.remove(file.name)
+                raise
+
+        with self._lock:
+            for old_path in self._files(self._prefix(query_id, file_format)):
+                os.remove(old_path)
+            os.replace(file.name, path)
+            self._evict(keep=path)
+        return path
+
+    def get_or_put(self, query_id: str, file_format: str, query_info: dict,
+                   download: Callable[[BinaryIO], object]) -> str:
+        path = self.get(query_id, file_format, query_info)
+        if path is None:
+            path = self.put(query_id, file_format, query_info, download)
+        return path
+
+    def invalidate(self, query_id: str) -> None:
+        """Removes all cached results of a query"""
+        with self._lock:
+            for path in self._files(self._prefix(query_id)):
+                os.remove(path)
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in self._files():
+                os.remove(path)
+
+    def size(self) -> int:
+        return sum(os.path.getsize(path) for path in self._files())
+
+    def _evict(self, keep: str = None) -> None:
+        paths = sorted(self._files(), key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in paths)
+        for path in paths:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+
+@attr.s(auto_attribs=True)
+class CachedResponse:
+    value: Any
+    dataset: str
+    fetched_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def validators(self) -> Dict[str, str]:
+        """Headers for a conditional request to revalidate the cached value"""
+        headers = dict()
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ConceptsCache:
+    """In-memory cache of the concept responses of conquery with a time to live.
+
+    Expired entries are revalidated with If-None-Match/If-Modified-Since when the server sent an ETag or
+    Last-Modified header, so an unchanged catalogue is not downloaded again. Cached values are shared between
+    callers and must not be modified.
+
+    :param ttl: seconds an entry is used without asking the server
+    """
+
+    def __init__(self, ttl: float = 600):
+        self.ttl = ttl
+        self._entries: Dict[str, CachedResponse] = dict()
+        self._lock = threading.Lock()
+
+    def get(self, url: str, dataset: str, fetch: Callable[[Dict[str, str]], requests.Response]) -> Any:
+        """Returns the cached json for url or fetches it with fetch(headers)"""
+        with self._lock:
+            entry = self._entries.get(url)
+
+        if entry is not None and monotonic() - entry.fetched_at < self.ttl:
+            return entry.value
+
+        response = fetch(entry.validators() if entry is not None else dict())
+        if entry is not None and response.status_code == 304:
+            entry.fetched_at = monotonic()
+            return entry.value
+
+        entry = CachedResponse(value=response.json(), dataset=dataset, fetched_at=monotonic(),
+                               etag=response.headers.get("ETag"),
+                               last_modified=response.headers.get("Last-Modified"))
+        with self._lock:
+            self._entries[url] = entry
+        return entry.value
+
+    def invalidate(self, dataset: str = None) -> None:
+        """Removes all entries of dataset or all entries if dataset is None"""
+        with self._lock:
+            if dataset is None:
+                self._entries.clear()
+                return
+            self._entries = {url: entry for url, entry in self._entries.items() if entry.dataset != dataset}
+
+
+class _StoredQueriesIndex:
+    def __init__(self, query_infos: List[dict]):
+        self.fetched_at = monotonic()
+        self.infos: Dict[str, dict] = {query_info["id"]: dict(query_info) for query_info in query_infos}
+        self.ids_by_label: Dict[Optional[str], List[str]] = dict()
+        for query_info in query_infos:
+            self.add_label(query_info["id"], query_info.get("label"))
+
+    def add_label(self, query_id: str, label: Optional[str]) -> None:
+        query_ids = self.ids_by_label.setdefault(label, [])
+        if query_id not in query_ids:
+            query_ids.append(query_id)
+
+    def remove_label(self, query_id: str, label: Optional[str]) -> None:
+        query_ids = self.ids_by_label.get(label, [])
+        if query_id in query_ids:
+            query_ids.remove(query_id)
+
+
+class StoredQueriesCache:
+    """In-memory index of the stored queries of each dataset by id and by label with a time to live.
+
+    The list of stored queries of a dataset is downloaded on first access, when it is older than ttl and when a
+    lookup misses, so queries created by others are found as well. Queries executed, labeled or deleted through the
+    connection are applied to the index without downloading the list again.
+
+    :param ttl: seconds the list of stored queries of a dataset is used without asking the server
+    """
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self._indices: Dict[str, _StoredQueriesIndex] = dict()
+        self._lock = threading.Lock()
+
+    def _get_index(self, dataset: str, fetch: Callable[[], List[dict]],
+                   lookup: Callable[[_StoredQueriesIndex], Any]) -> Any:
+        """Returns lookup(index), the index is downloaded again if it expired or the lookup misses"""
+        with self._lock:
+            index = self._indices.get(dataset)
+            if index is not None and monotonic() - index.fetched_at < self.ttl:
+                result = lookup(index)
+                if result:
+                    return result
+
+        self.put(dataset, fetch())
+        with self._lock:
+            return lookup(self._indices[dataset])
+
+    def put(self, dataset: str, query_infos: List[dict]) -> None:
+        """Replaces the index of dataset by the list of stored queries"""
+        index = _StoredQueriesIndex(query_infos)
+        with self._lock:
+            self._indices[dataset] = index
+
+    def get_info(self, dataset: str, query_id: str, fetch: Callable[[], List[dict]]) -> Optional[dict]:
+        """Info of the stored query with query_id or None"""
+        return self._get_index(dataset, fetch, lambda index: dict(index.infos[query_id])
+                               if query_id in index.infos else None)
+
+    def get_ids(self, dataset: str, label: str, fetch: Callable[[], List[dict]]) -> List[str]:
+        """Ids of the stored queries with label"""
+        return self._get_index(dataset, fetch, lambda index: list(index.ids_by_label.get(label, [])))
+
+    def add(self, dataset: str, query_id: str, label: str = None) -> None:
+        """Registers a newly executed query. Its info is downloaded with the next refresh of the index."""
+        with self._lock:
+            index = self._indices.get(dataset)
+            if index is not None:
+                index.add_label(query_id, label)
+
+    def set_label(self, dataset: str, query_id: str, label: Optional[str]) -> None:
+        """Applies a label change of a stored query to the index"""
+        with self._lock:
+            index = self._indices.get(dataset)
+            if index is None:
+                return
+            query_info = index.infos.get(query_id)
+            for old_label in ([query_info.get("label")] if query_info is not None else list(index.ids_by_label)):
+                index.remove_label(query_id, old_label)
+            if query_info is not None:
+                query_info["label"] = label
+            index.add_label(query_id, label)
+
+    def remove(self, dataset: str, query_id: str) -> None:
+        with self._lock:
+            index = self._indices.get(dataset)
+            if index is None:
+                return
+            query_info = index.infos.pop(query_id, None)
+            for label in ([query_info.get("label")] if query_info is not None else list(index.ids_by_label)):
+                index.remove_label(query_id, label)
+
+    def invalidate(self, dataset: str = None) -> None:
+        """Removes the index of dataset or all indices if dataset is None"""
+        with self._lock:
+            if dataset is None:
+                self._indices.clear()
+            else:
+                self._indices.pop(dataset, None)
+
+
+class QueryRegistry:
+    """Client-side registry of executed queries by content, so an identical query is not executed again.
+
+    Queries are identified by a hash of their canonical json (see cqapi.queries.serialization) and the dataset. The connection reuses a
+    registered query id while the query is younger than max_age seconds, DONE and not deleted.
+
+    With path, the registry is stored in a json file that is shared by all processes using the same path. The file
+    is replaced atomically and merged with the entries of other processes on every write.
+
+    :param path: json file to persist the registry, None keeps it in memory
+    :param max_age: seconds a registered query is reused, None reuses it as long as it exists
+    """
+
+    def __init__(self, path: str = None, max_age: Optional[float] = 3600):
+        self.path = path
+        self.max_age = max_age
+        # key -> {"id": query id, "executedAt": unix time}
+        self._entries: Dict[str, dict] = dict()
+        # identity of the file the entries were read from, the file is replaced by every write
+        self._file_version: Optional[tuple] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: dict, dataset: str) -> str:
+        return hashlib.sha256(canonical_json([dataset, query])).hexdigest()
+
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return dict()
+        except ValueError:
+            # broken file, it is replaced with the next write
+            return dict()
+
+    def _reload(self) -> None:
+        """Loads the entries of other processes if the file changed"""
+        if self.path is None:
+            return
+        try:
+            file_version = self._get_file_version()
+        except FileNotFoundError:
+            return
+        if file_version != self._file_version:
+            self._entries = self._read()
+            self._file_version = file_version
+
+    def _get_file_version(self) -> tuple:
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _write(self, update: Callable[[Dict[str, dict]], None]) -> None:
+        update(self._entries)
+        if self.path is None:
+            return
+
+        entries = self._read()
+        update(entries)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with NamedTemporaryFile("w", dir=directory, prefix=".registry-", suffix=".json", delete=False,
+                                encoding="utf-8") as file:
+            json.dump(entries, file)
+        os.replace(file.name, self.path)
+        self._entries = entries
+        self._file_version = self._get_file_version()
+
+    def get(self, key: str) -> Optional[str]:
+        """Query id registered for key if it is not older than max_age"""
+        with self._lock:
+            self._reload()
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.max_age is not None and time() - entry["executedAt"] > self.max_age:
+            return None
+        return entry["id"]
+
+    def put(self, key: str, query_id: str) -> None:
+        def add(entries: Dict[str, dict]):
+            entries[key] = {"id": query_id, "executedAt": time()}
+
+        with self._lock:
+            self._write(add)
+
+    def remove_query_id(self, query_id: str) -> None:
+        """Removes all entries of a (deleted or failed) query"""
+        def remove(entries: Dict[str, dict]):
+            for key in [key for key, entry in entries.items() if entry["id"] == query_id]:
+                del entries[key]
+
+        with self._lock:
+            if any(entry["id"] == query_id for entry in self._entries.values()):
+                self._write(remove)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._write(lambda entries: entries.clear())
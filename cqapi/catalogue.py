@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import attr
+
+from cqapi.namespace import Keys
+
+
+def concept_id_of(conquery_id: str) -> str:
+    """Root concept (dataset.concept) of an id string of a concept element"""
+    return ".".join(conquery_id.split(".", 2)[:2])
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class ConnectorEntry:
+    table: dict
+    selects: Dict[str, dict]
+    filters: Dict[str, dict]
+    date_columns: Dict[str, dict]
+
+    @property
+    def label(self) -> str:
+        return self.table.get(Keys.label, "")
+
+    @classmethod
+    def from_table(cls, table: dict) -> ConnectorEntry:
+        date_column = table.get(Keys.date_column) or dict()
+        return cls(table=table,
+                   selects={select[Keys.id]: select for select in table.get(Keys.selects, [])},
+                   filters={filter_obj[Keys.id]: filter_obj for filter_obj in table.get(Keys.filters, [])},
+                   date_columns={option[Keys.value]: option for option in date_column.get(Keys.options, [])})
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class ConceptEntry:
+    concept: dict
+    selects: Dict[str, dict]
+    connectors: Dict[str, ConnectorEntry]
+
+    @property
+    def label(self) -> str:
+        return self.concept.get(Keys.label, "")
+
+    @classmethod
+    def from_concept(cls, concept: dict) -> ConceptEntry:
+        return cls(concept=concept,
+                   selects={select[Keys.id]: select for select in concept.get(Keys.selects, [])},
+                   connectors={table[Keys.connector_id]: ConnectorEntry.from_table(table)
+                               for table in concept.get(Keys.tables, [])})
+
+
+class ConceptCatalogue:
+    """Hash indices over the concepts returned by get_concepts.
+
+    Each root concept is indexed on first access, afterwards connectors, selects, filters and date columns
+    are found by their id string in O(1). The concepts must not be modified while the catalogue is in use.
+    """
+
+    def __init__(self, concepts: Mapping[str, dict]):
+        self.concepts = concepts
+        self._entries: Dict[str, ConceptEntry] = dict()
+        self._id_labels: Dict[Tuple[type, str], Optional[str]] = dict()
+
+    def get_concept(self, concept_id: str) -> ConceptEntry:
+        """Raises KeyError for unknown concepts"""
+        try:
+            return self._entries[concept_id]
+        except KeyError:
+            entry = self._entries[concept_id] = ConceptEntry.from_concept(self.concepts[concept_id])
+            return entry
+
+    def get_connector(self, connector_id: str) -> Optional[ConnectorEntry]:
+        return self.get_concept(concept_id_of(connector_id)).connectors.get(connector_id)
+
+    def _get_connector(self, connector_id: str) -> ConnectorEntry:
+        connector = self.get_connector(connector_id)
+        if connector is None:
+            raise ValueError(f"Unknown {connector_id=}")
+        return connector
+
+    def concept_label(self, concept_id: str) -> str:
+        return self.get_concept(concept_id).label
+
+    def connector_label(self, connector_id: str) -> str:
+        return self._get_connector(connector_id).label
+
+    def concept_select_label(self, select_id: str) -> str:
+        try:
+            return self.get_concept(concept_id_of(select_id)).selects[select_id][Keys.label]
+        except KeyError:
+            raise ValueError(f"Unknown {select_id=}")
+
+    def connector_select_label(self, connector_id: str, select_id: str) -> str:
+        try:
+            return self._get_connector(connector_id).selects[select_id][Keys.label]
+        except KeyError:
+            raise ValueError(f"Unknown {select_id=}")
+
+    def filter_label(self, connector_id: str, filter_id: str) -> str:
+        try:
+            return self._get_connector(connector_id).filters[filter_id][Keys.label]
+        except KeyError:
+            raise ValueError(f"Unknown {filter_id=}")
+
+    def date_column_label(self, connector_id: str, date_column_id: str) -> str:
+        try:
+            return self._get_connector(connector_id).date_columns[date_column_id][Keys.label]
+        except KeyError:
+            raise ValueError(f"Unknown {date_column_id=}")
+
+    def get_id_label(self, conquery_id) -> Optional[str]:
+        """Memoized conquery_id.get_id_label(concepts), None if the id can not be found in the concepts"""
+        # ids of different types can share the id string
+        key = (type(conquery_id), conquery_id.id)
+        try:
+            return self._id_labels[key]
+        except KeyError:
+            pass
+
+        try:
+            label = conquery_id.get_id_label(concepts=self.concepts)
+        except (KeyError, ValueError, IndexError):
+            label = None
+        self._id_labels[key] = label
+        return label
+
+    def default_connectors(self, concept_id: str) -> List[str]:
+        return [connector_id for connector_id, connector in self.get_concept(concept_id).connectors.items()
+                if connector.table.get(Keys.default, False)]
+
+    def default_concept_selects(self, concept_id: str) -> List[str]:
+        return [select_id for select_id, select in self.get_concept(concept_id).selects.items()
+                if select.get(Keys.default, False)]
+
+    def default_connector_selects(self, concept_id: str, connector_ids: List[str]) -> List[str]:
+        connector_ids = set(connector_ids)
+        return [select_id
+                for connector_id, connector in self.get_concept(concept_id).connectors.items()
+                if connector_id in connector_ids
+                for select_id, select in connector.selects.items()
+                if select.get(Keys.default, False)]
+
+
+_catalogues: OrderedDict = OrderedDict()
+_catalogues_lock = threading.Lock()
+_max_catalogues = 8
+
+
+def get_catalogue(concepts: Mapping[str, dict]) -> ConceptCatalogue:
+    """Returns the catalogue of concepts, built once per concepts object.
+
+    The last few catalogues are kept with a reference to their concepts, so an id is not reused by another object
+    while it is cached.
+    """
+    with _catalogues_lock:
+        catalogue = _catalogues.get(id(concepts))
+        if catalogue is not None and catalogue.concepts is concepts:
+            _catalogues.move_to_end(id(concepts))
+            return catalogue
+
+        catalogue = _catalogues[id(concepts)] = ConceptCatalogue(concepts)
+        if len(_catalogues) > _max_catalogues:
+            _catalogues.popitem(last=False)
+        return catalogue
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from cqapi.namespace import Keys
+
+_token_pattern = re.compile(r"\w+")
+
+# score of a query token matching a node
+label_exact_score = 3
+label_prefix_score = 2
+description_score = 1
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return _token_pattern.findall(text.casefold())
+
+
+class _FieldIndex:
+    """Inverted index token -> node numbers of one field with a sorted token list for prefix lookups"""
+
+    def __init__(self, postings: Dict[str, Set[int]]):
+        self.postings = postings
+        self.tokens = sorted(postings)
+
+    def exact(self, token: str) -> Set[int]:
+        return self.postings.get(token, set())
+
+    def prefix(self, prefix: str) -> Set[int]:
+        nodes: Set[int] = set()
+        for position in range(bisect_left(self.tokens, prefix), len(self.tokens)):
+            token = self.tokens[position]
+            if not token.startswith(prefix):
+                break
+            nodes |= self.postings[token]
+        return nodes
+
+
+class ConceptSearchIndex:
+    """Full-text index over labels and descriptions of all nodes of a concept tree (as returned by get_concept).
+
+    Every token of the search value has to match a token of the label or description of a node as a prefix.
+    Results are ranked by exact label matches, then label prefix matches, then description matches and keep the
+    tree order otherwise. Values that are no token prefix fall back to a substring search.
+    """
+
+    def __init__(self, concept_tree: dict, root_concept_id: str):
+        self.concept_tree = concept_tree
+        self.node_ids: List[str] = []
+        label_postings: Dict[str, Set[int]] = defaultdict(set)
+        description_postings: Dict[str, Set[int]] = defaultdict(set)
+
+        # depth first in tree order without recursion, trees like ICD are deep and have many nodes
+        stack = [root_concept_id]
+        while stack:
+            node_id = stack.pop()
+            node = concept_tree[node_id]
+            node_number = len(self.node_ids)
+            self.node_ids.append(node_id)
+
+            for token in tokenize(node.get(Keys.label)):
+                label_postings[token].add(node_number)
+            for token in tokenize(node.get(Keys.description)):
+                description_postings[token].add(node_number)
+
+            stack.extend(reversed(node.get(Keys.children) or []))
+
+        self._labels = _FieldIndex(label_postings)
+        self._descriptions = _FieldIndex(description_postings)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def search(self, value: str, limit: Optional[int] = None) -> List[Tuple[str, str, Optional[str]]]:
+        """Returns (label, id, description) of the best matching nodes"""
+        scores = self._score(tokenize(value))
+        if not scores:
+            scores = self._score_substring(value.casefold())
+
+        ranked = sorted(scores, key=lambda node_number: (-scores[node_number], node_number))
+        if limit is not None:
+            ranked = ranked[:limit]
+
+        return [(node.get(Keys.label), node_id, node.get(Keys.description))
+                for node_id, node in ((self.node_ids[node_number], self.concept_tree[self.node_ids[node_number]])
+                                      for node_number in ranked)]
+
+    def _score(self, tokens: List[str]) -> Dict[int, int]:
+        scores: Optional[Dict[int, int]] = None
+        for token in tokens:
+            token_scores: Dict[int, int] = dict()
+            for score, nodes in ((description_score, self._descriptions.prefix(token)),
+                                 (label_prefix_score, self._labels.prefix(token)),
+                                 (label_exact_score, self._labels.exact(token))):
+                for node_number in nodes:
+                    token_scores[node_number] = score
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {node_number: score + token_scores[node_number]
+                          for node_number, score in scores.items() if node_number in token_scores}
+            if not scores:
+                return dict()
+
+        return scores or dict()
+
+    def _score_substring(self, value: str) -> Dict[int, int]:
+        if not value:
+            return dict()
+
+        scores = dict()
+        for node_number, node_id in enumerate(self.node_ids):
+            node = self.concept_tree[node_id]
+            if value in (node.get(Keys.label) or "").casefold():
+                scores[node_number] = label_prefix_score
+            elif value in (node.get(Keys.description) or "").casefold():
+                scores[node_number] = description_score
+        return scores
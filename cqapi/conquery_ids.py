@@ -1,9 +1,12 @@
 from __future__ import annotations
-from typing import List, Union, Set, Optional
+from typing import List, Union, Set, Optional, Type, Iterable, Sequence, Dict, Iterator, Tuple
+from functools import lru_cache
 from abc import ABC, abstractmethod
+from weakref import ref
 from cqapi.namespace import Keys
-from copy import deepcopy
+from cqapi.catalogue import get_catalogue
 import cqapi.datasets
+import pandas as pd
 
 # Conquery Id Info
 conquery_id_separator = "."
@@ -20,36 +23,60 @@ date_index = 4
 
 
 class ConqueryId(ABC):
-    def __init__(self, name: str, base: Optional[ConqueryId] = None):
-        if type(self) == ConqueryId:
+    """
+    Immutable and interned: creating an id that already exists returns the existing object, so equal ids are
+    usually identical. The id string is computed once on creation, its hash is cached by the string.
+    Methods that "change" an id (change_dataset, rename_concept_id) return a new id.
+    """
+    __slots__ = ("name", "_base", "_id", "__weakref__")
+
+    def __new__(cls, name: str, base: Optional[ConqueryId] = None):
+        if cls == ConqueryId:
             raise ValueError("Only subclasses of ConqueryId can be initiated")
+        return _intern_id(cls, name, base)
 
-        self._base: Optional[ConqueryId] = base
-        self.name = name
+    def __init__(self, name: str, base: Optional[ConqueryId] = None):
+        # all attributes are set in __new__
+        pass
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{type(self).__name__} is immutable")
 
     def __hash__(self):
-        return hash(self.id)
+        return hash(self._id)
 
     def __eq__(self, other_id):
+        if self is other_id:
+            return True
         if isinstance(other_id, ConqueryId):
-            return self.id == other_id.id
+            return self._id == other_id._id
         raise ValueError("Can only compare to another instance of ConqueryId or its subclasses")
 
     def __repr__(self):
-        return self.id
+        return self._id
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return _intern_id, (type(self), self.name, self._base)
 
     def deepcopy(self) -> ConqueryId:
-        return deepcopy(self)
+        """Ids are immutable, so this returns the id itself"""
+        return self
 
     @property
-    def id(self):
+    def id(self) -> str:
         """
         Datasets returns its name, all other Ids that build on it add their name to the string.
         """
-        if not isinstance(self, DatasetId):
-            return f"{self.base.id}{conquery_id_separator}{self.name}"
-        else:
-            return self.name
+        return self._id
 
     @property
     def base(self) -> ConqueryId:
@@ -61,11 +88,6 @@ class ConqueryId(ABC):
 
         raise ValueError(f"Cannot retrieve base")
 
-    @base.setter
-    def base(self, new_base: Optional[ConqueryId]):
-        self._check_valid_base(new_base=new_base)
-        self._base = new_base
-
     @abstractmethod
     def _check_valid_base(self, new_base: Optional[ConqueryId]):
         pass
@@ -81,16 +103,16 @@ class ConqueryId(ABC):
         else:
             return self.base.get_concept_id()
 
-    def rename_concept_id(self, new_concept: str):
+    def rename_concept_id(self, new_concept: str) -> ConqueryId:
         """
-        Renames the concept_id base of a ConqueryId
+        Returns the ConqueryId with renamed concept_id base
         """
         if isinstance(self, DatasetId):
             raise ValueError("Cannot rename concept for dataset")
         elif isinstance(self, ConceptId):
-            self.name = new_concept
+            return _intern_id(ConceptId, new_concept, self.base)
         else:
-            self.base.rename_concept_id(new_concept=new_concept)
+            return _intern_id(type(self), self.name, self.base.rename_concept_id(new_concept=new_concept))
 
     def get_connector_id(self) -> ConnectorId:
         """
@@ -112,22 +134,27 @@ class ConqueryId(ABC):
         else:
             return self.base.get_dataset()
 
-    def change_dataset(self, new_dataset: str):
+    def change_dataset(self, new_dataset: str) -> ConqueryId:
         """
-        Change the name of the base dataset
+        Returns the ConqueryId with changed name of the base dataset
         """
         if isinstance(self, DatasetId):
-            self.name = new_dataset
+            return _intern_id(DatasetId, new_dataset, None)
         else:
-            self.base.change_dataset(new_dataset=new_dataset)
+            return _rebase(type(self), self, new_dataset)
 
-    def is_in_id_list(self, other_ids: List[ConqueryId]) -> bool:
+    def is_in_id_list(self, other_ids: Union[List[ConqueryId], ConqueryIdCollection]) -> bool:
+        if isinstance(other_ids, ConqueryIdCollection):
+            return self in other_ids
         return any(self == other_id for other_id in other_ids)
 
     def is_child_of(self, other_id: ConqueryId) -> bool:
-        return self.id.startswith(other_id.id)
+        """True if other_id is this id or one of its bases"""
+        return self.id == other_id.id or self.id.startswith(other_id.id + conquery_id_separator)
 
-    def is_child_of_any(self, other_ids: List[ConqueryId]) -> bool:
+    def is_child_of_any(self, other_ids: Union[List[ConqueryId], ConqueryIdCollection]) -> bool:
+        if isinstance(other_ids, ConqueryIdCollection):
+            return other_ids.has_ancestor(self)
         return any(self.is_child_of(other_id=other_id) for other_id in other_ids)
 
     @abstractmethod
@@ -138,7 +165,7 @@ class ConqueryId(ABC):
     @abstractmethod
     def create_id_objects_recursively(cls, id_list: List[str]) -> ConqueryId:
         """
-        Method is used in from_str and should validate provided string and recursively initiate objects for each
+        Method is used in from_str and should validate provided string and initiate objects for each
         inherited class needed for the provided Id
         """
         raise ValueError("Without type hint, from_str can only be called on subclasses of ConqueryId")
@@ -147,27 +174,18 @@ class ConqueryId(ABC):
     def from_str(cls, id_string: str, type_hint: str = None) -> ConqueryId:
         """
         Splits the string on the separator and initiates instances of conqueryIds to represent the string.
-        If type hint provided, calls from string method on the corresponding subclass
+        If type hint provided, calls from string method on the corresponding subclass.
+        Parsed ids are cached, parsing the same string again is a lookup.
         """
-        if not type_hint:
-            id_list = id_string.split(conquery_id_separator)
-            return cls.create_id_objects_recursively(id_list=id_list)
-        if type_hint == "dataset":
-            return DatasetId.from_str(id_string=id_string)
-        elif type_hint == "concept":
-            return ConceptId.from_str(id_string=id_string)
-        elif type_hint == "connector":
-            return ConnectorId.from_str(id_string=id_string)
-        elif type_hint == "child":
-            return ChildId.from_str(id_string=id_string)
-        elif type_hint == "select" or type_hint == "concept_select" or type_hint == "connector_select":
-            return SelectId.from_str(id_string=id_string)
-        elif type_hint == "filter":
-            return FilterId.from_str(id_string=id_string)
-        elif type_hint == "date":
-            return DateId.from_str(id_string=id_string)
-        else:
-            raise ValueError(f"Invalid type hint, provided: {type_hint}")
+        return _parse_id(cls, id_string, type_hint)
+
+    @classmethod
+    def from_strs(cls, id_strings: Iterable[Union[str, ConqueryId]], type_hint: str = None) -> List[ConqueryId]:
+        """
+        from_str for many strings, elements that already are ConqueryIds are returned unchanged
+        """
+        return [_parse_id(cls, id_string, type_hint) if isinstance(id_string, str) else id_string
+                for id_string in id_strings]
 
     @staticmethod
     def filter_concept_obj(filter_obj: list, filter_key: str, compare_string: str, return_key: str) \
@@ -181,6 +199,8 @@ class ConqueryId(ABC):
 
 
 class DatasetId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str):
         super().__init__(name=name, base=None)
 
@@ -196,10 +216,12 @@ class DatasetId(ConqueryId):
         if len(id_list) != dataset_index:
             raise ValueError(f"Provided list of ids for Dataset must be of length {dataset_index}. "
                              f"Provided: {id_list}")
-        return DatasetId(name=id_list[0])
+        return _create_id_chain(id_list, (DatasetId,))
 
 
 class ConceptId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str, base: DatasetId):
         super().__init__(name=name, base=base)
 
@@ -210,22 +232,19 @@ class ConceptId(ConqueryId):
             raise ValueError(f"Base of Concept can only be a Dataset. Provided: {new_base.id}")
 
     def get_id_label(self, concepts: dict):
-        concept_id = self.id
-        concept_obj = concepts[concept_id]
-        concept_label = concept_obj[Keys.label]
-        return concept_label
+        return concepts[self.id][Keys.label]
 
     @classmethod
     def create_id_objects_recursively(cls, id_list: List[str]) -> ConceptId:
         if len(id_list) != concept_index:
             raise ValueError(f"Provided string for Concept must be of length {concept_index} (dataset and concept). "
                              f"Provided: {id_list}")
-        concept_id = id_list.pop(-1)
-        base = DatasetId.create_id_objects_recursively(id_list=id_list)
-        return ConceptId(name=concept_id, base=base)
+        return _create_id_chain(id_list, (DatasetId, ConceptId))
 
 
 class SecondaryId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str, base: DatasetId):
         super().__init__(name=name, base=base)
 
@@ -244,12 +263,12 @@ class SecondaryId(ConqueryId):
             raise ValueError(
                 f"Provided string for Concept must be of length {concept_index} (dataset and secpndary id). "
                 f"Provided: {id_list}")
-        secondary_id = id_list.pop(-1)
-        base = DatasetId.create_id_objects_recursively(id_list=id_list)
-        return SecondaryId(name=secondary_id, base=base)
+        return _create_id_chain(id_list, (DatasetId, SecondaryId))
 
 
 class TableId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str, base: DatasetId):
         super().__init__(name=name, base=base)
 
@@ -263,16 +282,16 @@ class TableId(ConqueryId):
         return self.name.replace("_", "").title()
 
     @classmethod
-    def create_id_objects_recursively(cls, id_list: List[str]) -> ConceptId:
+    def create_id_objects_recursively(cls, id_list: List[str]) -> TableId:
         if len(id_list) != table_index:
             raise ValueError(f"Provided string for Table must be of length {table_index} (dataset and table). "
                              f"Provided: {id_list}")
-        table_id = id_list.pop(-1)
-        base = DatasetId.create_id_objects_recursively(id_list=id_list)
-        return TableId(name=table_id, base=base)
+        return _create_id_chain(id_list, (DatasetId, TableId))
 
 
 class ColumnId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str, base: TableId):
         super().__init__(name=name, base=base)
 
@@ -286,17 +305,17 @@ class ColumnId(ConqueryId):
         return self.name.replace("_", "").title()
 
     @classmethod
-    def create_id_objects_recursively(cls, id_list: List[str]) -> ConnectorId:
+    def create_id_objects_recursively(cls, id_list: List[str]) -> ColumnId:
         if len(id_list) != column_index:
             raise ValueError(f"Provided string for Column must be of length {column_index} "
                              f"(dataset, table and column). "
                              f"Provided: {id_list}")
-        column_id = id_list.pop(-1)
-        base = TableId.create_id_objects_recursively(id_list=id_list)
-        return ColumnId(name=column_id, base=base)
+        return _create_id_chain(id_list, (DatasetId, TableId, ColumnId))
 
 
 class ConnectorId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str, base: ConceptId):
         super().__init__(name=name, base=base)
 
@@ -308,11 +327,7 @@ class ConnectorId(ConqueryId):
 
     def get_id_label(self, concepts: dict):
         base_label = self.base.get_id_label(concepts=concepts)
-        concept_id = self.get_concept_id().id
-        concept_obj = concepts[concept_id]
-        connector_id = self.id
-        connector_label = self.filter_concept_obj(filter_obj=concept_obj[Keys.tables], filter_key=Keys.connector_id,
-                                                  compare_string=connector_id, return_key=Keys.label)
+        connector_label = get_catalogue(concepts).connector_label(connector_id=self.id)
         return " - ".join([base_label, connector_label])
 
     @classmethod
@@ -321,12 +336,12 @@ class ConnectorId(ConqueryId):
             raise ValueError(f"Provided string for Connector must be of length {connector_index} "
                              f"(dataset, concept and connector). "
                              f"Provided: {id_list}")
-        connector_id = id_list.pop(-1)
-        base = ConceptId.create_id_objects_recursively(id_list=id_list)
-        return ConnectorId(name=connector_id, base=base)
+        return _create_id_chain(id_list, (DatasetId, ConceptId, ConnectorId))
 
 
 class ChildId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str, base: Union[ChildId, ConceptId]):
         super().__init__(name=name, base=base)
 
@@ -343,20 +358,16 @@ class ChildId(ConqueryId):
 
     @classmethod
     def create_id_objects_recursively(cls, id_list: List[str]) -> ChildId:
-        child_id = id_list.pop(-1)
-        if len(id_list) >= child_index:
-            base = ChildId.create_id_objects_recursively(id_list=id_list)  # type: ignore
-        elif len(id_list) == concept_index:
-            base = ConceptId.create_id_objects_recursively(id_list=id_list)  # type: ignore
-        else:
-            raise ValueError(f"Provided string for Child must be of minimum length {child_index + 1} "
+        if len(id_list) < child_index:
+            raise ValueError(f"Provided string for Child must be of minimum length {child_index} "
                              f"(dataset, concept and child/children). "
                              f"Provided: {id_list}")
-
-        return ChildId(name=child_id, base=base)
+        return _create_id_chain(id_list, (DatasetId, ConceptId, *[ChildId] * (len(id_list) - concept_index)))
 
 
 class SelectId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str, base: Union[ConceptId, ConnectorId]):
         super().__init__(name=name, base=base)
 
@@ -371,39 +382,29 @@ class SelectId(ConqueryId):
 
     def get_id_label(self, concepts: dict):
         base_label = self.base.get_id_label(concepts=concepts)
-        concept_id = self.get_concept_id().id
-        concept_obj = concepts[concept_id]
+        catalogue = get_catalogue(concepts)
 
         if isinstance(self.base, ConnectorId):
-            connector_id = self.get_connector_id().id
-
-            table_selects = self.filter_concept_obj(filter_obj=concept_obj[Keys.tables], filter_key=Keys.connector_id,
-                                                    compare_string=connector_id, return_key=Keys.selects) \
-                # type: ignore
-            select_label = self.filter_concept_obj(filter_obj=table_selects, filter_key=Keys.id,
-                                                   compare_string=self.id, return_key=Keys.label)  # type: ignore
-
+            select_label = catalogue.connector_select_label(connector_id=self.base.id, select_id=self.id)
         else:
-            select_label = self.filter_concept_obj(filter_obj=concept_obj[Keys.selects], filter_key=Keys.id,
-                                                   compare_string=self.id, return_key=Keys.label)  # type: ignore
+            select_label = catalogue.concept_select_label(select_id=self.id)
         return " - ".join([base_label, select_label])
 
     @classmethod
     def create_id_objects_recursively(cls, id_list: List[str]) -> SelectId:
-        select_id = id_list.pop(-1)
-        if len(id_list) == concept_index:
-            base = ConceptId.create_id_objects_recursively(id_list=id_list)  # type: ignore
-        elif len(id_list) == connector_index:
-            base = ConnectorId.create_id_objects_recursively(id_list=id_list)  # type: ignore
-        else:
-            raise ValueError(f"Provided string for Select must be of length {concept_select_index} or "
-                             f"{connector_select_index} (dataset, concept, (connector) and select. "
-                             f"Provided: {id_list}")
+        if len(id_list) == concept_select_index:
+            return _create_id_chain(id_list, (DatasetId, ConceptId, SelectId))
+        if len(id_list) == connector_select_index:
+            return _create_id_chain(id_list, (DatasetId, ConceptId, ConnectorId, SelectId))
 
-        return SelectId(name=select_id, base=base)
+        raise ValueError(f"Provided string for Select must be of length {concept_select_index} or "
+                         f"{connector_select_index} (dataset, concept, (connector) and select. "
+                         f"Provided: {id_list}")
 
 
 class FilterId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str, base: ConnectorId):
         super().__init__(name=name, base=base)
 
@@ -415,15 +416,7 @@ class FilterId(ConqueryId):
 
     def get_id_label(self, concepts: dict):
         base_label = self.base.get_id_label(concepts=concepts)
-        concept_id = self.get_concept_id().id
-        concept_obj = concepts[concept_id]
-        connector_id = self.get_connector_id().id
-
-        table_filters = self.filter_concept_obj(filter_obj=concept_obj[Keys.tables], filter_key=Keys.connector_id,
-                                                compare_string=connector_id, return_key=Keys.filters) \
-            # type: ignore
-        filter_label = self.filter_concept_obj(filter_obj=table_filters, filter_key=Keys.id,
-                                               compare_string=self.id, return_key=Keys.label)  # type: ignore
+        filter_label = get_catalogue(concepts).filter_label(connector_id=self.base.id, filter_id=self.id)
         return " - ".join([base_label, filter_label])
 
     @classmethod
@@ -432,12 +425,12 @@ class FilterId(ConqueryId):
             raise ValueError(f"Provided string for Filter must be of length {filter_index} "
                              f"(dataset, concept, connector and filter). "
                              f"Provided: {id_list}")
-        filter_id = id_list.pop(-1)
-        base = ConnectorId.create_id_objects_recursively(id_list=id_list)
-        return FilterId(name=filter_id, base=base)
+        return _create_id_chain(id_list, (DatasetId, ConceptId, ConnectorId, FilterId))
 
 
 class DateId(ConqueryId):
+    __slots__ = ()
+
     def __init__(self, name: str, base: ConnectorId):
         super().__init__(name=name, base=base)
 
@@ -449,16 +442,7 @@ class DateId(ConqueryId):
 
     def get_id_label(self, concepts: dict):
         base_label = self.base.get_id_label(concepts=concepts)
-        concept_id = self.get_concept_id().id
-        concept_obj = concepts[concept_id]
-        connector_id = self.get_connector_id().id
-
-        table_dates = self.filter_concept_obj(filter_obj=concept_obj[Keys.tables], filter_key=Keys.connector_id,
-                                              compare_string=connector_id, return_key=Keys.date_column) \
-            # type: ignore
-
-        date_label = self.filter_concept_obj(filter_obj=table_dates[Keys.options], filter_key=Keys.value,
-                                             compare_string=self.id, return_key=Keys.label)  # type: ignore
+        date_label = get_catalogue(concepts).date_column_label(connector_id=self.base.id, date_column_id=self.id)
         return " - ".join([base_label, date_label])
 
     @classmethod
@@ -467,52 +451,280 @@ class DateId(ConqueryId):
             raise ValueError(f"Provided string for Date must be of length {date_index} "
                              f"(dataset, concept, connector and date). "
                              f"Provided: {id_list}")
-        date_id = id_list.pop(-1)
-        base = ConnectorId.create_id_objects_recursively(id_list=id_list)
-        return DateId(name=date_id, base=base)
+        return _create_id_chain(id_list, (DatasetId, ConceptId, ConnectorId, DateId))
+
+
+def _create_id_chain(id_list: Sequence[str], id_types: Sequence[Type[ConqueryId]]) -> ConqueryId:
+    """Creates the ids for all elements of id_list from the dataset onwards, id_types[i] is the type of id_list[i]"""
+    if len(id_list) == 1:
+        return _intern_id(id_types[0], id_list[0], None)
+    # bases like dataset.concept are shared by many ids and looked up instead of created again
+    return _intern_id(id_types[-1], id_list[-1], _get_base_id(tuple(id_list[:-1]), tuple(id_types[:-1])))
+
+
+@lru_cache(maxsize=2 ** 14)
+def _get_base_id(id_list: Tuple[str, ...], id_types: Tuple[Type[ConqueryId], ...]) -> ConqueryId:
+    return _create_id_chain(id_list, id_types)
+
+
+@lru_cache(maxsize=2 ** 16)
+def _parse_id(cls: Type[ConqueryId], id_string: str, type_hint: Optional[str]) -> ConqueryId:
+    if type_hint:
+        try:
+            cls = id_type_hints[type_hint]
+        except KeyError:
+            raise ValueError(f"Invalid type hint, provided: {type_hint}")
+
+    return cls.create_id_objects_recursively(id_list=id_string.split(conquery_id_separator))
+
+
+@lru_cache(maxsize=2 ** 16)
+def _rebase(cls: Type[ConqueryId], conquery_id: ConqueryId, new_dataset: str) -> ConqueryId:
+    """change_dataset for all ids but datasets, memoized since translation rebases the same ids repeatedly.
+    The type is part of the key as ids of different types can have the same id string."""
+    if conquery_id.get_dataset() == new_dataset:
+        return conquery_id
+    return _intern_id(cls, conquery_id.name, conquery_id.base.change_dataset(new_dataset=new_dataset))
+
+
+def concept_id_from_str(id_string: str) -> Union[ConceptId, ChildId]:
+    """
+    ConceptId or ChildId depending on the number of elements of the string
+    """
+    if id_string.count(conquery_id_separator) == concept_index - 1:
+        return ConceptId.from_str(id_string)
+    return ChildId.from_str(id_string)
+
+
+# (type, name, type of base, id string of base) -> weak reference to the id. The key only holds strings and types,
+# so looking it up does not call ConqueryId.__hash__. Entries of ids that died are swept when the table doubled.
+_interned_ids: Dict[tuple, ref] = dict()
+_interned_ids_sweep_size = 1024
+
+
+def _sweep_interned_ids() -> None:
+    global _interned_ids_sweep_size
+    for key, reference in list(_interned_ids.items()):
+        if reference() is None and _interned_ids.get(key) is reference:
+            _interned_ids.pop(key, None)
+    _interned_ids_sweep_size = max(1024, 2 * len(_interned_ids))
+
+
+def _intern_id(cls: Type[ConqueryId], name: str, base: Optional[ConqueryId]) -> ConqueryId:
+    """Returns the existing id of type cls with name and base or creates it"""
+    key = (cls, name, type(base), None if base is None else base._id)
+    reference = _interned_ids.get(key)
+    if reference is not None:
+        conquery_id = reference()
+        if conquery_id is not None:
+            return conquery_id
+
+    if base is None and not issubclass(cls, DatasetId):
+        raise ValueError(f"Base of {cls.__name__} cannot be None")
+
+    conquery_id = object.__new__(cls)
+    _set_name(conquery_id, name)
+    _set_base(conquery_id, base)
+    _set_id(conquery_id, name if base is None else f"{base._id}{conquery_id_separator}{name}")
+
+    # dict operations are atomic, a thread that created the same id at the same time gets the id stored first
+    new_reference = ref(conquery_id)
+    reference = _interned_ids.setdefault(key, new_reference)
+    if reference is not new_reference:
+        existing_id = reference()
+        if existing_id is not None:
+            return existing_id
+        _interned_ids[key] = new_reference
+    elif len(_interned_ids) > _interned_ids_sweep_size:
+        _sweep_interned_ids()
+    return conquery_id
+
+
+# setters of the slots, ConqueryId.__setattr__ raises
+_set_name = ConqueryId.name.__set__
+_set_base = ConqueryId._base.__set__
+_set_id = ConqueryId._id.__set__
+
+
+id_type_hints = {
+    "dataset": DatasetId,
+    "concept": ConceptId,
+    "connector": ConnectorId,
+    "child": ChildId,
+    "select": SelectId,
+    "concept_select": SelectId,
+    "connector_select": SelectId,
+    "filter": FilterId,
+    "date": DateId
+}
+
+id_type_names = {
+    DatasetId: "dataset",
+    ConceptId: "concept",
+    SecondaryId: "secondary_id",
+    TableId: "table",
+    ColumnId: "column",
+    ConnectorId: "connector",
+    ChildId: "child",
+    FilterId: "filter",
+    DateId: "date"
+}
+
+
+class _IdTrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: Dict[str, _IdTrieNode] = dict()
+        self.ids: Set[ConqueryId] = set()
+
+
+def get_id_type_name(conquery_id: ConqueryId) -> str:
+    if isinstance(conquery_id, SelectId):
+        return "concept_select" if conquery_id.is_concept_select() else "connector_select"
+    return id_type_names[type(conquery_id)]
 
 
 class ConqueryIdCollection:
-    def __init__(self, conquery_ids: Set[ConqueryId] = None):
-        if conquery_ids is None:
-            self.conquery_ids: Set[ConqueryId] = set()
-        else:
-            self.conquery_ids = conquery_ids
+    """
+    Set of ConqueryIds that is additionally stored in a trie over the id segments (dataset, concept, ...),
+    so besides membership also ancestor (has_ancestor) and descendant (get_descendants) queries only take
+    O(depth of the id). Supports len, iteration and the set operators |, & and -.
+    """
+
+    def __init__(self, conquery_ids: Iterable[ConqueryId] = None):
+        self._conquery_ids: Set[ConqueryId] = set()
+        self._root = _IdTrieNode()
+        for conquery_id in conquery_ids or []:
+            self.add(conquery_id)
+
+    @property
+    def conquery_ids(self) -> Set[ConqueryId]:
+        """All ids of the collection, use add/remove to change them"""
+        return self._conquery_ids
 
     def __eq__(self, other):
         if isinstance(other, ConqueryIdCollection):
-            return self.conquery_ids == other.conquery_ids
+            return self._conquery_ids == other._conquery_ids
         raise NotImplementedError
 
-    def is_empty(self):
-        return len(self.conquery_ids) == 0
+    def __len__(self):
+        return len(self._conquery_ids)
 
-    def add(self, conquery_id: ConqueryId):
-        self.conquery_ids.add(conquery_id)
+    def __iter__(self) -> Iterator[ConqueryId]:
+        return iter(self._conquery_ids)
 
-    def update(self, other: ConqueryIdCollection):
-        if isinstance(other, ConqueryIdCollection):
-            for conquery_id in other.conquery_ids:
-                self.add(conquery_id)
-        else:
-            raise NotImplementedError
+    def __contains__(self, conquery_id: ConqueryId) -> bool:
+        return conquery_id in self._conquery_ids
 
-    def create_label_dicts(self, concepts: dict):
-        # TODO implement
-        pass
+    def __or__(self, other: ConqueryIdCollection) -> ConqueryIdCollection:
+        return ConqueryIdCollection(self._conquery_ids | other.conquery_ids)
+
+    def __and__(self, other: ConqueryIdCollection) -> ConqueryIdCollection:
+        return ConqueryIdCollection(self._conquery_ids & other.conquery_ids)
+
+    def __sub__(self, other: ConqueryIdCollection) -> ConqueryIdCollection:
+        return ConqueryIdCollection(self._conquery_ids - other.conquery_ids)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({sorted(conquery_id.id for conquery_id in self._conquery_ids)})"
+
+    def is_empty(self):
+        return len(self._conquery_ids) == 0
+
+    def add(self, conquery_id: ConqueryId):
+        if conquery_id in self._conquery_ids:
+            return
+
+        self._conquery_ids.add(conquery_id)
+        node = self._root
+        for segment in conquery_id.id.split(conquery_id_separator):
+            node = node.children.setdefault(segment, _IdTrieNode())
+        node.ids.add(conquery_id)
+
+    def remove(self, conquery_id: ConqueryId):
+        """Raises KeyError if conquery_id is not in the collection"""
+        self._conquery_ids.remove(conquery_id)
+
+        path = [self._root]
+        segments = conquery_id.id.split(conquery_id_separator)
+        for segment in segments:
+            path.append(path[-1].children[segment])
+        path[-1].ids.discard(conquery_id)
+
+        # prune nodes that neither hold ids nor lead to any
+        for parent, segment, node in zip(reversed(path[:-1]), reversed(segments), reversed(path[1:])):
+            if node.ids or node.children:
+                break
+            del parent.children[segment]
+
+    def update(self, other: Union[ConqueryIdCollection, Iterable[ConqueryId]]):
+        for conquery_id in other:
+            self.add(conquery_id)
+
+    def _find_node(self, conquery_id: ConqueryId) -> Optional[_IdTrieNode]:
+        node = self._root
+        for segment in conquery_id.id.split(conquery_id_separator):
+            node = node.children.get(segment)
+            if node is None:
+                return None
+        return node
+
+    def has_ancestor(self, conquery_id: ConqueryId) -> bool:
+        """True if the collection contains conquery_id or an id conquery_id is a child of"""
+        node = self._root
+        for segment in conquery_id.id.split(conquery_id_separator):
+            node = node.children.get(segment)
+            if node is None:
+                return False
+            if node.ids:
+                return True
+        return False
+
+    def get_descendants(self, conquery_id: ConqueryId) -> List[ConqueryId]:
+        """All ids of the collection that are conquery_id or a child of it"""
+        node = self._find_node(conquery_id)
+        if node is None:
+            return []
+
+        descendants = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            descendants.extend(node.ids)
+            stack.extend(node.children.values())
+        return descendants
+
+    def create_label_dicts(self, concepts: dict) -> Dict[str, Dict[str, Optional[str]]]:
+        """
+        Labels of all ids grouped by id type, e.g. {"connector": {"dataset1.icd.arzt": "ICD - Arzt"}}.
+        Ids that can not be found in concepts get the label None. Labels are cached per concepts object.
+        """
+        catalogue = get_catalogue(concepts)
+        label_dicts: Dict[str, Dict[str, Optional[str]]] = dict()
+        for conquery_id in sorted(self._conquery_ids, key=lambda conquery_id: conquery_id.id):
+            label_dicts.setdefault(get_id_type_name(conquery_id), dict())[conquery_id.id] = \
+                catalogue.get_id_label(conquery_id)
+        return label_dicts
+
+    def create_label_table(self, concepts: dict) -> pd.DataFrame:
+        """DataFrame with columns id, type and label of all ids, see create_label_dicts"""
+        rows = [(conquery_id, id_type, label)
+                for id_type, labels in self.create_label_dicts(concepts=concepts).items()
+                for conquery_id, label in labels.items()]
+        # object dtype keeps None for unknown labels
+        return pd.DataFrame(rows, columns=["id", "type", "label"], dtype=object).sort_values("id", ignore_index=True)
 
     def print_id_labels_as_table(self, concepts: dict):
-        # TODO implement
-        pass
+        print(self.create_label_table(concepts=concepts).to_markdown(index=False))
 
 
 def get_copy_of_id_with_changed_dataset(new_dataset: str, conquery_id: ConqueryId):
     """
-    Creates a copy and then changes the dataset and returns the new ConqueryId
+    Returns the ConqueryId with changed dataset. Ids are immutable, so no copy is needed and
+    conquery_id itself is not changed.
     """
-    new_conquery_id = conquery_id.deepcopy()
-    new_conquery_id.change_dataset(new_dataset=new_dataset)
-    return new_conquery_id
+    return conquery_id.change_dataset(new_dataset=new_dataset)
 
 
 def get_dataset_from_id_string(id_string: str) -> str:
@@ -1,9 +1,12 @@
 import sys
+import threading
 from typing import List
 
 this_module = sys.modules[__name__]
 
 this_module.dataset_list = None
+# the list is replaced, never modified in place, so readers need no lock
+_lock = threading.Lock()
 
 
 def set_dataset_list(dataset_list: List[str]) -> None:
@@ -11,7 +14,8 @@ def set_dataset_list(dataset_list: List[str]) -> None:
         if not isinstance(dataset, str):
             raise ValueError(f"dataset entry must be of type str, not {type(dataset)} - {dataset}")
 
-    this_module.dataset_list = list(set(dataset_list))
+    with _lock:
+        this_module.dataset_list = list(set(dataset_list))
 
 
 def set_test_datasets():
@@ -32,7 +36,14 @@ def add_to_dataset_list(dataset: str) -> None:
     if not isinstance(dataset, str):
         raise ValueError(f"{dataset=} must be of type str, not {type(dataset)}")
 
-    if _dataset_list_set():
-        this_module.dataset_list = list({*this_module.dataset_list, dataset})
-    else:
-        this_module.dataset_list = [dataset]
+    extend_dataset_list([dataset])
+
+
+def extend_dataset_list(dataset_list: List[str]) -> None:
+    """Adds datasets to the list of known datasets, e.g. the datasets of another connection"""
+    for dataset in dataset_list:
+        if not isinstance(dataset, str):
+            raise ValueError(f"dataset entry must be of type str, not {type(dataset)} - {dataset}")
+
+    with _lock:
+        this_module.dataset_list = list({*(this_module.dataset_list or []), *dataset_list})
@@ -21,3 +21,7 @@ class ConqueryClientConnectionError(CqApiError):
 
 class QueryNotFoundError(BaseException):
     pass
+
+
+class QueryTimeoutError(CqApiError, TimeoutError):
+    """Raised when a query does not finish in time, caught by ``except Exception`` like other expected errors"""
@@ -2,10 +2,11 @@ from __future__ import annotations
 from cqapi.namespace import Keys, QueryType
 from cqapi.queries.utils import remove_null_values, get_start_end_date
 from cqapi.conquery_ids import ConqueryId, ConqueryIdCollection, ConceptId, ConnectorId, ChildId, DateId, SelectId, \
-    get_copy_of_id_with_changed_dataset, FilterId, conquery_id_separator, get_dataset_from_id_string, \
-    get_concept_id_from_id_string, SecondaryId
+    get_copy_of_id_with_changed_dataset, FilterId, get_dataset_from_id_string, SecondaryId, concept_id_from_str
 from cqapi.search_conquery_id import find_concept_id
-from typing import List, Union, Tuple, Type, Optional
+from cqapi.catalogue import get_catalogue
+from cqapi.queries.serialization import Tracked, canonical_json, mutates, start_tracking
+from typing import List, Mapping, Union, Tuple, Type, Optional
 from copy import deepcopy
 from cqapi.exceptions import SavedQueryTranslationError, ExternalQueryTranslationError
 import attr
@@ -23,15 +24,41 @@ def validate_children_queries(instance, attribute, value):
         validate_root_child_query(instance, attribute, value_entry)
 
 
-@attr.s(auto_attribs=True, kw_only=True)
-class QueryObject:
-    """Base Class of all query elements"""
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
+class QueryObject(Tracked):
+    """Base Class of all query elements
+
+    Query objects are equal if their canonical json is equal. The canonical json and its hash are cached per object
+    and dropped when the object or anything it contains is modified. The hash changes with the content, so do not
+    modify query objects while they are in a set or used as dict key.
+    """
     row_prefix: str = attr.ib(None, init=False)
     query_type: QueryType
     label: str = None
 
     def __eq__(self, other):
-        return isinstance(other, QueryObject) and self.to_dict() == other.to_dict()
+        if self is other:
+            return True
+        if not isinstance(other, QueryObject):
+            return False
+        value, value_hash = self._get_canonical_json()
+        other_value, other_hash = other._get_canonical_json()
+        return value_hash == other_hash and value == other_value
+
+    def __hash__(self):
+        return self._get_canonical_json()[1]
+
+    def canonical_json(self) -> bytes:
+        """to_dict() as compact json with sorted keys and without null values, cached while self is unchanged"""
+        return self._get_canonical_json()[0]
+
+    def _get_canonical_json(self) -> Tuple[bytes, int]:
+        cached = self.__dict__.get("_canonical_json")
+        if cached is None:
+            start_tracking(self)
+            value = canonical_json(self.to_dict())
+            cached = self.__dict__["_canonical_json"] = (value, hash(value))
+        return cached
 
     def copy(self):
         return QueryObject(query_type=self.query_type, label=self.label)
@@ -183,7 +210,7 @@ class QueryDescription(QueryObject):
     def get_connector_ids(self):
         raise NotImplementedError()
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class SingleRootQueryDescription(QueryDescription):
     root: QueryObject = attr.ib(validator=validate_root_child_query)
     date_aggregation_mode: str = None
@@ -253,7 +280,7 @@ class SingleRootQueryDescription(QueryDescription):
         self.root.remove_all_tables_but(connector_ids=connector_ids)
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class SingleChildQueryObject(QueryObject):
     """
     Base Class for all query elements that have one sub-query element with key "root" or "child":
@@ -319,7 +346,7 @@ class SingleChildQueryObject(QueryObject):
         self.child.remove_all_tables_but(connector_ids=connector_ids)
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class ConceptQuery(SingleRootQueryDescription):
     query_type: QueryType = attr.ib(QueryType.CONCEPT_QUERY, init=False)
 
@@ -352,7 +379,7 @@ class ConceptQuery(SingleRootQueryDescription):
         )
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class SecondaryIdQuery(SingleRootQueryDescription):
     query_type: QueryType = attr.ib(QueryType.SECONDARY_ID_QUERY, init=False)
     secondary_id: SecondaryId = None
@@ -450,7 +477,7 @@ class DateRestriction(SingleChildQueryObject):
         }
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class Negation(SingleChildQueryObject):
     query_type: QueryType = attr.ib(QueryType.NEGATION, init=False)
     child: QueryObject
@@ -490,7 +517,7 @@ class Negation(SingleChildQueryObject):
         }
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class AndOrElement(QueryObject):
     """
     Base class for query elements that have multiple sub query elements ("children").
@@ -600,7 +627,7 @@ class AndOrElement(QueryObject):
         return [concept_element for child in self.children for concept_element in child.get_concept_elements()]
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class AndElement(AndOrElement):
     query_type: QueryType = attr.ib(QueryType.AND, init=False)
     children: List[QueryObject]
@@ -650,7 +677,7 @@ class AndElement(AndOrElement):
         )
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class OrElement(AndOrElement):
     query_type: QueryType = attr.ib(QueryType.OR, init=False)
     children: List[QueryObject]
@@ -700,7 +727,7 @@ class OrElement(AndOrElement):
         )
 
 
-class ConceptTable:
+class ConceptTable(Tracked):
     """ Table/Connectors for query element CONCEPT"""
 
     def __init__(self, connector_id: ConnectorId, date_column_id: DateId = None,
@@ -713,7 +740,7 @@ class ConceptTable:
 
     def copy(self):
         return ConceptTable(connector_id=self.connector_id, date_column_id=self.date_column_id,
-                            select_ids=deepcopy(self.selects), filter_objs=deepcopy(self.filters))
+                            select_ids=list(self.selects), filter_objs=deepcopy(self.filters))
 
     def set_date_column_id(self, date_column_id: DateId):
         if not isinstance(date_column_id, DateId):
@@ -721,6 +748,7 @@ class ConceptTable:
         if date_column_id.get_connector_id() == self.connector_id:
             self.date_column_id = date_column_id
 
+    @mutates
     def add_select(self, select_id: SelectId):
         self.selects.append(select_id)
 
@@ -728,12 +756,14 @@ class ConceptTable:
         if select_ids is None:
             self.selects = list()
         else:
+            select_ids = ConqueryIdCollection(select_ids)
             self.selects = [select for select in self.selects if not select.is_in_id_list(select_ids)]
 
     def add_selects(self, select_ids: List[SelectId]):
         for select_id in select_ids:
             self.add_select(select_id=select_id)
 
+    @mutates
     def add_filter(self, filter_obj: dict):
         self.filters.append(filter_obj)
 
@@ -741,6 +771,7 @@ class ConceptTable:
         for filter_obj in filter_objs:
             self.add_filter(filter_obj=filter_obj)
 
+    @mutates
     def remove_filters(self, filter_objs: List[dict]):
         for filter_obj in filter_objs:
             self.filters.remove(filter_obj)
@@ -755,38 +786,33 @@ class ConceptTable:
                                                                conquery_id=self.connector_id)
 
         # get table from concepts
-        table_list = [table for table in concepts[new_root_concept_id.id]["tables"]
-                      if ConnectorId.from_str(table["connectorId"]) == new_connector_id]
-        if len(table_list) == 0:
-            removed_ids.add(self.connector_id.deepcopy())
+        catalogue = get_catalogue(concepts)
+        table = catalogue.get_concept(new_root_concept_id.id).connectors.get(new_connector_id.id)
+        if table is None:
+            removed_ids.add(self.connector_id)
             return None, None
 
-        table = table_list[0]
-
         # translate date column
         date_column_id = self.date_column_id
         new_date_column_id = None
         if self.date_column_id is not None:
             new_date_column_id = get_copy_of_id_with_changed_dataset(new_dataset=new_dataset,
                                                                      conquery_id=self.date_column_id)
-            table_date_column_ids = [DateId.from_str(date_column_obj[Keys.value])
-                                     for date_column_obj in table[Keys.date_column][Keys.options]]
-            if new_date_column_id.is_in_id_list(table_date_column_ids):
+            if new_date_column_id.id in table.date_columns:
                 date_column_id = self.date_column_id
             else:
-                removed_ids.add(self.date_column_id.deepcopy())
+                removed_ids.add(self.date_column_id)
 
         # translate connector selects
         selects = list()
         new_selects = list()
         for select_id in self.selects:
             new_select_id = get_copy_of_id_with_changed_dataset(new_dataset=new_dataset, conquery_id=select_id)
-            if new_select_id.is_in_id_list([SelectId.from_str(table_select[Keys.id])
-                                            for table_select in table[Keys.selects]]):
+            if new_select_id.id in table.selects:
                 selects.append(select_id)
                 new_selects.append(new_select_id)
             else:
-                removed_ids.add(select_id.deepcopy())
+                removed_ids.add(select_id)
 
         filter_objs = list()
         new_filter_objs = list()
@@ -795,14 +821,13 @@ class ConceptTable:
         for filter_obj in self.filters:
             new_filter_id = get_copy_of_id_with_changed_dataset(new_dataset=new_dataset,
                                                                 conquery_id=filter_obj[Keys.filter])
-            if new_filter_id.is_in_id_list([FilterId.from_str(table_filter[Keys.id])
-                                            for table_filter in table[Keys.filters]]):
+            if new_filter_id.id in table.filters:
                 filter_objs.append(deepcopy(filter_obj))
                 new_filter_obj = deepcopy(filter_obj)
                 new_filter_obj[Keys.filter] = new_filter_id
                 new_filter_objs.append(new_filter_obj)
             else:
-                removed_ids.add(filter_obj[Keys.filter].deepcopy())
+                removed_ids.add(filter_obj[Keys.filter])
 
         new_table = ConceptTable(connector_id=new_connector_id,
                                  date_column_id=new_date_column_id,
@@ -820,11 +845,7 @@ class ConceptTable:
     def write_table(self) -> dict:
         date_column = {Keys.value: self.date_column_id.id} if self.date_column_id is not None else None
 
-        filters = list()
-        for filter_element in self.filters:
-            new_filter_element = deepcopy(filter_element)
-            new_filter_element[Keys.filter] = new_filter_element[Keys.filter].id
-            filters.append(new_filter_element)
+        filters = [{**filter_element, Keys.filter: filter_element[Keys.filter].id} for filter_element in self.filters]
 
         return {
             Keys.id: self.connector_id.id,
@@ -866,17 +887,11 @@ class ConceptElement(QueryObject):
                                selects=connector_selects, filter_objs=filter_objs,
                                validity_date_ids=validity_date_ids)
 
-    def __eq__(self, other):
-        if isinstance(other, ConceptElement):
-            return set(self.ids) == set(other.ids) and \
-                   self._exclude_from_time_aggregation == other._exclude_from_time_aggregation and \
-                   set(self.selects) == set(other.selects)
-
     def copy(self):
         return ConceptElement(ids=self.ids, tables=[table.copy() for table in self.tables],
                               exclude_from_secondary_id=self._exclude_from_secondary_id,
                               exclude_from_time_aggregation=self._exclude_from_time_aggregation,
-                              concept_selects=deepcopy(self.selects),
+                              concept_selects=list(self.selects),
                               label=self.label)
 
     def translate(self, concepts: dict, removed_ids: ConqueryIdCollection,
@@ -901,7 +916,7 @@ class ConceptElement(QueryObject):
                 new_concept_ids.append(new_concept_id)
                 concept_ids.append(concept_id)
             else:
-                removed_ids.add(concept_id.deepcopy())
+                removed_ids.add(concept_id)
         if not concept_ids:
             return None, None
 
@@ -912,13 +927,11 @@ class ConceptElement(QueryObject):
             new_concept_select_id = get_copy_of_id_with_changed_dataset(new_dataset=new_dataset,
                                                                         conquery_id=concept_select_id)
             new_root_concept_id = new_concept_select_id.get_concept_id()
-            if new_concept_select_id.is_in_id_list([SelectId.from_str(select[Keys.id])
-                                                    for select in concepts[new_root_concept_id.id].get(
-                    Keys.selects, [])]):
+            if new_concept_select_id.id in get_catalogue(concepts).get_concept(new_root_concept_id.id).selects:
                 new_concept_select_ids.append(new_concept_select_id)
                 concept_select_ids.append(concept_select_id)
             else:
-                removed_ids.add(concept_select_id.deepcopy())
+                removed_ids.add(concept_select_id)
 
         # translate tables
         new_tables = []
@@ -958,8 +971,7 @@ class ConceptElement(QueryObject):
                 if isinstance(date_column_id, str):
                     date_column_id = DateId.from_str(date_column_id)
 
-            select_ids = [SelectId.from_str(select_id) if isinstance(select_id, str) else select_id
-                          for select_id in query_table.get(Keys.selects)] \
+            select_ids = SelectId.from_strs(query_table.get(Keys.selects)) \
                 if query_table.get(Keys.selects) else None
 
             filter_objs = query_table.get(Keys.filters)
@@ -977,11 +989,9 @@ class ConceptElement(QueryObject):
                                        select_ids=select_ids,
                                        filter_objs=new_filter_objs))
 
-        ids = [ConceptId.from_str(id_string) if len(id_string.split(conquery_id_separator)) == 2 else
-               ChildId.from_str(id_string) for id_string in query[Keys.ids]] if isinstance(query[Keys.ids][0], str) \
-            else query[Keys.ids]
-        concept_selects = [SelectId.from_str(id_string) if isinstance(id_string, str) else id_string
-                           for id_string in query.get(Keys.selects, [])]
+        ids = [concept_id_from_str(id_string) for id_string in query[Keys.ids]] \
+            if isinstance(query[Keys.ids][0], str) else query[Keys.ids]
+        concept_selects = SelectId.from_strs(query.get(Keys.selects, []))
 
         return cls(ids=ids,
                    label=query.get(Keys.label),
@@ -997,10 +1007,14 @@ class ConceptElement(QueryObject):
             self.create_tables(concept=concepts[connector_id.get_concept_id().id],
                                connector_ids=[connector_id])
 
+    @mutates
     def create_tables(self, concept: dict, connector_ids: List[ConnectorId] = None,
                       selects: List[SelectId] = None, filter_objs: List[dict] = None,
                       validity_date_ids: List[DateId] = None):
 
+        if connector_ids is not None:
+            connector_ids = ConqueryIdCollection(connector_ids)
+
         for table in concept[Keys.tables]:
             table_connector_id = ConnectorId.from_str(table[Keys.connector_id])
             if connector_ids is not None and not table_connector_id.is_in_id_list(connector_ids):
@@ -1036,6 +1050,7 @@ class ConceptElement(QueryObject):
         for table in self.tables:
             table.remove_selects(select_ids=connector_select_ids)
 
+    @mutates
     def add_concept_select(self, select_id: SelectId):
         if self.ids[0].get_concept_id() == select_id.get_concept_id():
             self.selects.append(select_id)
@@ -1044,6 +1059,7 @@ class ConceptElement(QueryObject):
         if concept_select_ids is None:
             self.selects = list()
         else:
+            concept_select_ids = ConqueryIdCollection(concept_select_ids)
             self.selects = [select for select in self.selects if not select.is_in_id_list(concept_select_ids)]
 
     def add_filter(self, filter_obj: dict) -> None:
@@ -1083,6 +1099,7 @@ class ConceptElement(QueryObject):
                        if not table.connector_id == connector_id]
 
     def remove_all_tables_but(self, connector_ids: List[ConnectorId]):
+        connector_ids = ConqueryIdCollection(connector_ids)
         self.tables = [table
                        for table in self.tables
                        if table.connector_id.is_in_id_list(connector_ids)]
@@ -1124,7 +1141,7 @@ class SimpleQuery(QueryObject):
         pass
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class SavedQuery(SimpleQuery):
     query_type: QueryType = attr.ib(QueryType.SAVED_QUERY, init=False)
     query_id: str
@@ -1160,7 +1177,7 @@ class SavedQuery(SimpleQuery):
         )
 
 
-@attr.s(auto_attribs=True, kw_only=True)
+@attr.s(auto_attribs=True, kw_only=True, eq=False)
 class External(SimpleQuery):
     format_list: List[str]
     values: List[List[str]]
@@ -1225,7 +1242,7 @@ def create_query_obj_list(queries: List[dict]) -> List[QueryObject]:
 
 @typechecked
 def create_query(concept_id: Union[str, ConceptId, ChildId, List[str], List[ConceptId], List[ChildId], list],
-                 concepts: dict,
+                 concepts: Mapping,
                  concept_query: bool = False,
                  secondary_id: Optional[Union[str, SecondaryId]] = None,
                  connector_ids: Union[List[ConnectorId], List[str]] = None,
@@ -1243,27 +1260,17 @@ def create_query(concept_id: Union[str, ConceptId, ChildId, List[str], List[Conc
     else:
         concept_ids = concept_id
 
-    for index, concept_element in enumerate(concept_ids):
-        if isinstance(concept_element, str):
-            if get_concept_id_from_id_string(id_string=concept_element) == concept_element:
-                concept_ids[index] = ConceptId.from_str(concept_element)
-            else:
-                concept_ids[index] = ChildId.from_str(concept_element)
+    concept_ids[:] = [concept_id_from_str(concept_element) if isinstance(concept_element, str) else concept_element
+                      for concept_element in concept_ids]
 
     if connector_ids:
-        for index, connector_element in enumerate(connector_ids):
-            if isinstance(connector_element, str):
-                connector_ids[index] = ConnectorId.from_str(connector_element)
+        connector_ids[:] = ConnectorId.from_strs(connector_ids)
 
     if concept_select_ids:
-        for index, concept_select_element in enumerate(concept_select_ids):
-            if isinstance(concept_select_element, str):
-                concept_select_ids[index] = SelectId.from_str(concept_select_element)
+        concept_select_ids[:] = SelectId.from_strs(concept_select_ids)
 
     if connector_select_ids:
-        for index, connector_select_element in enumerate(connector_select_ids):
-            if isinstance(connector_select_element, str):
-                connector_select_ids[index] = SelectId.from_str(connector_select_element)
+        connector_select_ids[:] = SelectId.from_strs(connector_select_ids)
 
     if filter_objs:
         for index, filter_obj_element in enumerate(filter_objs):
@@ -0,0 +1,224 @@
+"""Bulk translation of stored queries from one dataset to another"""
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import attr
+
+from cqapi.api import ConqueryConnection
+from cqapi.conquery_ids import ConqueryIdCollection, concept_id_from_str
+from cqapi.exceptions import QueryTranslationError
+from cqapi.queries.base_elements import create_query_obj
+from cqapi.queries.translation import check_concept_ids_in_concepts_for_new_dataset, \
+    get_concept_ids_available_in_new_dataset
+
+
+@attr.s(auto_attribs=True)
+class QueryMigrationReport:
+    """Outcome of migrating one stored query. error is set if the query could not be translated or executed."""
+    query_id: str
+    new_query_id: Optional[str] = None
+    removed_ids: List[str] = attr.ib(factory=list)
+    error: Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+    def to_dict(self) -> dict:
+        return attr.asdict(self)
+
+    @classmethod
+    def from_dict(cls, report: dict) -> QueryMigrationReport:
+        return cls(**report)
+
+
+def read_checkpoint(checkpoint_path: str) -> Dict[str, QueryMigrationReport]:
+    """Reports by query id of a checkpoint file (json lines), later lines overwrite earlier ones"""
+    reports = dict()
+    if not os.path.exists(checkpoint_path):
+        return reports
+
+    with open(checkpoint_path, encoding="utf-8") as checkpoint:
+        for line in checkpoint:
+            try:
+                report = QueryMigrationReport.from_dict(json.loads(line))
+            except (ValueError, TypeError):
+                # last line of an interrupted run
+                continue
+            reports[report.query_id] = report
+    return reports
+
+
+# concepts of the new dataset in the worker processes, sent once by the pool initializer
+_worker_concepts: Optional[dict] = None
+
+
+def _init_worker(concepts: dict) -> None:
+    global _worker_concepts
+    _worker_concepts = concepts
+
+
+def _get_concept_ids_to_check(query: dict, new_dataset: str, concepts: dict = None) -> List[str]:
+    """Concept ids of query that have to be looked up in the new dataset"""
+    return [concept_id.id for concept_id in
+            get_concept_ids_available_in_new_dataset(queries=[create_query_obj(query)], new_dataset=new_dataset,
+                                                     concepts=concepts if concepts is not None else _worker_concepts)]
+
+
+def _translate(query: dict, children_ids: List[str], concepts: dict = None) -> Tuple[Optional[dict], List[str]]:
+    """Returns the translated query as dict (None if nothing is left after translation) and the removed ids"""
+    removed_ids = ConqueryIdCollection()
+    new_query, _ = create_query_obj(query).translate(
+        concepts=concepts if concepts is not None else _worker_concepts,
+        removed_ids=removed_ids,
+        children_ids=ConqueryIdCollection(concept_id_from_str(child_id) for child_id in children_ids))
+
+    return (new_query.to_dict() if new_query is not None else None), sorted(str(removed_id)
+                                                                            for removed_id in removed_ids)
+
+
+def _error_message(error: Exception) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+def migrate_stored_queries(source: Union[str, Iterable[str]], new_dataset: str, conquery_conn: ConqueryConnection,
+                           concepts_new_dataset: dict = None, checkpoint_path: str = None,
+                           max_processes: Optional[int] = None, max_in_flight: int = 8, chunk_size: int = 64,
+                           keep_labels: bool = True) -> Iterator[QueryMigrationReport]:
+    """Translates stored queries to new_dataset and executes them there.
+    Yields one QueryMigrationReport per query as soon as its chunk is done.
+
+    Queries are processed in chunks of chunk_size: the queries of a chunk are requested concurrently, parsed and
+    translated in a process pool, the children concepts of all queries of the chunk are requested once, and the
+    translated queries are executed with at most max_in_flight requests at the same time.
+    A query that can not be translated or executed does not stop the migration, its report holds the error.
+
+    :param source: dataset whose stored queries are migrated or the ids of the stored queries
+    :param concepts_new_dataset: concepts of new_dataset, requested if not given
+    :param checkpoint_path: every report is appended to this json lines file. Queries that already succeeded
+                            according to the file are skipped, so an interrupted migration can be resumed.
+    :param max_processes: number of worker processes for parsing and translating, default is the number of CPUs.
+                          0 translates in the calling process.
+    :param keep_labels: label the new queries like the stored queries
+    """
+    if max_in_flight < 1 or chunk_size < 1:
+        raise ValueError(f"{max_in_flight=} and {chunk_size=} must be positive")
+
+    if concepts_new_dataset is None:
+        concepts_new_dataset = conquery_conn.get_concepts(dataset=new_dataset)
+
+    if isinstance(source, str):
+        query_ids = (query_info["id"] for query_info in conquery_conn.get_stored_queries(dataset=source))
+    else:
+        query_ids = iter(source)
+
+    done: Set[str] = set()
+    if checkpoint_path is not None:
+        done = {query_id for query_id, report in read_checkpoint(checkpoint_path).items() if report.succeeded}
+    query_ids = (query_id for query_id in query_ids if query_id not in done)
+
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8") if checkpoint_path is not None else None
+    process_pool = ProcessPoolExecutor(max_workers=max_processes, initializer=_init_worker,
+                                       initargs=(concepts_new_dataset,)) if max_processes != 0 else None
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as thread_pool:
+            while True:
+                chunk = list(islice(query_ids, chunk_size))
+                if not chunk:
+                    break
+
+                for report in _migrate_chunk(chunk, new_dataset=new_dataset, conquery_conn=conquery_conn,
+                                             concepts=concepts_new_dataset, thread_pool=thread_pool,
+                                             process_pool=process_pool, keep_labels=keep_labels):
+                    if checkpoint is not None:
+                        checkpoint.write(json.dumps(report.to_dict()) + "\n")
+                        checkpoint.flush()
+                    yield report
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def _migrate_chunk(query_ids: List[str], new_dataset: str, conquery_conn: ConqueryConnection, concepts: dict,
+                   thread_pool: Executor, process_pool: Optional[Executor],
+                   keep_labels: bool) -> List[QueryMigrationReport]:
+    reports = {query_id: QueryMigrationReport(query_id=query_id) for query_id in query_ids}
+
+    def fetch(query_id: str):
+        try:
+            return conquery_conn.get_query_info(query_id)
+        except Exception as error:
+            reports[query_id].error = _error_message(error)
+
+    query_infos = {query_id: query_info for query_id, query_info in zip(query_ids, thread_pool.map(fetch, query_ids))
+                   if query_info is not None}
+
+    # parse and collect the concept ids that have to be looked up in the concept trees of the new dataset
+    if process_pool is not None:
+        concept_ids_futures = {query_id: process_pool.submit(_get_concept_ids_to_check, query_info["query"],
+                                                             new_dataset)
+                               for query_id, query_info in query_infos.items()}
+
+    concept_ids = set()
+    for query_id, query_info in list(query_infos.items()):
+        try:
+            if process_pool is not None:
+                query_concept_ids = concept_ids_futures[query_id].result()
+            else:
+                query_concept_ids = _get_concept_ids_to_check(query_info["query"], new_dataset, concepts)
+        except Exception as error:
+            reports[query_id].error = _error_message(error)
+            del query_infos[query_id]
+            continue
+        concept_ids.update(query_concept_ids)
+
+    try:
+        children_ids = [str(child_id) for child_id in check_concept_ids_in_concepts_for_new_dataset(
+            concept_ids=[concept_id_from_str(concept_id) for concept_id in sorted(concept_ids)],
+            new_dataset=new_dataset, conquery_conn=conquery_conn)]
+    except Exception as error:
+        for query_id in query_infos:
+            reports[query_id].error = _error_message(error)
+        return list(reports.values())
+
+    # translate
+    if process_pool is not None:
+        translation_futures = {query_id: process_pool.submit(_translate, query_info["query"], children_ids)
+                               for query_id, query_info in query_infos.items()}
+    translated_queries = dict()
+    for query_id, query_info in query_infos.items():
+        try:
+            if process_pool is not None:
+                new_query, removed_ids = translation_futures[query_id].result()
+            else:
+                new_query, removed_ids = _translate(query_info["query"], children_ids, concepts)
+        except Exception as error:
+            reports[query_id].error = _error_message(error)
+            continue
+
+        reports[query_id].removed_ids = removed_ids
+        if new_query is None:
+            reports[query_id].error = _error_message(QueryTranslationError("Nothing left after translation"))
+            continue
+        translated_queries[query_id] = new_query
+
+    # execute
+    def execute(query_id: str):
+        try:
+            reports[query_id].new_query_id = conquery_conn.execute_query(
+                translated_queries[query_id], dataset=new_dataset,
+                label=query_infos[query_id].get("label") if keep_labels else None)
+        except Exception as error:
+            reports[query_id].error = _error_message(error)
+
+    list(thread_pool.map(execute, translated_queries))
+
+    return list(reports.values())
+
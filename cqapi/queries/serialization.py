@@ -0,0 +1,280 @@
+"""Canonical json of queries: keys sorted, null values removed, compact and byte-stable.
+
+Serialized with orjson if it is installed, with the json module otherwise.
+"""
+from __future__ import annotations
+
+import json
+from functools import wraps
+from operator import itemgetter
+from typing import Any, Callable, Dict, TypeVar
+from weakref import ref
+
+from cqapi.conquery_ids import ConqueryId
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+F = TypeVar("F", bound=Callable)
+
+# attributes of tracked objects that are not part of their content
+_internal_attributes = ("_parents", "_canonical_json")
+
+
+def mark_mutated(obj: Tracked) -> None:
+    """Drops the cached canonical json of obj and of all tracked objects containing it"""
+    obj.__dict__.pop("_canonical_json", None)
+    if not obj.__dict__.get("_parents"):
+        return
+
+    stack = [obj]
+    seen = set()
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        current.__dict__.pop("_canonical_json", None)
+        for parent_ref in current.__dict__.get("_parents", {}).values():
+            parent = parent_ref()
+            if parent is not None:
+                stack.append(parent)
+
+
+def mutates(method: F) -> F:
+    """Decorator for methods that modify their object in place"""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            mark_mutated(self)
+
+    return wrapper
+
+
+# kind of values by class: 0 not tracked, 1 tracked object, 2 list, 3 dict
+_kinds: Dict[type, int] = dict()
+
+
+def _get_kind(value_type: type) -> int:
+    kind = _kinds.get(value_type)
+    if kind is None:
+        kind = _kinds[value_type] = (1 if issubclass(value_type, Tracked) else 2 if issubclass(value_type, list)
+                                     else 3 if issubclass(value_type, dict) else 0)
+    return kind
+
+
+def track(value: Any, owner: Tracked) -> Any:
+    """value as content of owner: lists and dicts are copied to tracked lists and dicts that report in place changes
+    to owner, tracked objects are linked to owner and start tracking their own content"""
+    kind = _get_kind(type(value))
+    if kind == 0:
+        return value
+    if kind == 1:
+        # keyed by id, a link to a dead owner whose id was reused is replaced
+        start_tracking(value)
+        value.__dict__["_parents"][id(owner)] = ref(owner)
+        return value
+    if kind == 2:
+        if isinstance(value, TrackedList) and value._owner() is owner:
+            return value
+        return TrackedList(owner, value)
+    if isinstance(value, TrackedDict) and value._owner() is owner:
+        return value
+    return TrackedDict(owner, value)
+
+
+def start_tracking(obj: Tracked) -> None:
+    """Tracks the content of obj and everything it contains, done before the canonical json of obj is cached.
+
+    Objects without cached canonical json anywhere above them do not need to report changes, so building queries
+    does not pay for the tracking.
+    """
+    if "_parents" in obj.__dict__:
+        return
+    obj.__dict__["_parents"] = dict()
+    for name, value in list(obj.__dict__.items()):
+        if name not in _internal_attributes and _kinds.get(type(value)) != 0:
+            obj.__dict__[name] = track(value, obj)
+
+
+class Tracked:
+    """Base of objects that drop their cached canonical json when they or anything they contain are modified.
+
+    Once tracked (see start_tracking), attribute values are passed through track, so assignments and in place
+    changes of lists and dicts invalidate the object and all tracked objects containing it in O(depth).
+    """
+
+    def __setattr__(self, name, value):
+        if "_parents" not in self.__dict__:
+            object.__setattr__(self, name, value)
+            return
+        object.__setattr__(self, name, track(value, self))
+        mark_mutated(self)
+
+    def __getstate__(self):
+        return {name: value for name, value in self.__dict__.items() if name not in _internal_attributes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class TrackedList(list):
+    """list that invalidates its owner on in place changes, copied and pickled as plain list"""
+    __slots__ = ("_owner",)
+
+    def __init__(self, owner: Tracked, values=()):
+        self._owner = ref(owner)
+        super().__init__(values)
+        for index, value in enumerate(self):
+            # most entries are ids or strings that are not tracked
+            if _kinds.get(type(value)) != 0:
+                list.__setitem__(self, index, track(value, owner))
+
+    def _changed(self) -> None:
+        owner = self._owner()
+        if owner is not None:
+            mark_mutated(owner)
+
+    def _track(self, value):
+        owner = self._owner()
+        return track(value, owner) if owner is not None else value
+
+    def __reduce_ex__(self, protocol):
+        return list, (list(self),)
+
+    def __setitem__(self, index, value):
+        value = [self._track(entry) for entry in value] if isinstance(index, slice) else self._track(value)
+        super().__setitem__(index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._changed()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, factor):
+        super().__imul__(factor)
+        self._changed()
+        return self
+
+    def append(self, value):
+        super().append(self._track(value))
+        self._changed()
+
+    def extend(self, values):
+        super().extend(self._track(value) for value in values)
+        self._changed()
+
+    def insert(self, index, value):
+        super().insert(index, self._track(value))
+        self._changed()
+
+    def pop(self, index=-1):
+        value = super().pop(index)
+        self._changed()
+        return value
+
+    def remove(self, value):
+        super().remove(value)
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        super().reverse()
+        self._changed()
+
+
+class TrackedDict(dict):
+    """dict that invalidates its owner on in place changes, copied and pickled as plain dict"""
+    __slots__ = ("_owner",)
+
+    def __init__(self, owner: Tracked, values=()):
+        self._owner = ref(owner)
+        super().__init__(values)
+        for key, value in self.items():
+            if _kinds.get(type(value)) != 0:
+                dict.__setitem__(self, key, track(value, owner))
+
+    _changed = TrackedList._changed
+    _track = TrackedList._track
+
+    def __reduce_ex__(self, protocol):
+        return dict, (dict(self),)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, self._track(value))
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, values):
+        self.update(values)
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update((key, self._track(value)) for key, value in dict(*args, **kwargs).items())
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+_json_scalars = frozenset({str, int, float, bool, type(None)})
+
+
+def canonicalize(value: Any) -> Any:
+    """Copy of a json like value with sorted keys and without None values in dicts. ConqueryIds become strings."""
+    if type(value) in _json_scalars:
+        return value
+    if isinstance(value, dict):
+        return {key: entry if type(entry) in _json_scalars else canonicalize(entry)
+                for key, entry in sorted(value.items(), key=itemgetter(0)) if entry is not None}
+    if isinstance(value, (list, tuple)):
+        return [entry if type(entry) in _json_scalars else canonicalize(entry) for entry in value]
+    if isinstance(value, ConqueryId):
+        return value.id
+    return value
+
+
+def dumps(value: Any) -> bytes:
+    """Compact json of a canonical value as utf-8 bytes"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def canonical_json(value: Any) -> bytes:
+    return dumps(canonicalize(value))
@@ -1,4 +1,5 @@
-from typing import Union, Tuple, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Tuple, List, Set
 
 from cqapi.api import ConqueryConnection
 from cqapi.conquery_ids import ConqueryIdCollection, ConceptId, ChildId, get_copy_of_id_with_changed_dataset, \
@@ -9,27 +10,19 @@ from cqapi.queries.base_elements import create_query_obj, QueryObject
 
 
 def translate_query(query: Union[QueryObject, dict], concepts: dict, conquery_conn: ConqueryConnection,
-                    return_removed_ids: bool = False) -> \
+                    return_removed_ids: bool = False, children_ids: ConqueryIdCollection = None) -> \
         Union[Tuple[Union[QueryObject, dict, None], Union[QueryObject, dict, None], ConqueryIdCollection],
               Tuple[Union[QueryObject, dict, None], Union[QueryObject, dict, None]]]:
-    new_dataset = get_dataset_from_id_string(next(iter(concepts)))
-
+    """
+    :param children_ids: children concept ids that exist in the new dataset,
+                         see get_children_ids_for_new_dataset. Requested from conquery if not given.
+    """
     # translate
     conquery_ids = ConqueryIdCollection()
 
-    # get children ids that exist
-    all_concept_ids = query.get_concept_ids()
-    # don't ask for children concepts for concepts that are not available for new dataset
-    concept_ids = list()
-    for concept_id in all_concept_ids:
-        new_concept_id = concept_id.get_concept_id()
-        new_concept_id = get_copy_of_id_with_changed_dataset(new_dataset=new_dataset, conquery_id=new_concept_id)
-        if new_concept_id.id in concepts.keys():
-            concept_ids.append(concept_id)
-
-    children_ids = check_concept_ids_in_concepts_for_new_dataset(concept_ids=concept_ids,
-                                                                 new_dataset=new_dataset,
-                                                                 conquery_conn=conquery_conn)
+    if children_ids is None:
+        children_ids = get_children_ids_for_new_dataset(queries=[query], concepts=concepts,
+                                                        conquery_conn=conquery_conn)
 
     new_query, query = query.translate(concepts=concepts, removed_ids=conquery_ids, children_ids=children_ids)
 
@@ -40,9 +33,15 @@ def translate_query(query: Union[QueryObject, dict], concepts: dict, conquery_co
 
 
 def translate_queries(queries: List[QueryObject], concepts: dict, conquery_conn: ConqueryConnection,
-                      return_removed_ids: bool = False) -> \
+                      return_removed_ids: bool = False, max_workers: int = 8) -> \
         Union[Tuple[List[QueryObject], List[QueryObject], ConqueryIdCollection],
               Tuple[List[QueryObject], List[QueryObject]]]:
+    """
+    Translates all queries to the dataset of concepts. The concepts of children ids of all queries are requested
+    once and concurrently with up to max_workers requests.
+    """
+    children_ids = get_children_ids_for_new_dataset(queries=queries, concepts=concepts,
+                                                    conquery_conn=conquery_conn, max_workers=max_workers)
     new_queries = list()
     remaining_queries = list()
     removed_ids = ConqueryIdCollection()
@@ -50,7 +49,8 @@ def translate_queries(queries: List[QueryObject], concepts: dict, conquery_conn:
         new_query, remaining_query, removed_ids_query = translate_query(query=query,
                                                                         concepts=concepts,
                                                                         conquery_conn=conquery_conn,
-                                                                        return_removed_ids=True)
+                                                                        return_removed_ids=True,
+                                                                        children_ids=children_ids)
         removed_ids.update(removed_ids_query)
         if new_query is not None:
             new_queries.append(new_query)
@@ -62,6 +62,36 @@ def translate_queries(queries: List[QueryObject], concepts: dict, conquery_conn:
     return new_queries, remaining_queries
 
 
+def get_children_ids_for_new_dataset(queries: List[QueryObject], concepts: dict, conquery_conn: ConqueryConnection,
+                                     max_workers: int = 8) -> ConqueryIdCollection:
+    """
+    Children concept ids of all queries that exist in the dataset of concepts.
+    Concepts that are not available in the new dataset are not requested.
+    """
+    new_dataset = get_dataset_from_id_string(next(iter(concepts)))
+    concept_ids = get_concept_ids_available_in_new_dataset(queries=queries, concepts=concepts,
+                                                           new_dataset=new_dataset)
+
+    return ConqueryIdCollection(
+        check_concept_ids_in_concepts_for_new_dataset(concept_ids=list(concept_ids),
+                                                      new_dataset=new_dataset,
+                                                      conquery_conn=conquery_conn,
+                                                      max_workers=max_workers))
+
+
+def get_concept_ids_available_in_new_dataset(queries: List[QueryObject], concepts: dict,
+                                             new_dataset: str) -> Set[Union[ConceptId, ChildId]]:
+    """Concept ids of all queries whose root concept exists in the dataset of concepts"""
+    concept_ids = set()
+    for query in queries:
+        for concept_id in query.get_concept_ids():
+            new_concept_id = get_copy_of_id_with_changed_dataset(new_dataset=new_dataset,
+                                                                 conquery_id=concept_id.get_concept_id())
+            if new_concept_id.id in concepts:
+                concept_ids.add(concept_id)
+    return concept_ids
+
+
 def translate_and_execute_stored_query(query_id: str, new_dataset: str, conquery_conn: ConqueryConnection,
                                        concepts_new_dataset: dict = None, return_removed_ids: bool = False) -> \
         Union[Tuple[str, ConqueryIdCollection], str]:
@@ -91,34 +121,48 @@ def translate_and_execute_stored_query(query_id: str, new_dataset: str, conquery
 
 
 def check_concept_ids_in_concepts_for_new_dataset(concept_ids: List[Union[ConceptId, ChildId]],
-                                                  new_dataset: str, conquery_conn: ConqueryConnection):
+                                                  new_dataset: str, conquery_conn: ConqueryConnection,
+                                                  max_workers: int = 8):
     """
     For each concept_id in concept_ids it checks if the concept_id exist in the concept-object of the new dataset.
     This ist needed for translating children concepts that are on level 3 or higher
     :param concept_ids:
     :param new_dataset:
     :param conquery_conn:
+    :param max_workers: number of concepts requested at the same time
     :return:
     """
 
     # group concept_ids by root_concept_id
     concept_ids_dict = dict()
     for concept_id in concept_ids:
-        root_concept_id = concept_id.get_concept_id()
-        concept_ids_dict[root_concept_id] = [concept_id, *concept_ids_dict.get(root_concept_id, [])]
+        new_root_concept_id = get_copy_of_id_with_changed_dataset(new_dataset=new_dataset,
+                                                                  conquery_id=concept_id.get_concept_id())
+        concept_ids_dict.setdefault(new_root_concept_id.id, []).append(concept_id)
+
+    # get all root concepts concurrently, the connection caches them for following translations
+    if not concept_ids_dict:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(concept_ids_dict))) as executor:
+        concepts = dict(zip(concept_ids_dict, executor.map(conquery_conn.get_concept, concept_ids_dict)))
 
-    # for each root concept_id get the concept and check if concept_ids are in there
+    # for each root concept check if concept_ids are in there
     children_ids = []
-    for root_concept_id, child_concept_ids in concept_ids_dict.items():
-        new_root_concept_id = get_copy_of_id_with_changed_dataset(new_dataset=new_dataset, conquery_id=root_concept_id)
+    for new_root_concept_id, child_concept_ids in concept_ids_dict.items():
+        concept_ids_in_concept = get_ids_of_concept_tree(concepts[new_root_concept_id])
         new_child_concept_ids = [get_copy_of_id_with_changed_dataset(new_dataset=new_dataset,
                                                                      conquery_id=child_concept_id)
                                  for child_concept_id in child_concept_ids]
 
-        concept = conquery_conn.get_concept(new_root_concept_id.id)
-        concept_ids_in_concept = [child_id for child in concept for child_id in child[Keys.ids]]
-
         children_ids.extend([child_concept_id for child_concept_id in new_child_concept_ids
                              if child_concept_id.id in concept_ids_in_concept])
 
     return children_ids
+
+
+def get_ids_of_concept_tree(concept: Union[dict, list]) -> Set[str]:
+    """Ids of all nodes of a concept tree as returned by get_concept, either a dict of nodes by id or a list of
+    nodes with ids"""
+    if isinstance(concept, dict):
+        return set(concept)
+    return {child_id for child in concept for child_id in child[Keys.ids]}
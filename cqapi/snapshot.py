@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+import zipfile
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from tempfile import NamedTemporaryFile
+from typing import Dict, Iterable, Iterator, Optional
+from urllib.parse import quote
+
+SNAPSHOT_FORMAT_VERSION = 1
+_manifest_name = "manifest.json"
+
+
+def _member_name(concept_id: str) -> str:
+    return f"concepts/{quote(concept_id, safe='')}.json"
+
+
+def get_snapshot_path(directory: str, dataset: str) -> str:
+    return os.path.join(directory, f"{quote(dataset, safe='')}.concepts.zip")
+
+
+def write_concepts_snapshot(path: str, concepts: dict, dataset: str) -> None:
+    """Writes the concepts (as returned by get_concepts(remove_structure_elements=False)) to a compressed snapshot.
+
+    Each concept is stored as its own zip member, so a snapshot can be read concept by concept. The manifest holds
+    the dataset, the creation time and the label and active flag of every concept.
+    The file is replaced atomically, readers never see a partial snapshot.
+    """
+    manifest = {"formatVersion": SNAPSHOT_FORMAT_VERSION,
+                "dataset": dataset,
+                "createdAt": datetime.now(timezone.utc).isoformat(),
+                "concepts": {concept_id: {"label": concept.get("label", ""), "active": bool(concept.get("active"))}
+                             for concept_id, concept in concepts.items()}}
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with NamedTemporaryFile(dir=directory, prefix=".snapshot-", delete=False) as file:
+        try:
+            with zipfile.ZipFile(file, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr(_manifest_name, json.dumps(manifest))
+                for concept_id, concept in concepts.items():
+                    archive.writestr(_member_name(concept_id), json.dumps(concept, separators=(",", ":")))
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+    os.replace(file.name, path)
+
+
+class ConceptsSnapshot:
+    """Read access to a snapshot written with write_concepts_snapshot.
+
+    Only the manifest is read on opening, concepts are decompressed on first access and memoized.
+    Raises ValueError for snapshots written with another format version.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._archive = zipfile.ZipFile(path, mode="r")
+        self._lock = threading.Lock()
+        self._loaded: Dict[str, dict] = dict()
+
+        manifest = json.loads(self._archive.read(_manifest_name))
+        if manifest.get("formatVersion") != SNAPSHOT_FORMAT_VERSION:
+            self._archive.close()
+            raise ValueError(f"Unsupported snapshot format {manifest.get('formatVersion')} in {path}, "
+                             f"expected {SNAPSHOT_FORMAT_VERSION}")
+
+        self.dataset: str = manifest["dataset"]
+        self.created_at: datetime = datetime.fromisoformat(manifest["createdAt"])
+        self.labels: Dict[str, str] = {concept_id: entry["label"]
+                                       for concept_id, entry in manifest["concepts"].items()}
+        self._active: Dict[str, bool] = {concept_id: entry["active"]
+                                         for concept_id, entry in manifest["concepts"].items()}
+
+    def close(self) -> None:
+        self._archive.close()
+
+    def age(self) -> float:
+        """Seconds since the snapshot was written"""
+        return (datetime.now(timezone.utc) - self.created_at).total_seconds()
+
+    def is_valid_for(self, dataset: str, max_age: Optional[float] = None) -> bool:
+        return self.dataset == dataset and (max_age is None or self.age() <= max_age)
+
+    def load(self, concept_id: str) -> dict:
+        with self._lock:
+            try:
+                return self._loaded[concept_id]
+            except KeyError:
+                pass
+
+            if concept_id not in self._active:
+                raise KeyError(concept_id)
+
+            concept = self._loaded[concept_id] = json.loads(self._archive.read(_member_name(concept_id)))
+            return concept
+
+    def concepts(self, active: bool) -> "LazyConcepts":
+        """Lazy mapping of all active (or all structure) concepts"""
+        return LazyConcepts(self, [concept_id for concept_id, is_active in self._active.items()
+                                   if is_active == active])
+
+
+class LazyConcepts(Mapping):
+    """Read-only mapping concept_id -> concept that loads concepts from a ConceptsSnapshot on access"""
+
+    def __init__(self, snapshot: ConceptsSnapshot, concept_ids: Iterable[str]):
+        self.snapshot = snapshot
+        self._concept_ids = dict.fromkeys(concept_ids)
+
+    def __getitem__(self, concept_id: str) -> dict:
+        if concept_id not in self._concept_ids:
+            raise KeyError(concept_id)
+        return self.snapshot.load(concept_id)
+
+    def __contains__(self, concept_id) -> bool:
+        return concept_id in self._concept_ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._concept_ids)
+
+    def __len__(self) -> int:
+        return len(self._concept_ids)
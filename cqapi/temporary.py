@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import threading
+from time import monotonic
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from cqapi.api import ConqueryConnection, DeletionReport
+
+
+class TemporaryQueries:
+    """Tracks the queries executed through a connection and deletes them from the server.
+
+    Created by ConqueryConnection.temporary_queries. As context manager, all queries executed inside the with block
+    are deleted on exit, except the ones passed to keep. With max_age, a background thread deletes tracked queries
+    once they are older than max_age seconds.
+
+    Usage:
+        with conn.temporary_queries() as temporary_queries:
+            data = conn.get_query_result(conn.execute_query(query))
+        print(temporary_queries.report)
+
+    :param max_age: seconds after which tracked queries are deleted by the background sweeper, None disables it
+    :param sweep_interval: seconds between two runs of the background sweeper
+    """
+
+    def __init__(self, conn: ConqueryConnection, max_age: float = None, sweep_interval: float = 60):
+        self.conn = conn
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        # result of the deletion on exit of the with block
+        self.report: Optional[DeletionReport] = None
+        # query id -> time it was tracked
+        self._tracked: Dict[str, float] = dict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+
+        if max_age is not None:
+            self._sweeper = threading.Thread(target=self._sweep_periodically, name="cqapi-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        self.report = self.delete()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tracked)
+
+    def track(self, query_id: str) -> None:
+        with self._lock:
+            self._tracked.setdefault(query_id, monotonic())
+
+    def keep(self, query_id: str) -> None:
+        """Stops tracking query_id, so it is not deleted"""
+        with self._lock:
+            self._tracked.pop(query_id, None)
+
+    def get_query_ids(self, older_than: float = None) -> List[str]:
+        """Tracked query ids in the order they were executed, only those tracked more than older_than seconds ago
+        if given"""
+        with self._lock:
+            if older_than is None:
+                return list(self._tracked)
+            limit = monotonic() - older_than
+            return [query_id for query_id, tracked_at in self._tracked.items() if tracked_at <= limit]
+
+    def delete(self, older_than: float = None, dry_run: bool = False) -> DeletionReport:
+        """Deletes the tracked queries (older than older_than seconds) and stops tracking the deleted ones.
+        With dry_run nothing is deleted and the report lists the queries that would be deleted."""
+        report = self.conn.delete_stored_queries(self.get_query_ids(older_than=older_than), dry_run=dry_run)
+        if not dry_run:
+            with self._lock:
+                for query_id in report.deleted:
+                    self._tracked.pop(query_id, None)
+        return report
+
+    def close(self) -> None:
+        """Stops tracking new queries and the background sweeper, tracked queries are not deleted"""
+        self.conn.untrack_queries(self)
+        self._stop.set()
+        if self._sweeper is not None and self._sweeper is not threading.current_thread():
+            self._sweeper.join()
+
+    def _sweep_periodically(self) -> None:
+        while not self._stop.wait(self.sweep_interval):
+            self.delete(older_than=self.max_age)
@@ -1,15 +1,23 @@
 from __future__ import annotations
 import pandas as pd
 import datetime
+import os
+import zipfile
+from collections import OrderedDict
 from importlib.resources import open_text
-from typing import Union, List, Tuple, Optional
+from typing import Union, List, Tuple, Optional, Mapping
 import attr
 from IPython.display import Markdown, Javascript
 
 from cqapi.api import ConqueryConnection
+from cqapi.cache import ResultCache
+from cqapi.catalogue import get_catalogue
+from cqapi.concept_search import ConceptSearchIndex
+from cqapi.snapshot import ConceptsSnapshot, get_snapshot_path, write_concepts_snapshot
 from cqapi.namespace import Keys
 from cqapi.conquery_ids import ConqueryIdCollection, contains_dataset_id, add_dataset_id_to_conquery_id, \
-    get_concept_id_from_id_string, remove_dataset_id_from_conquery_id_string, SelectId, DateId
+    get_concept_id_from_id_string, get_dataset_from_id_string, remove_dataset_id_from_conquery_id_string, SelectId, \
+    DateId
 from cqapi.queries.base_elements import QueryObject, create_query_obj, SavedQuery, DateRestriction, ConceptQuery, \
     SecondaryIdQuery, Negation, AndElement, OrElement, create_query, QueryDescription
 from cqapi.queries.form_elements import AbsoluteExportForm, RelativeExportForm
@@ -184,26 +192,32 @@ class EditorQuery(Query):
 
 
 class Concepts:
-    last_concept: Optional[dict] = None
+    max_search_indices: int = 4
 
     def __init__(self, concepts: dict):
+        self._search_indices: OrderedDict[str, ConceptSearchIndex] = OrderedDict()
         self.struc_elements = {key: value for key, value in concepts.items() if not value.get("active")}
-        self.concepts = {key: value for key, value in concepts.items() if value.get("active")}
+        self.concepts: Mapping[str, dict] = {key: value for key, value in concepts.items() if value.get("active")}
+        self.labels: Mapping[str, str] = {key: value.get("label", "") for key, value in concepts.items()}
         self.dataset = next(iter(concepts)).split(".")[0] if concepts else ""
 
+    @classmethod
+    def from_snapshot(cls, snapshot: ConceptsSnapshot) -> Concepts:
+        """Concepts backed by an on-disk snapshot. Concepts are read from the snapshot on first access."""
+        concepts = cls(concepts=dict())
+        concepts.struc_elements = dict(snapshot.concepts(active=False))
+        concepts.concepts = snapshot.concepts(active=True)
+        concepts.labels = snapshot.labels
+        concepts.dataset = snapshot.dataset
+        return concepts
+
     def get_default_connectors(self, concept_id: str) -> List[str]:
         concept_id = get_concept_id_from_id_string(concept_id)
-
-        return [table[Keys.connector_id]
-                for table in self.concepts[concept_id][Keys.tables]
-                if table.get(Keys.default, False)]
+        return get_catalogue(self.concepts).default_connectors(concept_id=concept_id)
 
     def get_default_concept_selects(self, concept_id: str) -> List[str]:
         concept_id = get_concept_id_from_id_string(concept_id)
-
-        return [select[Keys.id]
-                for select in self.concepts[concept_id][Keys.selects]
-                if select.get(Keys.default, False)]
+        return get_catalogue(self.concepts).default_concept_selects(concept_id=concept_id)
 
     def get_default_connector_selects(self, concept_id: str, connector_ids: List[str] = None) -> List[str]:
         concept_id = get_concept_id_from_id_string(concept_id)
@@ -211,10 +225,8 @@ class Concepts:
         if not connector_ids:
             connector_ids = self.get_default_connectors(concept_id=concept_id)
 
-        return [table_select[Keys.id]
-                for table in self.concepts[concept_id][Keys.tables]
-                for table_select in table[Keys.selects]
-                if table_select.get(Keys.default, False) and table[Keys.connector_id] in connector_ids]
+        return get_catalogue(self.concepts).default_connector_selects(concept_id=concept_id,
+                                                                      connector_ids=connector_ids)
 
     def is_empty(self):
         return not bool(self.concepts)
@@ -229,7 +241,7 @@ class Concepts:
 
             concept_ids.extend(remove_dataset_id_from_conquery_id_string(concept_id)
                                for concept_id in struc_element["children"])
-            concept_labels.extend([self.concepts[concept_id].get("label", "")
+            concept_labels.extend([self.labels.get(concept_id, "")
                                    for concept_id in struc_element["children"]])
 
             concept_ids.append("")
@@ -334,47 +346,53 @@ class Concepts:
             "EVA-ID": ids
         }).to_markdown(index=False))
 
-    def search_concept(self, concept_id: str, value: str, conn: ConqueryConnection):
-        concept_id = self._add_dataset_id(concept_id)
+    def search_concept(self, concept_id: str, value: str, conn: ConqueryConnection, limit: Optional[int] = 50,
+                       refresh: bool = False):
+        """Searches labels and descriptions of all elements of a concept, best matches first
 
-        # do not request again if same concept
-        if not self.last_concept or concept_id != next(iter(self.last_concept)):
-            self.last_concept = conn.get_concept(concept_id, return_raw_format=True)  # type: ignore
+        :param refresh: download the concept tree again and rebuild its search index
+        """
+        concept_id = self._add_dataset_id(concept_id)
 
-        matches: List[Tuple[str, str, str]] = []
-        self.search_concept_recursively(concept_id=concept_id,
-                                        concept=next(iter(self.last_concept.values())),  # type: ignore
-                                        value=value.lower(), matches=matches)
+        matches = self._get_search_index(concept_id=concept_id, conn=conn, refresh=refresh).search(value, limit=limit)
 
         if not matches:
             return Markdown("Es konnten keine Konzepte gefunden werden.")
 
         labels, ids, descriptions = list(map(list, zip(*matches)))
+        ids = [remove_dataset_id_from_conquery_id_string(conquery_id) for conquery_id in ids]
 
         return Markdown(pd.DataFrame(
             {"Konzept": labels,
              "Konzept-ID": ids,
              "Beschreibung": descriptions}).to_markdown(index=False))
 
-    def search_concept_recursively(self, concept_id: str, concept: dict, value: str,
-                                   matches: List[Tuple[str, str, str]]):
+    def _get_search_index(self, concept_id: str, conn: ConqueryConnection, refresh: bool = False) -> ConceptSearchIndex:
+        search_index = self._search_indices.get(concept_id)
+
+        if refresh:
+            conn.invalidate_concepts(dataset=get_dataset_from_id_string(concept_id))
+        # with a concepts cache, the index is rebuilt when the connection downloaded the tree again.
+        # Without, the index is kept until refresh is requested.
+        if search_index is None or refresh or conn.concepts_cache is not None:
+            concept_tree = conn.get_concept(concept_id, return_raw_format=True)
+            if search_index is None or search_index.concept_tree is not concept_tree:
+                search_index = ConceptSearchIndex(concept_tree=concept_tree, root_concept_id=concept_id)
+                self._search_indices[concept_id] = search_index
+        self._search_indices.move_to_end(concept_id)
 
-        if value in concept[Keys.label].lower() or \
-                (concept.get(Keys.description) and value in concept[Keys.description].lower()):
-            matches.append((concept[Keys.label],
-                            remove_dataset_id_from_conquery_id_string(concept_id),
-                            concept[Keys.description]))
+        while len(self._search_indices) > self.max_search_indices:
+            self._search_indices.popitem(last=False)
 
-        for child_concept_id in concept[Keys.children]:
-            self.search_concept_recursively(concept_id=child_concept_id,
-                                            concept=self.last_concept[child_concept_id],  # type: ignore
-                                            value=value, matches=matches)
+        return search_index
 
 
 class Conquery:
     conn: ConqueryConnection = ConqueryConnection(url="dummy_connection")
     concepts: Concepts = Concepts(concepts=dict())  # this is only a dummy and has to be overridden
     executed_query_id: Optional[str] = None
+    concepts_snapshot_dir: Optional[str] = None
+    concepts_snapshot_max_age: Optional[float] = 24 * 60 * 60
 
     def login(self,
               url: str = "localhost:8000",
@@ -382,19 +400,27 @@ class Conquery:
               dataset: Optional[str] = None,
               auth_url: str = "localhost:8000/auth",
               client_id: str = "conquery-prod",
-              token_refresh_rate: int = 300):
+              token_refresh_rate: int = 300,
+              result_cache: Optional[ResultCache] = None,
+              concepts_snapshot_dir: Optional[str] = None,
+              concepts_snapshot_max_age: Optional[float] = 24 * 60 * 60):
         """
         When _user_login is set, this function returns JavaScript-Code that will be executed in the output cell when
         code is run in a jupyter notebook. The Code will initialize a KeyCloak-Object that connects
         to the conquery-auth server. After successful login the token of Editor.conn for all Editor in the
         Notebook-Scope are updated and a second JavaScript-Process will refresh that token in self._token_refresh_rate
         seconds.
+        Downloaded results are kept on disk and reused when result_cache is given.
+        When concepts_snapshot_dir is given, the concepts of the dataset are stored there and read from the snapshot
+        in new sessions until it is older than concepts_snapshot_max_age seconds (None: never outdated).
         """
+        self.concepts_snapshot_dir = concepts_snapshot_dir
+        self.concepts_snapshot_max_age = concepts_snapshot_max_age
 
-        self.conn = ConqueryConnection(url=url, dataset=dataset)
+        self.conn = ConqueryConnection(url=url, dataset=dataset, result_cache=result_cache)
 
         if token:
-            self.conn = ConqueryConnection(url=url, token=token, dataset=dataset)
+            self.conn = ConqueryConnection(url=url, token=token, dataset=dataset, result_cache=result_cache)
             return None
 
         placeholder_dict = {
@@ -414,7 +440,38 @@ class Conquery:
         if not self.conn:
             raise ValueError(f"No connection established, please log in first")
         if self.concepts.is_empty():
-            self.concepts = Concepts(concepts=self.conn.get_concepts(remove_structure_elements=False))
+            self.concepts = self._load_concepts()
+
+    def _load_concepts(self) -> Concepts:
+        if self.concepts_snapshot_dir is None:
+            return Concepts(concepts=self.conn.get_concepts(remove_structure_elements=False))
+
+        dataset = self.conn.get_dataset()
+        snapshot_path = get_snapshot_path(directory=self.concepts_snapshot_dir, dataset=dataset)
+        if os.path.exists(snapshot_path):
+            try:
+                snapshot = ConceptsSnapshot(snapshot_path)
+            except (ValueError, KeyError, OSError, zipfile.BadZipFile):
+                # unreadable or outdated format, it is overwritten below
+                snapshot = None
+
+            if snapshot is not None:
+                if snapshot.is_valid_for(dataset, max_age=self.concepts_snapshot_max_age):
+                    return Concepts.from_snapshot(snapshot)
+                snapshot.close()
+
+        return self.refresh_concepts()
+
+    def refresh_concepts(self) -> Concepts:
+        """Downloads the concepts again and updates the snapshot if concepts_snapshot_dir is set"""
+        self.conn.invalidate_concepts(dataset=self.conn.get_dataset())
+        concepts = self.conn.get_concepts(remove_structure_elements=False)
+        if self.concepts_snapshot_dir is not None:
+            dataset = self.conn.get_dataset()
+            write_concepts_snapshot(get_snapshot_path(directory=self.concepts_snapshot_dir, dataset=dataset),
+                                    concepts=concepts, dataset=dataset)
+        self.concepts = Concepts(concepts=concepts)
+        return self.concepts
 
     def change_dataset(self, new_dataset: str):
         self.conn.change_dataset(dataset=new_dataset)
@@ -523,7 +580,7 @@ class Conquery:
                                concept_select_ids=concept_select_ids, connector_select_ids=connector_select_ids,
                                concepts=self.concepts.concepts)
 
-        query.query.features.append(concept)
+        query.query.features = [*query.query.features, concept]
 
     def show_concepts(self):
         self._check_conn_and_concepts()
@@ -539,9 +596,9 @@ class Conquery:
         self._check_conn_and_concepts()
         return self.concepts.show_concept(concept_id=concept_id, show_all=show_all, show_filters=show_filters)
 
-    def search_concept(self, concept_id: str, value: str):
+    def search_concept(self, concept_id: str, value: str, refresh: bool = False):
         self._check_conn_and_concepts()
-        return self.concepts.search_concept(concept_id=concept_id, value=value, conn=self.conn)
+        return self.concepts.search_concept(concept_id=concept_id, value=value, conn=self.conn, refresh=refresh)
 
     def execute(self, query: Query, label: str = None):
         self.executed_query_id = self.conn.execute_query(query=query.finalize(), label=label)
@@ -0,0 +1,105 @@
+import asyncio
+from random import uniform
+from time import sleep, monotonic
+from typing import Awaitable, Callable, Iterator, Optional
+
+from cqapi.exceptions import QueryTimeoutError
+
+
+def query_is_running(query_info: dict) -> bool:
+    return query_info["status"] == "RUNNING"
+
+
+class QueryWaiter:
+    """Polls the status of a query with exponential backoff until it leaves the state RUNNING.
+
+    :param initial_interval: seconds to sleep after the first poll
+    :param max_interval: upper bound for the sleep between two polls
+    :param multiplier: factor the interval grows with after each poll
+    :param jitter: relative random deviation applied to each interval, e.g. 0.1 means +-10%
+    :param timeout: overall deadline in seconds, None waits forever
+    :param on_poll: called after each poll with the number of polls made so far and the latest query info
+    """
+
+    def __init__(self, initial_interval: float = 0.1, max_interval: float = 5.0, multiplier: float = 1.5,
+                 jitter: float = 0.1, timeout: Optional[float] = None,
+                 on_poll: Optional[Callable[[int, dict], None]] = None):
+        if initial_interval < 0 or max_interval < initial_interval:
+            raise ValueError(f"Invalid intervals: {initial_interval=}, {max_interval=}")
+        if multiplier < 1:
+            raise ValueError(f"{multiplier=} must be >= 1")
+        if not 0 <= jitter < 1:
+            raise ValueError(f"{jitter=} must be in [0, 1)")
+
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.timeout = timeout
+        self.on_poll = on_poll
+
+    @classmethod
+    def with_rate(cls, requests_per_sec: float, timeout: Optional[float] = None) -> "QueryWaiter":
+        """Waiter with a constant poll interval"""
+        interval = 1 / requests_per_sec
+        return cls(initial_interval=interval, max_interval=interval, multiplier=1, jitter=0, timeout=timeout)
+
+    def intervals(self) -> Iterator[float]:
+        """Infinite sequence of (jittered) sleep intervals"""
+        interval = self.initial_interval
+        while True:
+            yield interval * uniform(1 - self.jitter, 1 + self.jitter)
+            interval = min(interval * self.multiplier, self.max_interval)
+
+    def wait(self, poll: Callable[[], dict], is_pending: Callable[[dict], bool] = query_is_running) -> dict:
+        """Calls poll until is_pending returns False for its result and returns that result.
+        Raises QueryTimeoutError when the deadline is exceeded."""
+        deadline = self.deadline()
+        intervals = self.intervals()
+        polls = 0
+
+        while True:
+            query_info = poll()
+            polls += 1
+            if not self.pending(polls, query_info, is_pending):
+                return query_info
+
+            sleep(self.next_interval(intervals, deadline, polls, query_info))
+
+    async def wait_async(self, poll: Callable[[], Awaitable[dict]],
+                         is_pending: Callable[[dict], bool] = query_is_running) -> dict:
+        """Same as wait, but awaits poll and sleeps without blocking the event loop"""
+        deadline = self.deadline()
+        intervals = self.intervals()
+        polls = 0
+
+        while True:
+            query_info = await poll()
+            polls += 1
+            if not self.pending(polls, query_info, is_pending):
+                return query_info
+
+            await asyncio.sleep(self.next_interval(intervals, deadline, polls, query_info))
+
+    def deadline(self) -> Optional[float]:
+        """Point in time (time.monotonic) at which waiting that starts now has to stop"""
+        return None if self.timeout is None else monotonic() + self.timeout
+
+    def pending(self, polls: int, query_info: dict, is_pending: Callable[[dict], bool]) -> bool:
+        """Reports a poll to on_poll and returns whether the query has to be polled again"""
+        if self.on_poll is not None:
+            self.on_poll(polls, query_info)
+        return is_pending(query_info)
+
+    def next_interval(self, intervals: Iterator[float], deadline: Optional[float], polls: int,
+                       query_info: dict) -> float:
+        """Next interval to sleep, shortened to the deadline. Raises QueryTimeoutError after the deadline."""
+        interval = next(intervals)
+        if deadline is None:
+            return interval
+
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise QueryTimeoutError(f"Query {query_info.get('id')} still {query_info.get('status')} "
+                                    f"after {self.timeout}s ({polls} polls)")
+        return min(interval, remaining)
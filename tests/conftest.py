@@ -0,0 +1,161 @@
+import json
+import re
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import count
+
+import pyarrow as pa
+import pytest
+
+
+class StubConquery:
+    """In-memory stand-in for the parts of the conquery REST api used by cqapi.
+    Every executed query reports RUNNING for the first `running_polls` status requests and DONE afterwards."""
+
+    datasets = ["dataset1", "dataset2"]
+
+    def __init__(self, running_polls: int = 2):
+        self.running_polls = running_polls
+        self.queries = dict()
+        self.concepts = {"dataset1.alter": {"label": "Alter", "active": True, "children": [], "tables": [],
+                                            "selects": []},
+                         "dataset1.struc": {"label": "Struktur", "active": False, "children": ["dataset1.alter"]}}
+        self.concept_trees = {"dataset1.icd": {"dataset1.icd": {"label": "ICD", "children": []}}}
+        self.result_table = pa.table({"pid": ["1", "2", "3"], "alter": [31, 42, 53]})
+        self.result_batch_size = 1
+        self.requests = list()
+        # path -> number of following requests answered with 503
+        self.failures = dict()
+        self._ids = count()
+        self._lock = threading.Lock()
+
+    def add_query(self, dataset: str, query: dict, status: str = "RUNNING") -> str:
+        with self._lock:
+            query_id = f"{dataset}.query{next(self._ids)}"
+            self.queries[query_id] = {"id": query_id, "label": None, "status": status, "query": query,
+                                      "polls": 0, "numberOfResults": self.result_table.num_rows,
+                                      "columnDescriptions": []}
+        return query_id
+
+    def query_info(self, query_id: str) -> dict:
+        with self._lock:
+            query = self.queries[query_id]
+            query["polls"] += 1
+            if query["status"] == "RUNNING" and query["polls"] > self.running_polls:
+                query["status"] = "DONE"
+            return {key: value for key, value in query.items() if key != "polls"}
+
+    def arrow_result(self) -> bytes:
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_file(sink, self.result_table.schema) as writer:
+            writer.write_table(self.result_table, max_chunksize=self.result_batch_size)
+        return sink.getvalue().to_pybytes()
+
+    def csv_result(self) -> bytes:
+        rows = [self.result_table.column_names, *zip(*[column.to_pylist()
+                                                       for column in self.result_table.columns])]
+        return "\n".join(";".join(str(value) for value in row) for row in rows).encode()
+
+
+class StubConqueryHandler(BaseHTTPRequestHandler):
+    stub: StubConquery
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, status: int = 200, content_type: str = "application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or "null")
+
+    def _route(self, method: str):
+        path = self.path.split("?")[0]
+        self.stub.requests.append((method, path))
+
+        if self.stub.failures.get(path, 0) > 0:
+            self.stub.failures[path] -= 1
+            return self._send({"message": "unavailable"}, status=503)
+
+        if method == "GET" and path == "/api/datasets":
+            return self._send([{"id": dataset, "label": dataset.upper()} for dataset in self.stub.datasets])
+        if method == "GET" and re.fullmatch(r"/api/datasets/\w+/concepts", path):
+            return self._send({"concepts": self.stub.concepts, "secondaryIds": []})
+        if method == "GET" and path.startswith("/api/concepts/"):
+            concept_id = path[len("/api/concepts/"):]
+            if concept_id not in self.stub.concept_trees:
+                return self._send({"message": "unknown concept"}, status=404)
+            return self._send(self.stub.concept_trees[concept_id])
+
+        match = re.fullmatch(r"/api/datasets/(\w+)/queries", path)
+        if match and method == "POST":
+            return self._send({"id": self.stub.add_query(match.group(1), self._body())})
+        if match and method == "GET":
+            return self._send([{key: value for key, value in query.items() if key != "polls"}
+                               for query_id, query in self.stub.queries.items()
+                               if query_id.startswith(match.group(1))])
+
+        match = re.fullmatch(r"/api/result/(arrow|csv)/(.+)\.(arrf|csv)", path)
+        if match and method == "GET":
+            if match.group(1) == "arrow":
+                return self._send(self.stub.arrow_result(), content_type="application/vnd.apache.arrow.file")
+            return self._send(self.stub.csv_result(), content_type="text/csv")
+
+        match = re.fullmatch(r"/api/queries/([^/]+)(/reexecute)?", path)
+        if match:
+            query_id = match.group(1)
+            if query_id not in self.stub.queries:
+                return self._send({"message": "unknown query"}, status=404)
+            if method == "POST" and match.group(2):
+                self.stub.queries[query_id].update(status="RUNNING", polls=0)
+                return self._send(self.stub.query_info(query_id))
+            if method == "GET":
+                return self._send(self.stub.query_info(query_id))
+            if method == "PATCH":
+                self.stub.queries[query_id].update(self._body())
+                return self._send(self.stub.query_info(query_id))
+            if method == "DELETE":
+                del self.stub.queries[query_id]
+                return self._send(b"", content_type="text/plain")
+
+        return self._send({"message": f"unknown endpoint {method} {path}"}, status=404)
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PATCH(self):
+        self._route("PATCH")
+
+    def do_DELETE(self):
+        self._route("DELETE")
+
+
+class StubConqueryServer(ThreadingHTTPServer):
+    # connections of many client threads at the same time
+    request_queue_size = 64
+    daemon_threads = True
+
+
+@pytest.fixture
+def conquery_stub():
+    """Runs a StubConquery on a free local port and yields it together with its url"""
+    stub = StubConquery()
+    handler = type("Handler", (StubConqueryHandler,), {"stub": stub})
+    server = StubConqueryServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield stub, f"http://127.0.0.1:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
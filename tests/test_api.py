@@ -0,0 +1,350 @@
+import gc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from requests.exceptions import HTTPError
+
+from cqapi.api import ConqueryConnection, ConqueryConnectionSession
+from cqapi.cache import ResultCache, QueryRegistry
+from cqapi.conquery_ids import concept_id_from_str
+from cqapi.exceptions import QueryNotFoundError, QueryTimeoutError
+from cqapi.queries.base_elements import create_query_obj
+from cqapi.waiter import QueryWaiter
+
+query = {"type": "CONCEPT_QUERY", "root": {"type": "CONCEPT", "ids": ["dataset1.alter"], "tables": []}}
+
+
+@pytest.fixture
+def conn(conquery_stub):
+    stub, url = conquery_stub
+    return ConqueryConnection(url, dataset="dataset1",
+                              waiter=QueryWaiter(initial_interval=0.01, max_interval=0.01, jitter=0))
+
+
+def test_get_query_result(conquery_stub, conn):
+    stub, url = conquery_stub
+    query_id = conn.execute_query(query, dataset="dataset1", label="test")
+
+    data = conn.get_query_result(query_id, delete_query=True)
+
+    assert data["alter"].tolist() == [31, 42, 53]
+    assert query_id not in stub.queries
+    # no busy polling while the query is running
+    assert stub.requests.count(("GET", f"/api/queries/{query_id}")) <= 4
+
+
+def test_execute_many(conquery_stub, conn):
+    stub, url = conquery_stub
+
+    results = list(conn.execute_many([query] * 5, labels=[f"query {i}" for i in range(5)], max_in_flight=2,
+                                      dataset="dataset1", delete_queries=True))
+
+    assert len({query_id for query_id, _ in results}) == 5
+    assert all(data["pid"].tolist() == ["1", "2", "3"] for _, data in results)
+    assert not stub.queries
+
+
+def test_execute_many_timeout_applies_per_query(conquery_stub):
+    stub, url = conquery_stub
+    stub.running_polls = 3
+    conn = ConqueryConnection(url, dataset="dataset1",
+                              waiter=QueryWaiter(initial_interval=0.05, max_interval=0.05, jitter=0, timeout=0.5))
+
+    # each query runs about 0.15s, together they take longer than the timeout of the waiter
+    results = list(conn.execute_many([query] * 6, max_in_flight=1))
+    assert len(results) == 6
+
+    with pytest.raises(QueryTimeoutError):
+        list(conn.execute_many([query] * 6, max_in_flight=1, timeout=0.3))
+
+
+def test_execute_many_wrong_number_of_labels(conn):
+    with pytest.raises(ValueError):
+        next(conn.execute_many([query] * 2, labels=["query"]))
+
+
+def test_iter_query_result_batches(conquery_stub, conn):
+    stub, url = conquery_stub
+    query_id = conn.execute_query(query, dataset="dataset1")
+
+    batches = list(conn.iter_query_result_batches(query_id, chunk_size=16))
+
+    assert [batch.num_rows for batch in batches] == [1, 1, 1]
+    assert [value for batch in batches for value in batch.column("alter").to_pylist()] == [31, 42, 53]
+
+
+def test_iter_query_result_batches_as_pandas(conquery_stub, conn):
+    stub, url = conquery_stub
+    stub.result_table = pa.table({"pid": [str(i) for i in range(10)]})
+    stub.result_batch_size = None
+    query_id = conn.execute_query(query, dataset="dataset1")
+
+    frames = list(conn.iter_query_result_batches(query_id, as_pandas=True, max_rows=4, delete_query=True))
+
+    assert all(isinstance(frame, pd.DataFrame) for frame in frames)
+    assert [len(frame) for frame in frames] == [4, 4, 2]
+    assert pd.concat(frames)["pid"].tolist() == [str(i) for i in range(10)]
+    assert query_id not in stub.queries
+
+
+@pytest.mark.parametrize("file_format", ["arrow", "csv"])
+def test_get_query_result_return_types(conquery_stub, conn, file_format):
+    query_id = conn.execute_query(query, dataset="dataset1")
+
+    table = conn.get_query_result(query_id, file_format=file_format, return_type="arrow")
+    arrays = conn.get_query_result(query_id, file_format=file_format, return_type="numpy")
+
+    assert isinstance(table, pa.Table)
+    assert table.column("pid").to_pylist() == ["1", "2", "3"]
+    assert list(arrays) == ["pid", "alter"]
+    assert isinstance(arrays["alter"], np.ndarray)
+    with pytest.raises(ValueError):
+        conn.get_query_result(query_id, return_type="polars")
+
+
+def test_result_cache(conquery_stub, tmp_path):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, dataset="dataset1", result_cache=ResultCache(str(tmp_path)),
+                              waiter=QueryWaiter(initial_interval=0.01, max_interval=0.01, jitter=0))
+    query_id = conn.execute_query(query, dataset="dataset1")
+    result_request = ("GET", f"/api/result/arrow/{query_id}.arrf")
+
+    first = conn.get_query_result(query_id)
+    second = conn.get_query_result(query_id, return_type="arrow")
+    batches = list(conn.iter_query_result_batches(query_id))
+
+    assert stub.requests.count(result_request) == 1
+    assert first["alter"].tolist() == second.column("alter").to_pylist() == [31, 42, 53]
+    assert len(batches) == 3
+
+    conn.reexecute_query(query_id)
+    conn.get_query_result(query_id)
+    assert stub.requests.count(result_request) == 2
+
+    conn.delete_stored_query(query_id)
+    assert conn.result_cache.size() == 0
+
+
+def test_iter_query_result_batches_with_result_cache_and_delete(conquery_stub, tmp_path):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, dataset="dataset1", result_cache=ResultCache(str(tmp_path)),
+                              waiter=QueryWaiter(initial_interval=0.01, max_interval=0.01, jitter=0))
+    query_id = conn.execute_query(query, dataset="dataset1")
+
+    batches = list(conn.iter_query_result_batches(query_id, delete_query=True))
+
+    assert [value for batch in batches for value in batch.column("alter").to_pylist()] == [31, 42, 53]
+    assert query_id not in stub.queries
+    assert conn.result_cache.size() == 0
+
+
+def test_concepts_are_cached(conquery_stub):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1")
+
+    assert list(conn.get_concepts()) == ["dataset1.alter"]
+    conn.get_secondary_ids()
+    conn.get_concept("dataset1.icd")
+    conn.get_concept("dataset1.icd")
+    assert stub.requests.count(("GET", "/api/datasets/dataset1/concepts")) == 1
+    assert stub.requests.count(("GET", "/api/concepts/dataset1.icd")) == 1
+
+    conn.invalidate_concepts("dataset1")
+    conn.get_concepts()
+    assert stub.requests.count(("GET", "/api/datasets/dataset1/concepts")) == 2
+
+
+def test_concepts_cache_disabled(conquery_stub):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1", concepts_ttl=None)
+
+    conn.get_concepts()
+    conn.get_concepts()
+
+    assert stub.requests.count(("GET", "/api/datasets/dataset1/concepts")) == 2
+
+
+def saved_query(query_id: str) -> dict:
+    return {"type": "SAVED_QUERY", "query": query_id}
+
+
+def test_explode_query(conquery_stub, conn):
+    stub, _ = conquery_stub
+    concept = {"type": "CONCEPT", "ids": ["dataset1.alter"], "tables": []}
+    inner_id = stub.add_query("dataset1", {"type": "CONCEPT_QUERY", "root": concept})
+    outer_id = stub.add_query("dataset1", {"type": "CONCEPT_QUERY", "root": {
+        "type": "OR", "children": [saved_query(inner_id), {"type": "NEGATION", "child": saved_query(inner_id)}]}})
+    query = {"type": "CONCEPT_QUERY", "root": {"type": "AND", "children": [saved_query(outer_id),
+                                                                           saved_query(inner_id)]}}
+
+    exploded = conn.explode_query(query)
+
+    assert exploded == {"type": "CONCEPT_QUERY", "root": {"type": "AND", "children": [
+        {"type": "OR", "children": [concept, {"type": "NEGATION", "child": concept}]}, concept]}}
+    assert query["root"]["children"][0] == saved_query(outer_id)
+    for query_id in [inner_id, outer_id]:
+        assert stub.requests.count(("GET", f"/api/queries/{query_id}")) == 1
+
+
+def test_explode_query_cycle(conquery_stub, conn):
+    stub, _ = conquery_stub
+    first_id = stub.add_query("dataset1", {"type": "CONCEPT_QUERY", "root": saved_query("dataset1.query1")})
+    stub.add_query("dataset1", {"type": "CONCEPT_QUERY", "root": saved_query(first_id)})
+
+    with pytest.raises(ValueError):
+        conn.explode_query({"type": "CONCEPT_QUERY", "root": saved_query(first_id)})
+
+
+def test_stored_queries_index(conquery_stub):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1")
+    stored_query_id = stub.add_query("dataset1", query, status="DONE")
+    stub.queries[stored_query_id]["label"] = "Alter"
+    list_request = ("GET", "/api/datasets/dataset1/queries")
+
+    assert conn.get_query_id("Alter") == stored_query_id
+    assert conn.get_stored_query_info(stored_query_id)["label"] == "Alter"
+    assert stub.requests.count(list_request) == 1
+
+    # executed and deleted queries are applied to the index
+    new_query_id = conn.execute_query(query, label="Neu")
+    assert conn.get_query_id("Neu") == new_query_id
+    conn.delete_stored_query(stored_query_id)
+    with pytest.raises(QueryNotFoundError):
+        conn.get_query_id("Alter")
+    assert stub.requests.count(list_request) == 2
+
+    # misses refresh the index, e.g. for queries created by others
+    other_query_id = stub.add_query("dataset1", query, status="DONE")
+    assert conn.get_stored_query_info(other_query_id)["id"] == other_query_id
+    assert conn.get_stored_query_info(None, label="Neu")["id"] == new_query_id
+    assert stub.requests.count(list_request) == 3
+
+
+def test_session_retries_idempotent_requests(conquery_stub):
+    stub, url = conquery_stub
+    session = ConqueryConnectionSession(token="token", retries=2, backoff_factor=0.01)
+
+    stub.failures["/api/datasets"] = 2
+    assert session.get_json(f"{url}/api/datasets")[0]["id"] == "dataset1"
+    assert stub.requests.count(("GET", "/api/datasets")) == 3
+
+    stub.failures["/api/datasets"] = 3
+    with pytest.raises(HTTPError):
+        session.get_json(f"{url}/api/datasets")
+
+    # posting a query is not idempotent
+    stub.failures["/api/datasets/dataset1/queries"] = 1
+    with pytest.raises(HTTPError):
+        session.post(f"{url}/api/datasets/dataset1/queries", query)
+    assert not stub.queries
+
+
+def test_session_drops_sessions_of_ended_threads(conquery_stub):
+    stub, url = conquery_stub
+    session = ConqueryConnectionSession(token="token")
+
+    for _ in range(20):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: session.get_json(f"{url}/api/datasets"), range(8)))
+    gc.collect()
+
+    assert len(session._sessions) == 0
+    session.close()
+
+
+def test_connection_shared_by_threads(conquery_stub):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1", pool_maxsize=16,
+                              waiter=QueryWaiter(initial_interval=0.01, max_interval=0.01, jitter=0))
+
+    def execute_and_get_result(i: int):
+        if i % 8 == 0:
+            conn.update_token(f"token{i}")
+        query_id = conn.execute_query(query, label=f"Abfrage {i}")
+        return query_id, conn.get_query_result(query_id, return_type="arrow")
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(execute_and_get_result, range(64)))
+
+    assert len({query_id for query_id, _ in results}) == 64
+    assert all(result.equals(stub.result_table) for _, result in results)
+    assert {stub.queries[query_id]["label"] for query_id, _ in results} == {f"Abfrage {i}" for i in range(64)}
+
+
+def test_delete_stored_queries(conquery_stub):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1")
+    old_ids = [stub.add_query("dataset1", query, status="DONE") for _ in range(10)]
+    new_id = stub.add_query("dataset1", query, status="DONE")
+    other_id = stub.add_query("dataset1", query, status="DONE")
+    for query_id in [*old_ids, new_id]:
+        stub.queries[query_id].update(label=f"tmp_{query_id}", createdAt="2020-01-01T10:00:00+01:00")
+    stub.queries[new_id]["createdAt"] = pd.Timestamp.now(tz="Europe/Berlin").isoformat()
+
+    report = conn.delete_stored_queries(label_pattern="^tmp_", older_than=timedelta(days=1), max_workers=4)
+
+    assert sorted(report.deleted) == sorted(old_ids)
+    assert report.failed == dict()
+    assert report.throughput > 0
+    assert set(stub.queries) == {new_id, other_id}
+
+    report = conn.delete_stored_queries([new_id, "dataset1.unknown"])
+    assert report.deleted == [new_id]
+    assert list(report.failed) == ["dataset1.unknown"]
+
+    with pytest.raises(ValueError):
+        conn.delete_stored_queries()
+    assert conn.delete_stored_queries(all_queries=True).deleted == [other_id]
+    assert not stub.queries
+
+
+def test_query_registry_reuses_done_queries(conquery_stub, tmp_path):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1",
+                              query_registry=QueryRegistry(path=str(tmp_path / "registry.json")))
+
+    query_id = conn.execute_query(query)
+    # still running, so it is executed again
+    running_query_id = conn.execute_query(query)
+    assert running_query_id != query_id
+
+    stub.queries[running_query_id]["status"] = "DONE"
+    assert conn.execute_query(query) == running_query_id
+    assert conn.execute_query(query, dataset="dataset2") != running_query_id
+
+    conn.delete_stored_query(running_query_id)
+    assert conn.execute_query(query) not in {query_id, running_query_id}
+
+
+def test_query_registry_does_not_relabel_queries(conquery_stub):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1", query_registry=QueryRegistry())
+
+    query_id = conn.execute_query(query, label="Alter")
+    stub.queries[query_id]["status"] = "DONE"
+
+    assert conn.execute_query(query) == query_id
+    assert conn.execute_query(query, label="Alter") == query_id
+    other_query_id = conn.execute_query(query, label="Andere")
+    assert other_query_id != query_id
+    assert stub.queries[query_id]["label"] == "Alter"
+    assert stub.queries[other_query_id]["label"] == "Andere"
+    assert conn.get_query_id("Alter") == query_id
+
+
+def test_execute_query_posts_current_state(conquery_stub, tmp_path):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1",
+                              query_registry=QueryRegistry(path=str(tmp_path / "registry.json")))
+    query_obj = create_query_obj(query)
+    query_id = conn.execute_query(query_obj)
+
+    query_obj.root.ids.append(concept_id_from_str("dataset1.geschlecht"))
+    new_query_id = conn.execute_query(query_obj)
+    assert new_query_id != query_id
+    assert stub.queries[new_query_id]["query"]["root"]["ids"] == ["dataset1.alter", "dataset1.geschlecht"]
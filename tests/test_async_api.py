@@ -0,0 +1,75 @@
+import asyncio
+
+from cqapi.async_api import AsyncConqueryConnection
+from cqapi.waiter import QueryWaiter
+
+query = {"type": "CONCEPT_QUERY", "root": {"type": "CONCEPT", "ids": ["dataset1.alter"], "tables": []}}
+
+
+def fast_waiter():
+    return QueryWaiter(initial_interval=0.01, max_interval=0.01, jitter=0)
+
+
+def test_execute_and_get_results(conquery_stub):
+    stub, url = conquery_stub
+
+    async def run():
+        async with AsyncConqueryConnection(url, token="token", dataset="dataset1", max_concurrency=4,
+                                           waiter=fast_waiter()) as cq:
+            query_ids = await asyncio.gather(*[cq.execute_query(query, label=f"query {i}") for i in range(10)])
+            results = await asyncio.gather(*[cq.get_query_result(query_id) for query_id in query_ids])
+            await asyncio.gather(*[cq.delete_stored_query(query_id) for query_id in query_ids])
+            return query_ids, results
+
+    query_ids, results = asyncio.run(run())
+
+    assert len(set(query_ids)) == 10
+    assert all(result["alter"].tolist() == [31, 42, 53] for result in results)
+    assert not stub.queries
+
+
+def test_concepts(conquery_stub):
+    stub, url = conquery_stub
+
+    async def run():
+        async with AsyncConqueryConnection(url, dataset="dataset1") as cq:
+            return await cq.get_concepts(), await cq.get_concept("dataset1.icd")
+
+    concepts, concept = asyncio.run(run())
+
+    assert list(concepts) == ["dataset1.alter"]
+    assert concept == stub.concept_trees["dataset1.icd"]
+
+
+def test_csv_result(conquery_stub):
+    stub, url = conquery_stub
+
+    async def run():
+        async with AsyncConqueryConnection(url, dataset="dataset1", waiter=fast_waiter()) as cq:
+            query_id = await cq.execute_query(query)
+            return await cq.get_query_result(query_id, file_format="csv", return_pandas=False)
+
+    assert asyncio.run(run()) == [["pid", "alter"], ["1", "31"], ["2", "42"], ["3", "53"]]
+
+
+def test_close_does_not_block_event_loop(conquery_stub):
+    stub, url = conquery_stub
+    events = []
+
+    async def run():
+        cq = AsyncConqueryConnection(url, dataset="dataset1")
+        request = asyncio.get_running_loop().create_task(cq.get_concepts())
+        await asyncio.sleep(0)
+
+        async def close():
+            await cq.aclose()
+            events.append("closed")
+
+        async def other():
+            events.append("other")
+
+        await asyncio.gather(close(), other())
+        return await request
+
+    assert list(asyncio.run(run())) == ["dataset1.alter"]
+    assert events == ["other", "closed"]
@@ -0,0 +1,189 @@
+import os
+
+from cqapi.cache import ResultCache, ConceptsCache, StoredQueriesCache, QueryRegistry
+
+query_info = {"id": "dataset1.query", "numberOfResults": 3, "finishTime": "2020-01-01T00:00:00"}
+
+
+def write(content: bytes):
+    return lambda file: file.write(content)
+
+
+def test_get_and_put(tmp_path):
+    cache = ResultCache(str(tmp_path))
+
+    assert cache.get("dataset1.query", "arrow", query_info) is None
+    path = cache.put("dataset1.query", "arrow", query_info, write(b"result"))
+
+    assert cache.get("dataset1.query", "arrow", query_info) == path
+    assert open(path, "rb").read() == b"result"
+    assert cache.get("dataset1.query", "csv", query_info) is None
+
+
+def test_new_execution_replaces_result(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("dataset1.query", "arrow", query_info, write(b"old"))
+    new_query_info = {**query_info, "finishTime": "2020-01-02T00:00:00"}
+
+    assert cache.get("dataset1.query", "arrow", new_query_info) is None
+    path = cache.get_or_put("dataset1.query", "arrow", new_query_info, write(b"new"))
+
+    assert open(path, "rb").read() == b"new"
+    assert cache.get("dataset1.query", "arrow", query_info) is None
+    assert cache.size() == 3
+
+
+def test_invalidate(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("dataset1.query", "arrow", query_info, write(b"result"))
+    cache.put("dataset1.query", "csv", query_info, write(b"result"))
+    cache.put("dataset1.query2", "csv", query_info, write(b"result"))
+
+    cache.invalidate("dataset1.query")
+
+    assert cache.get("dataset1.query", "arrow", query_info) is None
+    assert cache.get("dataset1.query", "csv", query_info) is None
+    assert cache.get("dataset1.query2", "csv", query_info) is not None
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10)
+    first = cache.put("dataset1.query1", "arrow", query_info, write(b"x" * 4))
+    cache.put("dataset1.query2", "arrow", query_info, write(b"x" * 4))
+    os.utime(first, (0, 0))
+    cache.get("dataset1.query1", "arrow", query_info)
+
+    cache.put("dataset1.query3", "arrow", query_info, write(b"x" * 4))
+
+    assert cache.get("dataset1.query1", "arrow", query_info) is not None
+    assert cache.get("dataset1.query2", "arrow", query_info) is None
+    assert cache.size() == 8
+
+
+def test_failed_download_leaves_no_file(tmp_path):
+    cache = ResultCache(str(tmp_path))
+
+    def fail(file):
+        file.write(b"partial")
+        raise ConnectionError
+
+    try:
+        cache.put("dataset1.query", "arrow", query_info, fail)
+    except ConnectionError:
+        pass
+
+    assert os.listdir(tmp_path) == []
+
+
+class FakeResponse:
+    def __init__(self, value=None, status_code=200, headers=None):
+        self.value = value
+        self.status_code = status_code
+        self.headers = headers or dict()
+
+    def json(self):
+        return self.value
+
+
+def test_concepts_cache_ttl(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("cqapi.cache.monotonic", lambda: now[0])
+    cache = ConceptsCache(ttl=10)
+    fetched = []
+
+    def fetch(headers):
+        fetched.append(headers)
+        return FakeResponse({"concepts": len(fetched)})
+
+    assert cache.get("url", "dataset1", fetch) == {"concepts": 1}
+    now[0] = 9
+    assert cache.get("url", "dataset1", fetch) == {"concepts": 1}
+    now[0] = 11
+    assert cache.get("url", "dataset1", fetch) == {"concepts": 2}
+    assert fetched == [{}, {}]
+
+
+def test_concepts_cache_revalidation(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("cqapi.cache.monotonic", lambda: now[0])
+    cache = ConceptsCache(ttl=10)
+    responses = [FakeResponse({"concepts": 1}, headers={"ETag": '"v1"', "Last-Modified": "yesterday"}),
+                 FakeResponse(status_code=304)]
+    fetched = []
+
+    def fetch(headers):
+        fetched.append(headers)
+        return responses.pop(0)
+
+    cache.get("url", "dataset1", fetch)
+    now[0] = 20
+    assert cache.get("url", "dataset1", fetch) == {"concepts": 1}
+    assert fetched[1] == {"If-None-Match": '"v1"', "If-Modified-Since": "yesterday"}
+    # revalidation restarts the ttl
+    now[0] = 25
+    assert cache.get("url", "dataset1", fetch) == {"concepts": 1}
+
+
+def test_concepts_cache_invalidate():
+    cache = ConceptsCache()
+    cache.get("url1", "dataset1", lambda headers: FakeResponse(1))
+    cache.get("url2", "dataset2", lambda headers: FakeResponse(2))
+
+    cache.invalidate("dataset1")
+
+    assert cache.get("url1", "dataset1", lambda headers: FakeResponse(3)) == 3
+    assert cache.get("url2", "dataset2", lambda headers: FakeResponse(4)) == 2
+
+    cache.invalidate()
+    assert cache.get("url2", "dataset2", lambda headers: FakeResponse(5)) == 5
+
+
+def test_stored_queries_cache_set_label():
+    cache = StoredQueriesCache()
+    cache.put("dataset1", [{"id": "dataset1.query", "label": "Alt"}])
+
+    def fetch():
+        raise AssertionError("index must not be downloaded")
+
+    cache.set_label("dataset1", "dataset1.query", "Neu")
+    cache.add("dataset1", "dataset1.other")
+    cache.set_label("dataset1", "dataset1.other", "Neu")
+
+    assert cache.get_ids("dataset1", "Neu", fetch) == ["dataset1.query", "dataset1.other"]
+    assert cache.get_info("dataset1", "dataset1.query", fetch)["label"] == "Neu"
+    assert cache.get_ids("dataset1", "Alt", lambda: []) == []
+
+
+def test_query_registry_key():
+    query = {"type": "CONCEPT_QUERY", "root": {"type": "CONCEPT", "ids": ["dataset1.alter"]}}
+    reordered_query = {"root": {"ids": ["dataset1.alter"], "type": "CONCEPT"}, "type": "CONCEPT_QUERY"}
+
+    assert QueryRegistry.key(query, "dataset1") == QueryRegistry.key(reordered_query, "dataset1")
+    assert QueryRegistry.key(query, "dataset1") != QueryRegistry.key(query, "dataset2")
+
+
+def test_query_registry_is_shared_by_file(tmp_path):
+    path = str(tmp_path / "registry.json")
+    registry = QueryRegistry(path=path)
+    other_registry = QueryRegistry(path=path)
+
+    registry.put("key1", "dataset1.query1")
+    other_registry.put("key2", "dataset1.query2")
+    assert registry.get("key2") == "dataset1.query2"
+    assert other_registry.get("key1") == "dataset1.query1"
+
+    other_registry.remove_query_id("dataset1.query1")
+    assert registry.get("key1") is None
+    assert [file_name for file_name in os.listdir(tmp_path)] == ["registry.json"]
+
+
+def test_query_registry_max_age(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("cqapi.cache.time", lambda: now[0])
+    registry = QueryRegistry(max_age=60)
+
+    registry.put("key", "dataset1.query")
+    now[0] += 59
+    assert registry.get("key") == "dataset1.query"
+    now[0] += 2
+    assert registry.get("key") is None
@@ -0,0 +1,77 @@
+import pytest
+
+from cqapi.catalogue import get_catalogue, concept_id_of
+from cqapi.conquery_ids import ConqueryIdCollection, ConceptId, SelectId, FilterId
+from cqapi.search_conquery_id import id_to_label
+from cqapi.user_editor import Concepts
+
+concepts = {
+    "dataset1.icd": {
+        "label": "ICD", "active": True,
+        "selects": [{"id": "dataset1.icd.exists", "label": "Existenz", "default": True}],
+        "tables": [
+            {"connectorId": "dataset1.icd.arzt", "label": "Arzt", "default": True,
+             "selects": [{"id": "dataset1.icd.arzt.anzahl", "label": "Anzahl", "default": True},
+                         {"id": "dataset1.icd.arzt.erster", "label": "Erster"}],
+             "filters": [{"id": "dataset1.icd.arzt.sicherheit", "label": "Sicherheit"}],
+             "dateColumn": {"options": [{"value": "dataset1.icd.arzt.datum", "label": "Datum"}]}},
+            {"connectorId": "dataset1.icd.kh", "label": "Krankenhaus",
+             "selects": [{"id": "dataset1.icd.kh.anzahl", "label": "Anzahl", "default": True}],
+             "filters": [], "dateColumn": None}]}}
+
+
+def test_concept_id_of():
+    assert concept_id_of("dataset1.icd.arzt.anzahl") == "dataset1.icd"
+    assert concept_id_of("dataset1.icd") == "dataset1.icd"
+
+
+def test_catalogue_is_cached_per_concepts_object():
+    assert get_catalogue(concepts) is get_catalogue(concepts)
+    assert get_catalogue(dict(concepts)) is not get_catalogue(concepts)
+
+
+def test_labels():
+    catalogue = get_catalogue(concepts)
+
+    assert catalogue.connector_label("dataset1.icd.kh") == "Krankenhaus"
+    assert catalogue.connector_select_label("dataset1.icd.arzt", "dataset1.icd.arzt.erster") == "Erster"
+    assert catalogue.filter_label("dataset1.icd.arzt", "dataset1.icd.arzt.sicherheit") == "Sicherheit"
+    assert catalogue.date_column_label("dataset1.icd.arzt", "dataset1.icd.arzt.datum") == "Datum"
+    assert catalogue.get_connector("dataset1.icd.unknown") is None
+    with pytest.raises(ValueError):
+        catalogue.connector_select_label("dataset1.icd.kh", "dataset1.icd.arzt.erster")
+
+
+def test_defaults():
+    concepts_obj = Concepts(concepts=concepts)
+
+    assert concepts_obj.get_default_connectors("dataset1.icd") == ["dataset1.icd.arzt"]
+    assert concepts_obj.get_default_concept_selects("dataset1.icd") == ["dataset1.icd.exists"]
+    assert concepts_obj.get_default_connector_selects("dataset1.icd") == ["dataset1.icd.arzt.anzahl"]
+    assert concepts_obj.get_default_connector_selects("dataset1.icd", ["dataset1.icd.kh", "dataset1.icd.arzt"]) == \
+        ["dataset1.icd.arzt.anzahl", "dataset1.icd.kh.anzahl"]
+
+
+def test_id_to_label():
+    assert id_to_label("dataset1.icd", concepts, "concept") == "ICD"
+    assert id_to_label("dataset1.icd.a00.a01", concepts, "child") == "ICD - a00 - a01"
+    assert id_to_label("dataset1.icd.exists", concepts, "concept_select") == "ICD - Existenz"
+    assert id_to_label("dataset1.icd.arzt.anzahl", concepts, "select") == "ICD - Arzt - Anzahl"
+    assert id_to_label("dataset1.icd.arzt.sicherheit", concepts, "filter") == "ICD - Arzt - Sicherheit"
+
+
+def test_collection_label_table():
+    ids = ConqueryIdCollection([ConceptId.from_str("dataset1.icd"),
+                                SelectId.from_str("dataset1.icd.arzt.anzahl"),
+                                SelectId.from_str("dataset1.icd.exists"),
+                                FilterId.from_str("dataset1.icd.arzt.unknown")])
+
+    assert ids.create_label_dicts(concepts)["connector_select"] == \
+        {"dataset1.icd.arzt.anzahl": "ICD - Arzt - Anzahl"}
+
+    table = ids.create_label_table(concepts)
+    assert table.to_dict(orient="records") == [
+        {"id": "dataset1.icd", "type": "concept", "label": "ICD"},
+        {"id": "dataset1.icd.arzt.anzahl", "type": "connector_select", "label": "ICD - Arzt - Anzahl"},
+        {"id": "dataset1.icd.arzt.unknown", "type": "filter", "label": None},
+        {"id": "dataset1.icd.exists", "type": "concept_select", "label": "ICD - Existenz"}]
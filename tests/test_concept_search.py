@@ -0,0 +1,91 @@
+from cqapi.api import ConqueryConnection
+from cqapi.concept_search import ConceptSearchIndex, tokenize
+from cqapi.user_editor import Concepts
+
+tree = {
+    "dataset1.icd": {"label": "ICD", "description": None, "children": ["dataset1.icd.e10-e14"]},
+    "dataset1.icd.e10-e14": {"label": "Diabetes mellitus", "description": "E10-E14",
+                             "children": ["dataset1.icd.e10-e14.e10", "dataset1.icd.e10-e14.e11"]},
+    "dataset1.icd.e10-e14.e10": {"label": "E10", "description": "Primär insulinabhängiger Diabetes mellitus "
+                                                                "[Typ-1-Diabetes]", "children": []},
+    "dataset1.icd.e10-e14.e11": {"label": "E11", "description": "Nicht primär insulinabhängiger Diabetes mellitus "
+                                                                "[Typ-2-Diabetes]", "children": []},
+}
+
+
+def search_ids(index, value, limit=None):
+    return [node_id for _, node_id, _ in index.search(value, limit=limit)]
+
+
+def test_tokenize():
+    assert tokenize("Typ-2-Diabetes [E11]") == ["typ", "2", "diabetes", "e11"]
+    assert tokenize(None) == []
+
+
+def test_search_ranking():
+    index = ConceptSearchIndex(tree, "dataset1.icd")
+
+    assert len(index) == 4
+    # label matches before description matches
+    assert search_ids(index, "e10") == ["dataset1.icd.e10-e14.e10", "dataset1.icd.e10-e14"]
+    assert search_ids(index, "e1") == ["dataset1.icd.e10-e14.e10", "dataset1.icd.e10-e14.e11",
+                                       "dataset1.icd.e10-e14"]
+    # equal scores keep the tree order
+    assert search_ids(index, "diabetes") == ["dataset1.icd.e10-e14", "dataset1.icd.e10-e14.e10",
+                                             "dataset1.icd.e10-e14.e11"]
+    assert search_ids(index, "diabetes", limit=1) == ["dataset1.icd.e10-e14"]
+
+
+def test_search_all_tokens_have_to_match():
+    index = ConceptSearchIndex(tree, "dataset1.icd")
+
+    assert search_ids(index, "Typ 2 Diab") == ["dataset1.icd.e10-e14.e11"]
+    assert search_ids(index, "typ 3") == []
+
+
+def test_substring_fallback():
+    index = ConceptSearchIndex(tree, "dataset1.icd")
+
+    assert search_ids(index, "abhängiger") == ["dataset1.icd.e10-e14.e10", "dataset1.icd.e10-e14.e11"]
+
+
+def test_deep_tree():
+    deep_tree = {f"dataset1.deep.{depth}": {"label": f"Ebene {depth}", "children": [f"dataset1.deep.{depth + 1}"]}
+                 for depth in range(5000)}
+    deep_tree["dataset1.deep.5000"] = {"label": "Blatt", "children": []}
+
+    index = ConceptSearchIndex(deep_tree, "dataset1.deep.0")
+
+    assert search_ids(index, "blatt") == ["dataset1.deep.5000"]
+
+
+def test_search_index_is_kept_without_concepts_cache(conquery_stub):
+    stub, url = conquery_stub
+    stub.concept_trees["dataset1.icd"] = tree
+    conn = ConqueryConnection(url, token="token", dataset="dataset1", concepts_ttl=None)
+    concepts = Concepts(concepts={"dataset1.icd": {"label": "ICD", "active": True}})
+    concept_request = ("GET", "/api/concepts/dataset1.icd")
+
+    first_index = concepts._get_search_index("dataset1.icd", conn=conn)
+    assert concepts._get_search_index("dataset1.icd", conn=conn) is first_index
+    concepts.search_concept("icd", "diabetes", conn=conn)
+    assert stub.requests.count(concept_request) == 1
+
+    concepts.search_concept("icd", "diabetes", conn=conn, refresh=True)
+    assert stub.requests.count(concept_request) == 2
+    assert concepts._get_search_index("dataset1.icd", conn=conn) is not first_index
+
+
+def test_search_index_refresh_with_concepts_cache(conquery_stub):
+    stub, url = conquery_stub
+    stub.concept_trees["dataset1.icd"] = tree
+    conn = ConqueryConnection(url, token="token", dataset="dataset1")
+    concepts = Concepts(concepts={"dataset1.icd": {"label": "ICD", "active": True}})
+    concept_request = ("GET", "/api/concepts/dataset1.icd")
+
+    first_index = concepts._get_search_index("dataset1.icd", conn=conn)
+    assert concepts._get_search_index("dataset1.icd", conn=conn) is first_index
+    assert stub.requests.count(concept_request) == 1
+
+    assert concepts._get_search_index("dataset1.icd", conn=conn, refresh=True) is not first_index
+    assert stub.requests.count(concept_request) == 2
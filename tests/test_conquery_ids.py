@@ -1,5 +1,10 @@
+import gc
+import pickle
+from copy import deepcopy
+from cqapi import conquery_ids
 from cqapi.conquery_ids import ConqueryIdCollection, DatasetId, ConceptId, ConnectorId, SelectId, DateId, \
-    ChildId, DateId, get_dataset_from_id_string, get_copy_of_id_with_changed_dataset, FilterId, ChildId
+    ChildId, DateId, get_dataset_from_id_string, get_copy_of_id_with_changed_dataset, FilterId, ChildId, \
+    ConqueryId, concept_id_from_str
 import pytest
 from cqapi.datasets import set_test_datasets
 set_test_datasets()
@@ -106,8 +111,9 @@ def test_is_in_id_list():
 
 def test_change_dataset():
     concept_id = ConceptId("concept", DatasetId("dataset1"))
-    concept_id.change_dataset(new_dataset="dataset2")
-    assert concept_id.get_dataset() == "dataset2"
+    new_concept_id = concept_id.change_dataset(new_dataset="dataset2")
+    assert new_concept_id.get_dataset() == "dataset2"
+    assert concept_id.get_dataset() == "dataset1"
 
 
 def test_from_str():
@@ -151,3 +157,107 @@ def test_label():
     ids.print_id_labels_as_table(concepts=concepts)
 
 
+
+
+def test_ids_are_interned():
+    select_id = SelectId("sel", ConnectorId("conn", ConceptId("concept", DatasetId("dataset1"))))
+
+    assert SelectId.from_str("dataset1.concept.conn.sel") is select_id
+    assert deepcopy(select_id) is select_id
+    assert pickle.loads(pickle.dumps(select_id)) is select_id
+    assert hash(select_id) == hash("dataset1.concept.conn.sel")
+
+
+def test_parsing_reuses_shared_bases(monkeypatch):
+    created = []
+    intern_id = conquery_ids._intern_id
+    monkeypatch.setattr(conquery_ids, "_intern_id", lambda cls, name, base: created.append(name) or
+                        intern_id(cls, name, base))
+
+    child_ids = [ChildId.from_str(f"dataset7.icd.a00.b{i}") for i in range(100)]
+
+    # the leaves and the bases dataset7, dataset7.icd and dataset7.icd.a00 once
+    assert len(created) == 103
+    assert all(child_id.base is child_ids[0].base for child_id in child_ids)
+
+
+def test_dead_ids_are_removed_from_the_intern_table():
+    for i in range(5000):
+        SelectId.from_str(f"dataset8.concept.conn.sel{i}")
+    conquery_ids._parse_id.cache_clear()
+    gc.collect()
+
+    ConceptId("concept", DatasetId("dataset8"))
+    for i in range(5000):
+        SelectId(f"other{i}", ConnectorId("conn", ConceptId("concept", DatasetId("dataset8"))))
+
+    assert len(conquery_ids._interned_ids) < 10000
+
+
+def test_ids_are_immutable():
+    concept_id = ConceptId("concept", DatasetId("dataset1"))
+
+    with pytest.raises(AttributeError):
+        concept_id.name = "other"
+
+    assert concept_id.rename_concept_id("other") == ConceptId("other", DatasetId("dataset1"))
+    assert concept_id.id == "dataset1.concept"
+
+
+def test_from_str_type_hints():
+    assert ConqueryId.from_str("dataset1.concept.conn.sel", type_hint="select") == \
+        SelectId("sel", ConnectorId("conn", ConceptId("concept", DatasetId("dataset1"))))
+    assert isinstance(ConqueryId.from_str("dataset1.concept.a.b", type_hint="child").base, ChildId)
+    with pytest.raises(ValueError):
+        ConqueryId.from_str("dataset1.concept", type_hint="unknown")
+    with pytest.raises(ValueError):
+        FilterId.from_str("dataset1.concept.conn")
+
+
+def test_from_strs():
+    concept_id = ConceptId("concept", DatasetId("dataset1"))
+
+    assert SelectId.from_strs(["dataset1.concept.sel", SelectId("sel2", concept_id)]) == \
+        [SelectId("sel", concept_id), SelectId("sel2", concept_id)]
+    assert concept_id_from_str("dataset1.concept") is concept_id
+    assert isinstance(concept_id_from_str("dataset1.concept.child"), ChildId)
+
+
+def test_change_dataset_of_nested_id():
+    select_id = SelectId.from_str("dataset1.concept.conn.sel")
+
+    new_select_id = get_copy_of_id_with_changed_dataset(new_dataset="dataset2", conquery_id=select_id)
+
+    assert new_select_id.id == "dataset2.concept.conn.sel"
+    assert isinstance(new_select_id.base, ConnectorId)
+    assert new_select_id is SelectId.from_str("dataset2.concept.conn.sel")
+    assert select_id.change_dataset("dataset1") is select_id
+
+
+def test_collection_trie_queries():
+    icd = ConceptId.from_str("dataset1.icd")
+    a00 = ChildId.from_str("dataset1.icd.a00")
+    a00_1 = ChildId.from_str("dataset1.icd.a00.a00_1")
+    a0 = ChildId.from_str("dataset1.icd.a0")
+    ids = ConqueryIdCollection([a00, a0])
+
+    assert a00_1.is_child_of_any(ids)
+    assert not icd.is_child_of_any(ids)
+    assert a00.is_in_id_list(ids)
+    assert set(ids.get_descendants(icd)) == {a00, a0}
+    assert ids.get_descendants(a00) == [a00]
+
+    ids.add(a00_1)
+    ids.remove(a00)
+    assert a00_1.is_child_of_any(ids)
+    assert not ChildId.from_str("dataset1.icd.a00.a00_2").is_child_of_any(ids)
+
+
+def test_collection_set_algebra():
+    first = ConqueryIdCollection([ConceptId.from_str("dataset1.icd"), ConceptId.from_str("dataset1.atc")])
+    second = ConqueryIdCollection([ConceptId.from_str("dataset1.atc")])
+
+    assert len(first | second) == 2
+    assert first & second == second
+    assert list(first - second) == [ConceptId.from_str("dataset1.icd")]
+    assert (second - first).is_empty()
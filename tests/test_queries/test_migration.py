@@ -0,0 +1,75 @@
+from cqapi import ConqueryConnection
+from cqapi.queries.migration import migrate_stored_queries, read_checkpoint
+from tests.test_queries.test_translation import icd_object
+
+
+def concept_query(concept_id: str) -> dict:
+    return {"type": "CONCEPT_QUERY",
+            "root": {"type": "CONCEPT", "ids": [concept_id], "tables": [{"id": "dataset1.icd.kh_diagnose_icd_code"}]}}
+
+
+def set_up_stub(stub):
+    stub.concept_trees["dataset3.icd"] = {"dataset3.icd": {}, "dataset3.icd.c00-d48": {},
+                                          "dataset3.icd.c00-d48.c00": {}}
+    translatable_id = stub.add_query("dataset1", concept_query("dataset1.icd.c00-d48.c00"), status="DONE")
+    stub.queries[translatable_id]["label"] = "Krebs"
+    missing_child_id = stub.add_query("dataset1", concept_query("dataset1.icd.c00-d48.c01"), status="DONE")
+    return translatable_id, missing_child_id
+
+
+def test_migrate_stored_queries(conquery_stub, tmp_path):
+    stub, url = conquery_stub
+    translatable_id, missing_child_id = set_up_stub(stub)
+    conn = ConqueryConnection(url, token="token", dataset="dataset1")
+    checkpoint_path = str(tmp_path / "migration.jsonl")
+
+    reports = {report.query_id: report
+               for report in migrate_stored_queries("dataset1", "dataset3", conn, concepts_new_dataset={
+                   "dataset3.icd": icd_object}, checkpoint_path=checkpoint_path, max_processes=1, chunk_size=1)}
+
+    assert reports[translatable_id].succeeded
+    new_query = stub.queries[reports[translatable_id].new_query_id]
+    assert new_query["query"]["root"]["ids"] == ["dataset3.icd.c00-d48.c00"]
+    assert new_query["label"] == "Krebs"
+
+    assert not reports[missing_child_id].succeeded
+    assert reports[missing_child_id].removed_ids == ["dataset1.icd.c00-d48.c01"]
+    assert stub.requests.count(("GET", "/api/concepts/dataset3.icd")) == 1
+
+    assert read_checkpoint(checkpoint_path) == reports
+
+
+def test_migrate_stored_queries_resumes_from_checkpoint(conquery_stub, tmp_path):
+    stub, url = conquery_stub
+    translatable_id, missing_child_id = set_up_stub(stub)
+    conn = ConqueryConnection(url, token="token", dataset="dataset1")
+    checkpoint_path = str(tmp_path / "migration.jsonl")
+
+    migration = migrate_stored_queries([translatable_id, missing_child_id], "dataset3", conn,
+                                       concepts_new_dataset={"dataset3.icd": icd_object},
+                                       checkpoint_path=checkpoint_path, max_processes=0, chunk_size=1)
+    first_report = next(migration)
+    migration.close()
+    assert first_report.query_id == translatable_id
+
+    reports = list(migrate_stored_queries([translatable_id, missing_child_id], "dataset3", conn,
+                                          concepts_new_dataset={"dataset3.icd": icd_object},
+                                          checkpoint_path=checkpoint_path, max_processes=0))
+
+    assert [report.query_id for report in reports] == [missing_child_id]
+    assert set(read_checkpoint(checkpoint_path)) == {translatable_id, missing_child_id}
+
+
+def test_migration_reports_parse_errors(conquery_stub):
+    stub, url = conquery_stub
+    translatable_id, _ = set_up_stub(stub)
+    unknown_type_id = stub.add_query("dataset1", {"type": "UNKNOWN"}, status="DONE")
+    conn = ConqueryConnection(url, token="token", dataset="dataset1")
+
+    reports = {report.query_id: report
+               for report in migrate_stored_queries([translatable_id, unknown_type_id], "dataset3", conn,
+                                                    concepts_new_dataset={"dataset3.icd": icd_object},
+                                                    max_processes=0)}
+
+    assert reports[translatable_id].succeeded
+    assert reports[unknown_type_id].error == "ValueError: Could not find query_type UNKNOWN"
@@ -0,0 +1,114 @@
+import copy
+import pickle
+from timeit import timeit
+
+from cqapi.conquery_ids import SelectId
+from cqapi.queries import base_elements, serialization
+from cqapi.queries.base_elements import ConceptElement, AndElement, OrElement, create_query_obj
+from cqapi.queries.serialization import canonicalize, canonical_json
+
+concept = {"type": "CONCEPT", "ids": ["dataset1.icd.a00"], "label": "Cholera",
+           "tables": [{"id": "dataset1.icd.arzt",
+                       "filters": [{"filter": "dataset1.icd.arzt.sicherheit", "type": "MULTI_SELECT",
+                                    "value": ["G"], "unit": None}]}]}
+
+
+def test_canonicalize():
+    assert canonicalize({"b": 1, "a": {"d": None, "c": [{"f": None, "e": 2}]}}) == {"a": {"c": [{"e": 2}]}, "b": 1}
+    assert list(canonicalize({"b": 1, "a": 2})) == ["a", "b"]
+    assert canonical_json({"b": "Ä", "a": [1, 2.5, None]}) == '{"a":[1,2.5,null],"b":"Ä"}'.encode()
+
+
+def test_json_fallback_is_identical(monkeypatch):
+    value = canonicalize(AndElement(children=[ConceptElement.from_dict(concept)] * 2).to_dict())
+    orjson_bytes = serialization.dumps(value)
+
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert serialization.dumps(value) == orjson_bytes
+
+
+def test_equality_and_hash():
+    query = AndElement(children=[ConceptElement.from_dict(concept), ConceptElement.from_dict(concept)])
+    other_query = create_query_obj(query.to_dict())
+
+    assert query == other_query
+    assert hash(query) == hash(other_query)
+    assert len({query, other_query}) == 1
+    assert query != AndElement(children=[ConceptElement.from_dict(concept)])
+
+
+def test_cached_json_is_invalidated_on_mutation():
+    concept_element = ConceptElement.from_dict(concept)
+    query = AndElement(children=[concept_element])
+    original_json = query.canonical_json()
+    assert query.canonical_json() is original_json
+
+    concept_element.add_concept_select(SelectId.from_str("dataset1.icd.exists"))
+    assert b'"selects":["dataset1.icd.exists"]' in query.canonical_json()
+
+    concept_element.tables[0].add_select(SelectId.from_str("dataset1.icd.arzt.anzahl"))
+    assert b"dataset1.icd.arzt.anzahl" in query.canonical_json()
+
+    concept_element.set_label("Cholera (A00)")
+    assert b"Cholera (A00)" in query.canonical_json()
+
+
+def test_cached_json_is_invalidated_on_in_place_changes():
+    query = AndElement(children=[ConceptElement.from_dict(concept)])
+    query.canonical_json()
+
+    query.children.append(ConceptElement.from_dict(concept))
+    assert query.canonical_json() == canonical_json(query.to_dict())
+
+    query.children[0].tables[0].filters[0]["value"] = ["V"]
+    assert b'"value":["V"]' in query.canonical_json()
+    assert query.canonical_json() == canonical_json(query.to_dict())
+
+
+def large_query() -> AndElement:
+    return AndElement(children=[OrElement(children=[ConceptElement.from_dict(concept) for _ in range(10)])
+                                for _ in range(50)])
+
+
+def test_cached_equality_and_hash_do_not_walk_the_query(monkeypatch):
+    query, other_query = large_query(), large_query()
+    assert query == other_query
+
+    to_dict_calls = []
+    for cls in (AndElement, OrElement, ConceptElement):
+        monkeypatch.setattr(cls, "to_dict", lambda self: to_dict_calls.append(self))
+    monkeypatch.setattr(base_elements, "start_tracking", lambda obj: to_dict_calls.append(obj))
+
+    assert query == other_query
+    assert hash(query) == hash(other_query)
+    assert not to_dict_calls
+    monkeypatch.undo()
+
+    # a cached hash costs far less than serializing the query
+    assert min(timeit(lambda: hash(query), number=100) for _ in range(3)) < timeit(query.to_dict, number=10)
+
+
+def test_nested_changes_invalidate_the_cache():
+    query = large_query()
+    other_query = large_query()
+    assert query == other_query
+
+    query.children[3].children[2].tables[0].filters[0]["value"].append("V")
+    assert query != other_query
+    assert query.canonical_json() == canonical_json(query.to_dict())
+
+    query.children[3].children[2].tables[0].filters[0]["value"].remove("V")
+    assert query == other_query
+
+
+def test_copies_are_tracked_independently():
+    query = large_query()
+    query.canonical_json()
+
+    for copied_query in (copy.deepcopy(query), pickle.loads(pickle.dumps(query))):
+        assert copied_query == query
+        copied_query.canonical_json()
+        copied_query.children[0].children.pop()
+        assert copied_query != query
+        assert copied_query.canonical_json() == canonical_json(copied_query.to_dict())
+        assert len(query.children[0].children) == 10
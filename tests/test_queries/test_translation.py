@@ -1,7 +1,7 @@
 from copy import deepcopy
 import pytest
 from cqapi.queries.base_elements import ConceptQuery, ConceptElement
-from cqapi.queries.translation import translate_query
+from cqapi.queries.translation import translate_query, translate_queries
 import json
 from cqapi import ConqueryConnection
 import cqapi.datasets
@@ -201,3 +201,32 @@ def test_translate_query():
         output_new_query["selects"] = ["dataset3.icd.exists"]
         assert query_new_val == new_query.to_dict()
         assert query_old_val == old_query.to_dict()
+
+
+class FakeConnection:
+    """Returns concept trees and counts the requests per root concept"""
+
+    def __init__(self, concept_trees: dict):
+        self.concept_trees = concept_trees
+        self.requested = list()
+
+    def get_concept(self, concept_id):
+        self.requested.append(concept_id)
+        return self.concept_trees[concept_id]
+
+
+def test_translate_queries_requests_each_root_concept_once():
+    concepts_new_dataset = {"dataset3.icd": icd_object}
+    conn = FakeConnection({"dataset3.icd": {"dataset3.icd": {}, "dataset3.icd.c00-d48": {},
+                                            "dataset3.icd.c00-d48.c00": {}}})
+    queries = [ConceptElement.from_dict({"type": "CONCEPT", "ids": [child_id],
+                                         "tables": [{"id": "dataset1.icd.kh_diagnose_icd_code"}]})
+               for child_id in ["dataset1.icd.c00-d48.c00", "dataset1.icd.c00-d48.c01", "dataset1.icd.c00-d48"]]
+
+    new_queries, remaining_queries, removed_ids = translate_queries(queries, concepts_new_dataset, conn,
+                                                                    return_removed_ids=True)
+
+    assert conn.requested == ["dataset3.icd"]
+    assert [query.to_dict()["ids"] for query in new_queries] == [["dataset3.icd.c00-d48.c00"],
+                                                                 ["dataset3.icd.c00-d48"]]
+    assert [conquery_id.id for conquery_id in removed_ids] == ["dataset1.icd.c00-d48.c01"]
@@ -0,0 +1,78 @@
+import json
+import os
+import zipfile
+
+import pytest
+
+from cqapi.snapshot import ConceptsSnapshot, write_concepts_snapshot, get_snapshot_path
+from cqapi.user_editor import Concepts, Conquery
+
+concepts = {"dataset1.alter": {"label": "Alter", "active": True, "selects": [],
+                               "tables": [{"connectorId": "dataset1.alter.alter", "default": True, "selects": []}]},
+            "dataset1.icd": {"label": "ICD", "active": True, "selects": [], "tables": []},
+            "dataset1.struc": {"label": "Struktur", "active": False, "children": ["dataset1.alter", "dataset1.icd"]}}
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.zip")
+    write_concepts_snapshot(path, concepts=concepts, dataset="dataset1")
+
+    snapshot = ConceptsSnapshot(path)
+
+    assert snapshot.dataset == "dataset1"
+    assert snapshot.is_valid_for("dataset1", max_age=60)
+    assert not snapshot.is_valid_for("dataset2")
+    assert snapshot.labels["dataset1.struc"] == "Struktur"
+    assert dict(snapshot.concepts(active=True)) == {key: value for key, value in concepts.items()
+                                                    if value["active"]}
+    assert list(snapshot.concepts(active=False)) == ["dataset1.struc"]
+
+
+def test_snapshot_is_lazy(tmp_path):
+    path = str(tmp_path / "snapshot.zip")
+    write_concepts_snapshot(path, concepts=concepts, dataset="dataset1")
+
+    concepts_obj = Concepts.from_snapshot(ConceptsSnapshot(path))
+
+    assert concepts_obj.get_default_connectors("dataset1.alter") == ["dataset1.alter.alter"]
+    assert "dataset1.icd" in concepts_obj.concepts
+    assert list(concepts_obj.concepts.snapshot._loaded) == ["dataset1.struc", "dataset1.alter"]
+
+
+def test_snapshot_format_version(tmp_path):
+    path = str(tmp_path / "snapshot.zip")
+    with zipfile.ZipFile(path, mode="w") as archive:
+        archive.writestr("manifest.json", json.dumps({"formatVersion": 0}))
+
+    with pytest.raises(ValueError):
+        ConceptsSnapshot(path)
+
+
+def test_conquery_uses_snapshot(conquery_stub, tmp_path):
+    stub, url = conquery_stub
+
+    first = Conquery()
+    first.login(url=url, token="token", dataset="dataset1", concepts_snapshot_dir=str(tmp_path))
+    first._check_conn_and_concepts()
+    assert os.path.exists(get_snapshot_path(str(tmp_path), "dataset1"))
+
+    second = Conquery()
+    second.login(url=url, token="token", dataset="dataset1", concepts_snapshot_dir=str(tmp_path))
+    second._check_conn_and_concepts()
+
+    assert list(second.concepts.concepts) == ["dataset1.alter"]
+    assert stub.requests.count(("GET", "/api/datasets/dataset1/concepts")) == 1
+
+
+def test_new_query_with_snapshot(conquery_stub, tmp_path):
+    stub, url = conquery_stub
+    path = str(tmp_path / "snapshot.zip")
+    write_concepts_snapshot(path, concepts=concepts, dataset="dataset1")
+
+    cq = Conquery()
+    cq.login(url=url, token="token", dataset="dataset1")
+    cq.concepts = Concepts.from_snapshot(ConceptsSnapshot(path))
+
+    query = cq.new_query("alter")
+
+    assert query.query.to_dict()["ids"] == ["dataset1.alter"]
@@ -0,0 +1,44 @@
+import time
+
+from cqapi.api import ConqueryConnection
+
+query = {"type": "CONCEPT_QUERY", "root": {"type": "CONCEPT", "ids": ["dataset1.alter"], "tables": []}}
+
+
+def test_temporary_queries_are_deleted_on_exit(conquery_stub):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1")
+    before_id = conn.execute_query(query)
+
+    with conn.temporary_queries() as temporary_queries:
+        kept_id = conn.execute_query(query)
+        temporary_queries.keep(kept_id)
+        deleted_ids = [conn.execute_query(query) for _ in range(3)]
+        manually_deleted_id = conn.execute_query(query)
+        conn.delete_stored_query(manually_deleted_id)
+
+        dry_run_report = temporary_queries.delete(dry_run=True)
+        assert dry_run_report.dry_run
+        assert dry_run_report.deleted == deleted_ids
+        assert len(stub.queries) == 5
+
+    after_id = conn.execute_query(query)
+
+    assert sorted(temporary_queries.report.deleted) == sorted(deleted_ids)
+    assert temporary_queries.report.failed == dict()
+    assert set(stub.queries) == {before_id, kept_id, after_id}
+
+
+def test_sweeper_deletes_old_queries(conquery_stub):
+    stub, url = conquery_stub
+    conn = ConqueryConnection(url, token="token", dataset="dataset1")
+    tracker = conn.temporary_queries(max_age=0.05, sweep_interval=0.01)
+
+    query_id = conn.execute_query(query)
+    deadline = time.monotonic() + 5
+    while query_id in stub.queries and time.monotonic() < deadline:
+        time.sleep(0.01)
+    tracker.close()
+
+    assert query_id not in stub.queries
+    assert len(tracker) == 0
@@ -0,0 +1,74 @@
+import pytest
+
+import cqapi.waiter
+from cqapi.exceptions import QueryTimeoutError
+from cqapi.waiter import QueryWaiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(cqapi.waiter, "sleep", fake_clock.sleep)
+    monkeypatch.setattr(cqapi.waiter, "monotonic", fake_clock.monotonic)
+    return fake_clock
+
+
+def status_sequence(*statuses):
+    query_infos = iter([{"id": "dataset1.query", "status": status} for status in statuses])
+    return lambda: next(query_infos)
+
+
+def test_backoff_intervals(clock):
+    polls = []
+    waiter = QueryWaiter(initial_interval=1, max_interval=3, multiplier=2, jitter=0,
+                         on_poll=lambda n_polls, query_info: polls.append(n_polls))
+
+    query_info = waiter.wait(status_sequence("RUNNING", "RUNNING", "RUNNING", "RUNNING", "DONE"))
+
+    assert query_info["status"] == "DONE"
+    assert clock.sleeps == [1, 2, 3, 3]
+    assert polls == [1, 2, 3, 4, 5]
+
+
+def test_jitter_stays_in_bounds(clock):
+    waiter = QueryWaiter(initial_interval=1, max_interval=1, multiplier=1, jitter=0.5)
+    waiter.wait(status_sequence(*["RUNNING"] * 50, "FAILED"))
+
+    assert all(0.5 <= interval <= 1.5 for interval in clock.sleeps)
+
+
+def test_deadline(clock):
+    waiter = QueryWaiter(initial_interval=1, max_interval=1, multiplier=1, jitter=0, timeout=2.5)
+
+    with pytest.raises(QueryTimeoutError):
+        waiter.wait(status_sequence(*["RUNNING"] * 10))
+
+    assert clock.sleeps == [1, 1, 0.5]
+
+
+def test_timeout_is_an_exception(clock):
+    waiter = QueryWaiter(initial_interval=1, max_interval=1, multiplier=1, jitter=0, timeout=1)
+
+    with pytest.raises(Exception) as error:
+        waiter.wait(status_sequence(*["RUNNING"] * 10))
+
+    assert isinstance(error.value, QueryTimeoutError)
+    assert isinstance(error.value, TimeoutError)
+
+
+def test_with_rate(clock):
+    QueryWaiter.with_rate(4).wait(status_sequence("RUNNING", "RUNNING", "NEW"))
+    assert clock.sleeps == [0.25, 0.25]